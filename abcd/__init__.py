@@ -1 +1,2 @@
 from .backend import Direction
+from .database import Database, connect
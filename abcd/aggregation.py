@@ -0,0 +1,133 @@
+"""
+Statistics of keys over groups of configurations, as returned by
+:py:meth:`abcd.backend.Backend.aggregate`. There is one entry for each
+combination of values of the group_by keys:
+
+    {'group': {'config_type': 'bulk'},
+     'count': 120,
+     'stats': {'energy': {'count': 118, 'min': -10.2, 'max': -9.1,
+                          'mean': -9.8,
+                          'histogram': {'edges': [...], 'counts': [...]}}}}
+
+Statistics are of the numeric values of a key, other values are left out.
+Histograms of a key have the same bins in every group, spanning the values
+of all the selected configurations.
+
+aggregate_atoms works them out from Atoms objects; backends which can
+have the database do it use the other functions, so that their results
+are the same.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from ase.data import atomic_numbers
+from six import string_types
+
+from .filtering import atoms_value, element_count_key
+
+
+def is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+
+def key_value(atoms, key):
+    '''Returns the value of the key for the Atoms object, counting n_<symbol> keys'''
+    if element_count_key(key) and key not in atoms.info:
+        return int((atoms.numbers == atomic_numbers[key[2:]]).sum())
+    return atoms_value(atoms, key)
+
+
+def group_value(value):
+    '''Returns the value of a group_by key as a plain (hashable) Python value'''
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, np.ndarray)):
+        return str(np.asarray(value).tolist())
+    return value
+
+
+def group_order(values):
+    '''Sort key of the values of a group: missing first, then numbers, then text'''
+    return tuple((v is not None, isinstance(v, string_types), v if v is not None else 0)
+                 for v in values)
+
+
+def histogram_edges(low, high, bins):
+    '''Returns the bins + 1 edges of equal bins from low to high'''
+    if low == high:
+        high = low + 1
+    return [float(edge) for edge in np.linspace(low, high, bins + 1)]
+
+
+def bin_index(value, low, high, bins):
+    '''Returns the bin of the value, the largest value being in the last one'''
+    if high == low:
+        return 0
+    return min(int((value - low) / (high - low) * bins), bins - 1)
+
+
+def group_entry(group_by, values, count):
+    return {'group': OrderedDict(zip(group_by, values)), 'count': count, 'stats': {}}
+
+
+def key_stats(count, min, max, mean):
+    return {'count': count, 'min': min, 'max': max, 'mean': mean}
+
+
+def set_histograms(entries, key, ranges, bins, counts):
+    '''
+    Adds the histograms of the key to the entries, from a dictionary
+    (group values, bin) -> number of values. ranges is (low, high) of the
+    key in all the entries, or None if it has no values.
+    '''
+    for entry in entries:
+        values = tuple(entry['group'].values())
+        if ranges is None:
+            entry['stats'][key]['histogram'] = {'edges': [], 'counts': []}
+            continue
+        entry['stats'][key]['histogram'] = {
+            'edges': histogram_edges(ranges[0], ranges[1], bins),
+            'counts': [counts.get((values, i), 0) for i in range(bins)]}
+
+
+def overall_range(entries, key):
+    '''Returns (min, max) of the key over all the entries, or None'''
+    counted = [entry['stats'][key] for entry in entries if entry['stats'][key]['count']]
+    if not counted:
+        return None
+    return min(s['min'] for s in counted), max(s['max'] for s in counted)
+
+
+def aggregate_atoms(atoms_it, group_by, metrics, bins=0):
+    '''Returns the aggregate of the Atoms objects, see the module docstring'''
+    groups = {}
+    for atoms in atoms_it:
+        values = tuple(group_value(key_value(atoms, key)) for key in group_by)
+        group = groups.setdefault(values, {'count': 0, 'values': {key: [] for key in metrics}})
+        group['count'] += 1
+        for key in metrics:
+            value = key_value(atoms, key)
+            if is_number(value):
+                group['values'][key].append(float(value))
+
+    entries = []
+    for values in sorted(groups, key=group_order):
+        group = groups[values]
+        entry = group_entry(group_by, values, group['count'])
+        for key in metrics:
+            v = group['values'][key]
+            entry['stats'][key] = key_stats(len(v), min(v) if v else None, max(v) if v else None,
+                                            float(np.mean(v)) if v else None)
+        entries.append(entry)
+
+    if bins:
+        for key in metrics:
+            ranges = overall_range(entries, key)
+            counts = {}
+            for values in groups:
+                for value in groups[values]['values'][key]:
+                    i = bin_index(value, ranges[0], ranges[1], bins)
+                    counts[(values, i)] = counts.get((values, i), 0) + 1
+            set_histograms(entries, key, ranges, bins, counts)
+    return entries
@@ -0,0 +1,180 @@
+"""
+Asyncio interface to a backend, for programs which run many queries and
+stores at the same time in one event loop (Python 3.7 or later):
+
+    async with AsyncStructureBox(backend) as box:
+        stored, n = await asyncio.gather(box.insert(token, atoms_list),
+                                         box.count(token, filter))
+        async for atoms in await box.find(token, filter):
+            ...
+
+The methods are those of StructureBox. Calls of a backend which talks to
+a remote process (see Backend.remote_calls) run the process with asyncio.
+Other calls run in a pool of max_workers threads, or in a single thread if
+the backend is not thread-safe (Backend.thread_safe, see the "pooled"
+argument of the ASEdb backend), so that they don't block the loop.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .backend import RemoteCall
+from .structurebox import StructureBox
+
+# Number of calls of a backend running at the same time
+MAX_WORKERS = 4
+
+# Number of Atoms objects a cursor reads from the backend at a time
+CURSOR_BATCH_SIZE = 100
+
+
+class AsyncCursor(object):
+    '''Iterates over the Atoms objects of a cursor of a backend with "async for"'''
+    def __init__(self, box, cursor, batch_size=CURSOR_BATCH_SIZE):
+        self.box = box
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.batch = []
+        self.done = False
+
+    def _read(self):
+        batch = []
+        for atoms in self.cursor:
+            batch.append(atoms)
+            if len(batch) == self.batch_size:
+                break
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.batch and not self.done:
+            self.batch = await self.box._run(self._read)
+            self.batch.reverse()
+            self.done = len(self.batch) < self.batch_size
+        if not self.batch:
+            raise StopAsyncIteration
+        return self.batch.pop()
+
+    async def count(self):
+        '''Counts the Atoms objects which are left'''
+        n = len(self.batch)
+        self.batch = []
+        if not self.done:
+            n += await self.box._run(self.cursor.count)
+            self.done = True
+        return n
+
+    async def to_list(self):
+        return [atoms async for atoms in self]
+
+
+class AsyncStructureBox(object):
+    def __init__(self, backend, max_workers=MAX_WORKERS):
+        self.backend = backend
+        self.box = StructureBox(backend)
+        remote = backend.remote_calls()
+        self.remote_box = StructureBox(remote) if remote is not None else None
+        self.executor = ThreadPoolExecutor(max_workers if backend.thread_safe else 1)
+        self.max_workers = max_workers
+        # Limits the remote processes running at the same time. It is made
+        # in the event loop using it.
+        self.processes = None
+        self.did_open = False
+
+    async def _run(self, func, *args):
+        '''Runs the function in the pool of threads'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def _run_remote(self, call):
+        if self.processes is None:
+            self.processes = asyncio.Semaphore(self.max_workers)
+        async with self.processes:
+            process = await asyncio.create_subprocess_exec(
+                *call.args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await process.communicate(call.input.encode())
+        return call.decode(stdout, stderr)
+
+    async def _call(self, name, *args):
+        if self.remote_box is not None:
+            call = getattr(self.remote_box, name)(*args)
+            # Calls which the backend does without the remote (such as
+            # authenticate) return the result
+            if isinstance(call, RemoteCall):
+                return await self._run_remote(call)
+            return call
+        return await self._run(getattr(self.box, name), *args)
+
+    async def open(self):
+        '''
+        Keeps the backend open until close(), instead of opening it for
+        each call
+        '''
+        if not self.backend.is_open():
+            await self._run(self.backend.open)
+            self.did_open = True
+
+    async def close(self):
+        if self.did_open:
+            await self._run(self.backend.close)
+            self.did_open = False
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def list(self, auth_token):
+        return await self._call('list', auth_token)
+
+    async def authenticate(self, credentials):
+        return await self._call('authenticate', credentials)
+
+    async def insert(self, auth_token, atoms, duplicates=None):
+        return await self._call('insert', auth_token, atoms, duplicates)
+
+    async def update(self, auth_token, atoms, upsert=False, replace=False):
+        return await self._call('update', auth_token, atoms, upsert, replace)
+
+    async def find(self, auth_token, filter, sort={}, limit=0, keys=None, omit_keys=False,
+                   workers=1):
+        '''Runs the query and returns an AsyncCursor over its Atoms objects'''
+        cursor = await self._call('find', auth_token, filter, sort, limit, keys, omit_keys,
+                                  workers)
+        return AsyncCursor(self, cursor)
+
+    async def count(self, auth_token, filter, limit=0):
+        return await self._call('count', auth_token, filter, limit)
+
+    async def explain(self, auth_token, filter, sort={}, limit=0):
+        return await self._call('explain', auth_token, filter, sort, limit)
+
+    async def remove(self, auth_token, filter, just_one=True):
+        return await self._call('remove', auth_token, filter, just_one)
+
+    async def add_keys(self, auth_token, filter, kvp):
+        return await self._call('add_keys', auth_token, filter, kvp)
+
+    async def remove_keys(self, auth_token, filter, keys):
+        return await self._call('remove_keys', auth_token, filter, keys)
+
+    async def key_statistics(self, auth_token):
+        return await self._call('key_statistics', auth_token)
+
+    async def aggregate(self, auth_token, filter, group_by, metrics, bins=0):
+        return await self._call('aggregate', auth_token, filter, group_by, metrics, bins)
+
+    async def create_index(self, auth_token, keys):
+        return await self._call('create_index', auth_token, keys)
+
+    async def list_indexes(self, auth_token):
+        return await self._call('list_indexes', auth_token)
+
+    async def drop_index(self, auth_token, keys):
+        return await self._call('drop_index', auth_token, keys)
@@ -9,11 +9,14 @@ a filesystem, MongoDB or others.
 
 __author__ = 'Martin Uhrin, Patrick Szmucer'
 
+import time
 from abc import ABCMeta
 from abc import abstractmethod
 
 from six import add_metaclass
 
+from .aggregation import aggregate_atoms
+
 
 def enum(*sequential):
     enums = dict(zip(sequential, range(len(sequential))))
@@ -22,9 +25,25 @@ def enum(*sequential):
 Direction = enum('ASCENDING', 'DESCENDING')
 
 
+class RemoteCall(object):
+    """
+    A call of a backend done by another process: its command line, what
+    is written to its standard input, and a function making the result of
+    the call from the standard output and error of the process.
+    """
+    def __init__(self, args, input, decode):
+        self.args = args
+        self.input = input
+        self.decode = decode
+
+
 # PY2 compat
 @add_metaclass(ABCMeta)
 class Backend(object):
+    # Whether methods of one backend can be called from several threads
+    # at the same time
+    thread_safe = False
+
     @abstractmethod
     def list(self, auth_token):
         """
@@ -49,14 +68,22 @@ class Backend(object):
         pass
 
     @abstractmethod
-    def insert(self, auth_token, atoms):
+    def insert(self, auth_token, atoms, duplicates=None):
         """
         Take the Atoms object or an iterable to the Atoms and insert it
-        to the database
+        to the database. The Atoms objects are not changed: keys added by
+        the backend (such as a new uid) are only stored.
 
         :param AuthToken auth_token: Authorisation token
         :param atoms: Atoms to insert
         :type atoms: Atoms or Atoms iterable
+        :param str duplicates: What to do with configurations whose structure
+            (see :py:func:`abcd.util.fingerprint`) is already in the database:
+            'skip' them, or 'link' them to the stored one with the
+            "duplicate_of" key. None only skips configurations with
+            a uid that is already in the database. The fingerprint of
+            every configuration is stored, so all of them are compared
+            against.
         :return: Returns a result that holds a list of ids at which
             the objects were inserted and a message
         :rtype: InsertResult
@@ -96,7 +123,7 @@ class Backend(object):
         pass
 
     @abstractmethod
-    def find(self, auth_token, filter, sort, limit, keys, omit):
+    def find(self, auth_token, filter, sort, limit, keys, omit, workers=1):
         """
         Find entries that match the filter
 
@@ -110,6 +137,9 @@ class Backend(object):
         :param bool omit: if True, the keys parameter will be interpreted
             as the keys to omit (all keys except the ones specified will
             be returned).
+        :param int workers: number of processes decoding the entries,
+            which are returned in the same order. Backends which decode
+            in one process ignore it.
         :return:
         :rtype: Iterator to the Atoms object
         """
@@ -141,6 +171,144 @@ class Backend(object):
         """
         pass
 
+    def count(self, auth_token, filter, limit=0):
+        """
+        Count entries that match the filter. Backends which can count
+        without decoding the entries should override this.
+
+        :param AuthToken auth_token: Authorisation token
+        :param filter: Filter (in MongoDB query language)
+        :type filter: dictionary?
+        :param int limit: count at most this many entries. 0 for all
+        :rtype: int
+        """
+        return self.find(auth_token, filter, {}, limit, None, False).count()
+
+    def explain(self, auth_token, filter, sort, limit):
+        """
+        Describe how the backend runs a find with these arguments, and how
+        long it takes. The find is run, but the Atoms objects are not
+        returned. Backends which can report the queries they make (and the
+        database's plan for them) should override this.
+
+        :param AuthToken auth_token: Authorisation token
+        :param filter: Filter (in MongoDB query language)
+        :type filter: dictionary?
+        :param dict sort: as for find()
+        :param int limit: as for find()
+        :return: Dictionary which can have the keys "queries" (list of
+            queries sent to the database), "plan" (list of lines of the
+            database's query plan), "untranslated" (part of the filter
+            evaluated in Python), "rows_scanned", "rows_returned" and
+            "times" (dictionary of seconds spent in each step)
+        :rtype: dict
+        """
+        started = time.time()
+        n = 0
+        for atoms in self.find(auth_token, filter, sort, limit, None, False):
+            n += 1
+        return {'rows_returned': n, 'times': {'find': time.time() - started}}
+
+    def key_statistics(self, auth_token):
+        """
+        Return statistics of the keys in the whole database, without
+        reading the configurations. Backends which keep them should
+        override this.
+
+        :param AuthToken auth_token: Authorisation token
+        :return: Dictionary with the number of configurations ("rows") and
+            for each key ("keys") a dictionary with the number of
+            configurations which have it ("count"), the type of its values
+            ("type": "number", "text" or "mixed"), the smallest and largest
+            value ("min", "max", None if not known) and the number of
+            distinct values ("distinct", None if not known). None if the
+            backend keeps no statistics of this database.
+        :rtype: dict
+        """
+        return None
+
+    def aggregate(self, auth_token, filter, group_by, metrics, bins=0):
+        """
+        Group the configurations matching the filter by the values of keys
+        and return statistics of other keys in each group. The default
+        reads the configurations; backends which can have the database do
+        it should override this.
+
+        :param AuthToken auth_token: Authorisation token
+        :param filter: Filter (in MongoDB query language)
+        :type filter: dictionary?
+        :param list group_by: Keys whose values make the groups. [] for
+            a single group
+        :param list metrics: Keys to work out the number of values, min,
+            max and mean of, in each group. Only numbers are counted.
+        :param int bins: Number of bins of a histogram of each of the
+            metrics. 0 for none
+        :return: One dictionary for each group, see :py:mod:`abcd.aggregation`
+        :rtype: list
+        """
+        return aggregate_atoms(self.find(auth_token, filter, {}, 0, None, False),
+                               group_by, metrics, bins)
+
+    def create_index(self, auth_token, keys):
+        """
+        Create indexes speeding up queries on the keys. Keys which already
+        have an index are left as they are.
+
+        :param AuthToken auth_token: Authorisation token
+        :param list keys: Keys to be indexed
+        :return: Keys for which an index was created
+        :rtype: list
+        """
+        raise NotImplementedError('This backend does not support indexes')
+
+    def list_indexes(self, auth_token):
+        """
+        List the keys indexed with create_index
+
+        :param AuthToken auth_token: Authorisation token
+        :rtype: list
+        """
+        raise NotImplementedError('This backend does not support indexes')
+
+    def drop_index(self, auth_token, keys):
+        """
+        Drop the indexes created with create_index for the keys
+
+        :param AuthToken auth_token: Authorisation token
+        :param list keys: Keys whose indexes are to be dropped
+        :return: Keys whose index was dropped
+        :rtype: list
+        """
+        raise NotImplementedError('This backend does not support indexes')
+
+    def remote_calls(self):
+        """
+        Return a copy of the backend whose methods, instead of doing the
+        call, return a :py:class:`RemoteCall` to be run by the caller, so
+        that it can wait for the process without blocking (see
+        :py:mod:`abcd.aio`). Backends which talk to a remote process through
+        a command should override this.
+
+        :return: The copy, or None if the backend does its calls itself
+        """
+        return None
+
+    def begin(self):
+        """
+        Start a transaction. Writes done until commit() or rollback() is
+        called are applied together. Backends without transactions
+        can leave this as it is.
+        """
+        pass
+
+    def commit(self):
+        """Commit the current transaction"""
+        pass
+
+    def rollback(self):
+        """Discard the writes done since the current transaction began"""
+        pass
+
     @abstractmethod
     def open(self):
         pass
@@ -5,23 +5,29 @@ import argparse
 import getpass
 import os
 import io
+import json
 import shlex
 import sys
 import tarfile
 import time
+import traceback
 from abcd import Direction
 from ase.atoms import Atoms
 from ase.db.core import convert_str_to_float_or_str
 from ase.io import read as ase_read
 from ase.io import write as ase_write
 from .authentication import Credentials
+from .backend import Cursor
 from base64 import b64encode, b64decode
 from .config import ConfigFile
+from .prefetch import PrefetchCursor
 from .query import translate
-from random import randint
 from .results import UpdateResult, InsertResult
+from .shell import Session, group_commands, merge_commands
 from .structurebox import StructureBox
-from .table import print_keys_table, print_rows, print_long_row
+from .table import (print_aggregate, print_key_statistics, print_keys_table, print_rows,
+                    print_long_row)
+from .util import uid_schemes
 
 description = ''
 
@@ -37,40 +43,19 @@ examples = '''
     abcd db1.db --store configs/   (store the whole directory in the database)
     abcd db1.db --keys 'user,id' --omit-keys --show  (show the database, but omit keys user and id)
     abcd db1.db --sort 'energy:A,age:D' --show  (sort by energy (ascending) and age (descending))
+    abcd db1.db --batch commands.txt   (run the commands from commands.txt, e.g. "'energy<0.6' --add-keys low=1", in one transaction)
+    abcd db1.db --create-index config_type,energy   (make queries on config_type and energy use an index)
+    abcd db1.db --group-by config_type --stats energy   (number of rows and statistics of energy for each config_type)
+    abcd db1.db 'energy<0.6' --show --explain   (show how the query is run and where the time goes)
+    abcd db1.db --shell   (keep the database open and type commands interactively, e.g. 'energy<0.6' --count)
 '''
 
-def main():
-    sys_args = sys.argv[1:]
-    if isinstance(sys_args, str):
-        sys_args = sys_args.split(' ')
-
-    config_file = ConfigFile('cli')
-
-    if not config_file.exists():
-        defaults = {'abcd': {
-            'opts': '',
-            'backend_module': '',
-            'backend_name': ''}}
-        config_file.initialise(defaults)
-
-    # Load the options from the config file. Push them to the front of the list
-    # so they will be overwritten on the command line.
-    cfg_options = config_file.get('abcd', 'opts')
-    # parse string as commadline options
-    new_args = shlex.split(cfg_options)
-    # Stick them at the front
-    # TODO: will not work with subcommands
-    sys_args = new_args + sys_args
-
+def make_parser():
     parser = argparse.ArgumentParser(usage = 'abcd [db-name] [selection] [options]',
                         description = description,
                         epilog = 'Examples: ' + examples,
                         formatter_class=argparse.RawTextHelpFormatter)
 
-    # Display usage if no arguments are supplied
-    if len(sys_args) == 0:
-        parser.print_usage()
-
     add = parser.add_argument
     add('database', nargs='?', help = 'Specify the database')
     add('query', nargs = '*', default = '', help = 'Query')
@@ -91,12 +76,23 @@ def main():
         help='Specify columns to sort the rows by (default direction is ascending). Multicolumn sorting might not be supported by all backends.')
     add('-c', '--count', action='store_true',
         help='Count number of selected rows.')
+    add('--group-by', metavar='K1,K2,...',
+        help='Group the selected rows by the values of the keys and print the number of rows\n'
+             'in each group, and the statistics of the keys given with --stats')
+    add('--stats', metavar='K1,K2,...',
+        help='Print the number of values, mean, min and max of the keys (in each group with --group-by)')
+    add('--bins', type=int, default=0, metavar='N',
+        help='With --stats, also print histograms of N bins of the keys')
     add('-k', '--keys', metavar='K1,K2,...', help='Select only specified keys. "+" for all. See also --omit-keys.')
     add('-n', '--omit-keys', action='store_true', help='Omit keys specified with --keys argument')
     add('-t', '--add-keys', metavar='K1=V1,...', help='Add key-value pairs')
     add('--remove-keys', metavar='K1,K2,...', help='Remove keys')
     add('--remove', action='store_true',
         help='Remove selected rows.')
+    add('--create-index', metavar='K1,K2,...',
+        help='Create indexes to speed up queries on the keys, e.g. "config_type,energy"')
+    add('--list-indexes', action='store_true', help='List the keys which have an index')
+    add('--drop-index', metavar='K1,K2,...', help='Drop the indexes of the keys')
     add('-s', '--store', metavar='', nargs='+', help='Store a directory / list of files')
     add('-u', '--update', metavar='', nargs='+', help='Update the databse with a directory / list of files')
     add('--replace', action='store_true', default=False,
@@ -107,6 +103,15 @@ def main():
         help='Insert configurations which are not yet in the database when using --update')
     add('--no-upsert', action='store_false', dest='upsert',
         help='Don\'t insert configurations which are not yet in the database when using --update')
+    add('--duplicates', choices=['skip', 'link'], default=None,
+        help='With --store, find configurations whose structure (composition, cell and sorted\n'
+             'interatomic distances) is already in the database, even under a different uid,\n'
+             'and either skip them or store them with a "duplicate_of" key. Only configurations\n'
+             'stored with --duplicates can be found this way')
+    add('--uid-scheme', choices=sorted(uid_schemes), default='random',
+        help='How uids are given to stored configurations which don\'t have one. "content" makes\n'
+             'the uid a hash of the structure and results, so storing the same configuration\n'
+             'again is recognised as a duplicate (default: random)')
     add('-x', '--extract-original-files', action='store_true',
         help='Extract original files stored with --store')
     add('--untar', action='store_true', default=True,
@@ -117,6 +122,52 @@ def main():
     add('-w', '--write-to-file', metavar='FILE',
         help='Write selected rows to file(s). Include format string for multiple \nfiles, e.g. file_%%03d.xyz')
     add('--ids', action='store_true', help='Print unique ids of selected configurations')
+    add('--workers', type=int, default=1, metavar='N',
+        help='Decode the selected configurations in N processes (default: 1). Not all backends\n'
+             'support it')
+    add('--prefetch', type=int, default=0, metavar='N',
+        help='Read and decode up to N configurations ahead in a background thread, while the\n'
+             'current ones are written or printed (default: 0, none)')
+    add('--explain', action='store_true',
+        help='Print the translated query, the queries the backend makes and its query plan,\n'
+             'the number of rows read and returned, and the time spent in each step')
+    add('--batch', metavar='FILE',
+        help='Run the commands from FILE ("-" for stdin), one per line, in a single transaction')
+    add('--shell', action='store_true',
+        help='Start an interactive shell. It accepts queries and options in the same form as abcd,\n'
+             'but keeps the database open and caches results between commands')
+
+    return parser
+
+
+def main():
+    sys_args = sys.argv[1:]
+    if isinstance(sys_args, str):
+        sys_args = sys_args.split(' ')
+
+    config_file = ConfigFile('cli')
+
+    if not config_file.exists():
+        defaults = {'abcd': {
+            'opts': '',
+            'backend_module': '',
+            'backend_name': ''}}
+        config_file.initialise(defaults)
+
+    # Load the options from the config file. Push them to the front of the list
+    # so they will be overwritten on the command line.
+    cfg_options = config_file.get('abcd', 'opts')
+    # parse string as commadline options
+    new_args = shlex.split(cfg_options)
+    # Stick them at the front
+    # TODO: will not work with subcommands
+    sys_args = new_args + sys_args
+
+    parser = make_parser()
+
+    # Display usage if no arguments are supplied
+    if len(sys_args) == 0:
+        parser.print_usage()
 
     args = parser.parse_args(sys_args)
 
@@ -134,7 +185,12 @@ def main():
     verbosity = 1 - args.quiet + args.verbose
 
     try:
-        run(args, sys_args, verbosity)
+        if args.shell:
+            shell(parser, args, verbosity)
+        elif args.batch:
+            batch(parser, args, verbosity)
+        else:
+            run(args, sys_args, verbosity)
     except Exception as x:
         if verbosity < 2:
             print('{0}: {1}'.format(x.__class__.__name__, x), file=sys.stderr)
@@ -143,6 +199,175 @@ def main():
             raise
 
 
+def init_backend(args):
+    '''Initialises the backend specified in the config file'''
+    cfg = ConfigFile('cli')
+    backend_module = cfg.get('abcd', 'backend_module')
+    backend_name = cfg.get('abcd', 'backend_name')
+
+    # Quit if no backend was specified
+    if not backend_module or not backend_name:
+        print('  Please specify the backend in {}'.format(cfg.path))
+        sys.exit()
+
+    # Import the backend
+    Backend = getattr(__import__(backend_module, fromlist=[backend_name]), backend_name)
+
+    # Initialise the backend
+    return Backend(database=args.database, remote=args.remote)
+
+
+def authenticate(box, args):
+    '''Asks for the credentials if needed and returns the token'''
+    # Get the username and password
+    if args.user == []:
+        try:
+            # PY2 compat
+            user = raw_input('User: ')
+        except NameError:
+            user = input('User: ')
+    else:
+        user = args.user
+
+    if args.password == []:
+        password = getpass.getpass()
+    else:
+        password = args.password
+
+    # Authenticate
+    return box.authenticate(Credentials(user))
+
+
+def parse_command(parser, args, line):
+    '''
+    Parses a line of the shell or of a batch file. It is interpreted as the
+    arguments following the database name given on the command line.
+    '''
+    cmd_args = parser.parse_args([args.database or ''] + shlex.split(line))
+    cmd_args.database = args.database
+    cmd_args.remote = args.remote
+    cmd_args.user = args.user
+    cmd_args.password = args.password
+    return cmd_args
+
+
+def shell(parser, args, verbosity):
+    '''Reads commands from stdin and runs them on one open backend'''
+    try:
+        # Gives the prompt history and line editing
+        import readline
+    except ImportError:
+        pass
+
+    try:
+        # PY2 compat
+        read_line = raw_input
+    except NameError:
+        read_line = input
+
+    session = Session(init_backend(args))
+    session.token = authenticate(session.box, args)
+    prompt = '{}> '.format(args.database or 'abcd')
+
+    print('Type queries and options as you would after "abcd {}". '
+          '"exit" or Ctrl-D to quit.'.format(args.database or ''))
+    try:
+        while True:
+            try:
+                line = read_line(prompt).strip()
+            except EOFError:
+                print('')
+                break
+            except KeyboardInterrupt:
+                print('')
+                continue
+
+            if not line:
+                continue
+            if line in ('exit', 'quit'):
+                break
+
+            try:
+                cmd_args = parse_command(parser, args, line)
+            except SystemExit:
+                # argparse has already printed the error (or --help)
+                continue
+            except ValueError as x:
+                to_stderr('Error: {}'.format(x))
+                continue
+
+            cmd_verbosity = 1 - cmd_args.quiet + cmd_args.verbose
+            try:
+                run(cmd_args, line, cmd_verbosity, session)
+            except SystemExit:
+                continue
+            except Exception as x:
+                if cmd_verbosity < 2:
+                    to_stderr('{0}: {1}'.format(x.__class__.__name__, x))
+                else:
+                    traceback.print_exc()
+    finally:
+        session.close()
+
+
+def batch(parser, args, verbosity):
+    '''
+    Runs all commands from a file on one open backend, in order. Consecutive
+    commands which add (or remove) keys on the same selection are merged
+    when that gives the same result (see shell.can_merge). Everything is
+    committed once at the end, or nothing if any command fails.
+    '''
+    if args.batch == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.batch) as f:
+            lines = f.readlines()
+
+    # Parse everything before touching the database
+    lines = [l.strip() for l in lines]
+    lines = [l for l in lines if l and not l.startswith('#')]
+    commands = []
+    for i, line in enumerate(lines):
+        try:
+            commands.append(parse_command(parser, args, line))
+        except (SystemExit, ValueError):
+            raise RuntimeError('Could not parse command {}: {}'.format(i + 1, line))
+        if commands[-1].shell or commands[-1].batch:
+            raise RuntimeError('Command {} can\'t be run from a batch: {}'.format(i + 1, line))
+
+    session = Session(init_backend(args), autocommit=False)
+    session.token = authenticate(session.box, args)
+    backend = session.box.backend
+
+    # Output is printed as the commands run, nothing is captured, so that
+    # the commands can still prompt the user
+    backend.begin()
+    try:
+        for group in group_commands(commands):
+            for i in group:
+                print('[{}] {}'.format(i + 1, lines[i]))
+            if len(group) > 1:
+                print('  (the {} commands above were run together)'.format(len(group)))
+            cmd_args = merge_commands([commands[i] for i in group])
+            cmd_verbosity = 1 - cmd_args.quiet + cmd_args.verbose
+            try:
+                run(cmd_args, lines[group[0]], cmd_verbosity, session)
+            except SystemExit:
+                raise RuntimeError('Command {} failed: {}'.format(group[0] + 1, lines[group[0]]))
+            except Exception as x:
+                raise RuntimeError('Command {} failed: {}\n{}: {}'
+                                   .format(group[0] + 1, lines[group[0]],
+                                           x.__class__.__name__, x))
+    except:
+        backend.rollback()
+        to_stderr('Nothing was written to the database')
+        raise
+    else:
+        backend.commit()
+    finally:
+        session.close()
+
+
 def to_stderr(*args):
     '''Prints to stderr'''
     if args and any(not arg.isspace() for arg in args):
@@ -171,6 +396,11 @@ def untar_and_delete(tar_files, path_prefix):
         os.remove(tarball)
 
 
+def split_keys(keys):
+    '''Splits a comma-separated list of keys'''
+    return [k for k in keys.split(',') if k.strip()]
+
+
 def print_result(result, multiconfig_files, database):
 
     if isinstance(result, UpdateResult):
@@ -261,15 +491,85 @@ def print_result(result, multiconfig_files, database):
             print('  ', f)
 
 
-def run(args, sys_args, verbosity):
+class TimedCursor(Cursor):
+    '''Cursor which adds up the time spent getting items from another cursor'''
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.seconds = 0.
+
+    def __next__(self):
+        started = time.time()
+        try:
+            return next(self.cursor)
+        finally:
+            self.seconds += time.time() - started
+
+    def next(self):
+        return self.__next__()
+
+    def count(self):
+        started = time.time()
+        try:
+            return self.cursor.count()
+        finally:
+            self.seconds += time.time() - started
+
+
+# Seconds of waiting for other writers (Result.lock_wait) worth reporting
+REPORTED_LOCK_WAIT = 0.1
+
+# Steps of a find reported by Backend.explain
+explain_steps = ['find', 'sql', 'filter', 'decode']
+
+
+def print_explain(query, report):
+    '''Prints the filter and what the backend reported about running it'''
+    print('Filter:', json.dumps(query, sort_keys=True))
+    if report.get('queries'):
+        print('Queries:')
+        for q in report['queries']:
+            print('  ' + q)
+        if report.get('arguments'):
+            print('Arguments:', json.dumps(report['arguments']))
+    if report.get('plan'):
+        print('Query plan:')
+        for line in report['plan']:
+            print('  ' + line)
+    if report.get('untranslated'):
+        print('Evaluated in Python:', json.dumps(report['untranslated'], sort_keys=True))
+    if 'rows_scanned' in report:
+        print('Rows: {} from the database, {} returned'.format(report['rows_scanned'],
+                                                             report['rows_returned']))
+    elif 'rows_returned' in report:
+        print('Rows: {} returned'.format(report['rows_returned']))
+    times = report.get('times', {})
+    if times:
+        steps = [step for step in explain_steps if step in times]
+        steps += sorted(set(times) - set(explain_steps))
+        print('Time: ' + ', '.join('{} {:.3f} s'.format(step, times[step]) for step in steps))
+    print('')
+
+
+def run(args, sys_args, verbosity, session=None):
+    '''
+    Runs one command. If session is given, its open backend and caches are
+    used instead of initialising a new backend.
+    '''
 
     def out(*args):
         '''Prints information in accordance to verbosity'''
         if verbosity > 0 and args and any(not arg.isspace() for arg in args):
             print(*(arg.rstrip('\n') for arg in args))
 
+    def out_lock_wait(result):
+        if result.lock_wait >= REPORTED_LOCK_WAIT:
+            out('  Waited {:.1f} s for other writers of the database'.format(result.lock_wait))
+
     # Get the query
-    query = translate(args.query)
+    if session is None:
+        query = translate(args.query)
+    else:
+        query = session.translate(args.query)
 
     if args.omit_keys and args.keys is None:
         print('Error: No keys to omit specified. Use --keys')
@@ -312,50 +612,36 @@ def run(args, sys_args, verbosity):
     remove_keys = [a for a in remove_keys if a not in (None, '', ' ')]
 
 
-    #
-    #
     # Backend initialisation and authentication
-    cfg = ConfigFile('cli')
-    backend_module = cfg.get('abcd', 'backend_module')
-    backend_name = cfg.get('abcd', 'backend_name')
-
-    # Quit if no backend was specified
-    if not backend_module or not backend_name:
-        print('  Please specify the backend in {}'.format(cfg.path))
-        sys.exit()
-
-    # Import the backend
-    Backend = getattr(__import__(backend_module, fromlist=[backend_name]), backend_name)
-
-    # Initialise the backend
-    box = StructureBox(Backend(database=args.database, remote=args.remote))
-
-    # Get the username and password
-    if args.user == []:
-        try:
-            # PY2 compat
-            user = raw_input('User: ')
-        except NameError:
-            user = input('User: ')
+    if session is None:
+        box = StructureBox(init_backend(args))
+        token = authenticate(box, args)
     else:
-        user = args.user
+        box = session.box
+        token = session.token
 
-    if args.password == []:
-        password = getpass.getpass()
-    else:
-        password = args.password
+    if args.explain:
+        print_explain(query, box.explain(token, query, sort, args.limit))
 
-    # Authenticate
-    token = box.authenticate(Credentials(user))
-    #
-    #
-    #
+    # Cursors returned by find, timed with --explain
+    cursors = []
+
+    def find(**kwargs):
+        atoms_it = box.find(workers=args.workers, **kwargs)
+        if args.prefetch:
+            atoms_it = PrefetchCursor(atoms_it, args.prefetch)
+        if args.explain:
+            atoms_it = TimedCursor(atoms_it)
+            cursors.append(atoms_it)
+        return atoms_it
 
+    started = time.time()
 
     # Remove entries from a database
     if args.remove:
         result = box.remove(token, query, just_one=False)
         print(result.msg)
+        out_lock_wait(result)
 
     # Extract a configuration from the database and write it
     # to the specified file.
@@ -372,9 +658,6 @@ def run(args, sys_args, verbosity):
         else:
             format = display_format
 
-        nrows = 0
-        list_of_atoms = []
-
         # Make sure 'original_files' is omitted
         omit = omit_keys
         if keys is not None and omit:
@@ -388,15 +671,9 @@ def run(args, sys_args, verbosity):
             keys = ['original_files']
             omit = True
 
-        for atoms in box.find(auth_token=token, filter=query,
-                              sort=sort, limit=args.limit,
-                              keys=keys, omit_keys=omit):
-            list_of_atoms.append(atoms)
-            nrows += 1
-
-        if not list_of_atoms:
-            to_stderr('No atoms selected')
-            return
+        atoms_it = find(auth_token=token, filter=query,
+                        sort=sort, limit=args.limit,
+                        keys=keys, omit_keys=omit)
 
         if '%' not in filename:
             one_file = True
@@ -426,16 +703,24 @@ def run(args, sys_args, verbosity):
 
         files_written = 0
         if one_file:
-            name = filename + '.' + display_format
-            write_atoms_locally(list_of_atoms, name, format, args.path_prefix)
-            files_written = 1
+            list_of_atoms = list(atoms_it)
+            if list_of_atoms:
+                name = filename + '.' + display_format
+                write_atoms_locally(list_of_atoms, name, format, args.path_prefix)
+                files_written = 1
         else:
-            # Write extracted configurations into separate files
-            for i, atoms in enumerate(list_of_atoms):
+            # Write extracted configurations into separate files as they
+            # are read, so that with --prefetch the next ones are decoded
+            # meanwhile
+            for i, atoms in enumerate(atoms_it):
                 name = filename % i + '.' + display_format
                 write_atoms_locally(atoms, name, format, args.path_prefix)
                 files_written += 1
 
+        if not files_written:
+            to_stderr('No atoms selected')
+            return
+
         out('  Writing {} file(s) to {}/'.format(files_written, args.path_prefix))
 
     # Extract original file(s) from the database and write them
@@ -449,7 +734,7 @@ def run(args, sys_args, verbosity):
         original_files =[]
         skipped_configs = []
         nat = 0
-        for atoms in box.find(auth_token=token, filter=query,
+        for atoms in find(auth_token=token, filter=query,
                         sort=sort, limit=args.limit,
                         keys=['original_files', 'uid']):
             nat += 1
@@ -647,7 +932,7 @@ def run(args, sys_args, verbosity):
             # Check if the configuration has a uid.
             # If not, attach one.
             if not 'uid' in atoms.info or atoms.info['uid'] is None:
-                atoms.info['uid'] = '%x' % randint(16**14, 16**15 - 1)
+                atoms.info['uid'] = uid_schemes[args.uid_scheme](atoms)
 
             # Add c_time, formula and n_atoms
             if not 'c_time' in atoms.info:
@@ -659,18 +944,50 @@ def run(args, sys_args, verbosity):
 
         # Store/update parsed atoms
         if args.store:
-            result = box.insert(token, atoms_to_store)
+            result = box.insert(token, atoms_to_store, args.duplicates)
         else:
             result = box.update(token, atoms_to_store, args.upsert, args.replace)
         print_result(result, multiconfig_files, args.database)
+        out_lock_wait(result)
 
     elif args.add_keys:
         result = box.add_keys(token, query, kvp)
         print(result.msg)
+        out_lock_wait(result)
 
     elif args.remove_keys:
         result = box.remove_keys(token, query, remove_keys)
         print(result.msg)
+        out_lock_wait(result)
+
+    elif args.create_index:
+        created = box.create_index(token, split_keys(args.create_index))
+        if created:
+            print('Created indexes for: ' + ', '.join(created))
+        else:
+            print('All the keys are indexed already')
+
+    elif args.drop_index:
+        dropped = box.drop_index(token, split_keys(args.drop_index))
+        if dropped:
+            print('Dropped indexes for: ' + ', '.join(dropped))
+        else:
+            print('None of the keys are indexed')
+
+    elif args.list_indexes:
+        indexed = box.list_indexes(token)
+        if indexed:
+            print('Indexed keys:')
+            for key in indexed:
+                print('  ' + key)
+        else:
+            print('No keys are indexed')
+
+    elif args.group_by or args.stats:
+        group_by = split_keys(args.group_by or '')
+        metrics = split_keys(args.stats or '')
+        entries = box.aggregate(token, query, group_by, metrics, args.bins)
+        print_aggregate(entries, group_by, metrics, border=args.pretty, truncate=args.pretty)
 
     # Count selected configurations
     elif args.count:
@@ -678,10 +995,7 @@ def run(args, sys_args, verbosity):
             lim = 0
         else:
             lim = args.limit + 1
-        atoms_it = box.find(auth_token=token, filter=query,
-                            sort=sort, limit=lim, keys=keys,
-                            omit_keys=omit_keys)
-        count = atoms_it.count()
+        count = box.count(token, query, lim)
         if args.limit != 0 and count > args.limit:
             count = '{}+'.format(count-1)
         else:
@@ -689,7 +1003,7 @@ def run(args, sys_args, verbosity):
         print('Found:', count)
 
     elif args.ids:
-        atoms_it = box.find(auth_token=token, filter=query,
+        atoms_it = find(auth_token=token, filter=query,
                             sort=sort, limit=args.limit,
                             keys=keys, omit_keys=omit_keys)
         for atoms in atoms_it:
@@ -698,14 +1012,14 @@ def run(args, sys_args, verbosity):
 
     # Show the database
     elif args.show:
-        atoms_it = box.find(auth_token=token, filter=query,
+        atoms_it = find(auth_token=token, filter=query,
                             sort=sort, limit=args.limit,
                             keys=keys, omit_keys=omit_keys)
         print_rows(atoms_it, border=args.pretty,
             truncate=args.pretty, show_keys=keys, omit_keys=omit_keys)
 
     elif args.long:
-        atoms_it = box.find(auth_token=token, filter=query,
+        atoms_it = find(auth_token=token, filter=query,
                             sort=sort, limit=args.limit,
                             keys=keys, omit_keys=omit_keys)
         try:
@@ -731,10 +1045,24 @@ def run(args, sys_args, verbosity):
         else:
             print('Hello. You don\'t have access to any databases.')
 
-    # Print info about keys
+    # Print info about keys. For the whole database, the statistics kept
+    # by the backend are used if it has them.
     else:
-        atoms_it = box.find(auth_token=token, filter=query,
-                            sort=sort, limit=args.limit, keys=keys,
-                            omit_keys=omit_keys)
-        print_keys_table(atoms_it, border=args.pretty,
-            truncate=args.pretty, show_keys=keys, omit_keys=omit_keys)
+        stats = None
+        if query == {'$and': []} and args.limit == 0:
+            # None if the backend keeps no statistics of the database
+            stats = box.key_statistics(token)
+        if stats is not None:
+            print_key_statistics(stats, border=args.pretty,
+                truncate=args.pretty, show_keys=keys, omit_keys=omit_keys)
+        else:
+            atoms_it = find(auth_token=token, filter=query,
+                                sort=sort, limit=args.limit, keys=keys,
+                                omit_keys=omit_keys)
+            print_keys_table(atoms_it, border=args.pretty,
+                truncate=args.pretty, show_keys=keys, omit_keys=omit_keys)
+
+    if args.explain:
+        fetching = sum(cursor.seconds for cursor in cursors)
+        print('\nTime: finding {:.3f} s, rendering {:.3f} s'.format(
+            fetching, time.time() - started - fetching))
@@ -0,0 +1,232 @@
+"""
+Python API for working with a database.
+
+A Database opens the backend once, authenticates once and keeps the
+connection open until it is closed, so scripts which issue many small
+calls don't pay the setup cost on each of them (as they would with
+:py:class:`abcd.structurebox.StructureBox`). Queries can be given in the
+same form as on the command line and their translations are cached.
+
+    >>> from abcd import connect
+    >>> db = connect('db1.db')
+    >>> for atoms in db.find('energy<0.6 elements~C'):
+    ...     print(atoms.info['uid'])
+    >>> with db:
+    ...     db.add_keys('config_type=bulk', {'split': 'train'})
+    ...     db.remove_keys('config_type=bulk', ['old_split'])
+    >>> db.close()
+
+Writes done inside a "with" block form a single transaction which is
+committed at the end of the block, or discarded if an exception is raised.
+Writes done outside of it are committed straight away.
+"""
+
+import copy
+from six import string_types
+
+from .authentication import Credentials
+from .config import ConfigFile
+from .prefetch import PrefetchCursor
+from .query import translate
+from .util import LRUCache
+
+
+def cached_filter(queries, query):
+    '''
+    Returns the filter in the MongoDB format. The query can be a string
+    or a list of strings as accepted by the command line tool, or an
+    already translated filter. None and blank strings (the command line's
+    default) select everything. Translations are kept in the LRUCache
+    queries.
+    '''
+    if isinstance(query, dict):
+        return query
+    if query is None:
+        query = []
+    elif isinstance(query, string_types):
+        query = [query] if query.strip() else []
+    cache_key = tuple(query)
+    if cache_key not in queries:
+        queries[cache_key] = translate(list(query))
+    # The backend is free to modify the filter it gets
+    return copy.deepcopy(queries[cache_key])
+
+
+def load_backend(database=None, remote=None):
+    """
+    Creates the backend specified in the configuration file of the
+    command line tool.
+    """
+    cfg = ConfigFile('cli')
+    if not cfg.exists():
+        raise RuntimeError('{} does not exist. Run "abcd" first'.format(cfg.path))
+    backend_module = cfg.get('abcd', 'backend_module')
+    backend_name = cfg.get('abcd', 'backend_name')
+    if not backend_module or not backend_name:
+        raise RuntimeError('Please specify the backend in {}'.format(cfg.path))
+
+    Backend = getattr(__import__(backend_module, fromlist=[backend_name]), backend_name)
+    return Backend(database=database, remote=remote)
+
+
+def connect(database=None, remote=None, username=None):
+    """
+    Opens the database using the backend from the configuration file
+    of the command line tool.
+
+    :param str database: Name of the database
+    :param str remote: Remote host, e.g. abcd@gc121mac1
+    :param str username: Username used to authenticate
+    :rtype: Database
+    """
+    return Database(load_backend(database, remote), Credentials(username))
+
+
+class Database(object):
+    def __init__(self, backend, credentials=None, cache_size=128):
+        """
+        :param Backend backend: The backend, it will be opened straight away
+        :param Credentials credentials: Credentials used to authenticate
+        :param int cache_size: Number of translated queries to remember
+        """
+        if credentials is None:
+            credentials = Credentials()
+        self.backend = backend
+        self.backend.open()
+        self.auth_token = self.backend.authenticate(credentials)
+        self._queries = LRUCache(cache_size)
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            self.backend.begin()
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._depth -= 1
+        if self._depth == 0:
+            if exc_type is None:
+                self.backend.commit()
+            else:
+                self.backend.rollback()
+
+    def _filter(self, query):
+        '''Returns the filter in the MongoDB format, see cached_filter'''
+        return cached_filter(self._queries, query)
+
+    def _written(self, result):
+        '''Commits the write, unless it's a part of an explicit transaction'''
+        if self._depth == 0:
+            self.backend.commit()
+        return result
+
+    def list(self):
+        return self.backend.list(self.auth_token)
+
+    def find(self, query=None, sort={}, limit=0, keys=None, omit_keys=False, prefetch=0,
+             workers=1):
+        """
+        :param query: Query, e.g. 'energy<0.6 elements~C'
+        :param dict sort: Columns to sort by, see :py:meth:`Backend.find`
+        :param int limit: Maximum number of returned entries. 0 for all
+        :param list keys: Keys to be returned. None for all
+        :param bool omit_keys: Return all keys except the ones in keys
+        :param int prefetch: Number of Atoms objects to read and decode
+            ahead in a background thread, see
+            :py:class:`abcd.prefetch.PrefetchCursor`. 0 for none
+        :param int workers: Number of processes decoding the Atoms objects,
+            see :py:meth:`Backend.find`
+        :rtype: Iterator to the Atoms objects
+        """
+        args = (self.auth_token, self._filter(query), sort, limit, keys, omit_keys)
+        if workers != 1:
+            args += (workers,)
+        cursor = self.backend.find(*args)
+        if prefetch:
+            cursor = PrefetchCursor(cursor, prefetch)
+        return cursor
+
+    def count(self, query=None, limit=0):
+        args = (self.auth_token, self._filter(query))
+        if limit != 0:
+            args += (limit,)
+        return self.backend.count(*args)
+
+    def explain(self, query=None, sort={}, limit=0):
+        """
+        Runs the query and describes how the backend did it, see
+        :py:meth:`Backend.explain`
+
+        :rtype: dict
+        """
+        return self.backend.explain(self.auth_token, self._filter(query), sort, limit)
+
+    def insert(self, atoms, duplicates=None):
+        """
+        :param atoms: Atoms object or a list of them
+        :param str duplicates: 'skip' or 'link' configurations whose
+            structure is already in the database, see :py:meth:`Backend.insert`
+        :rtype: InsertResult
+        """
+        if duplicates is None:
+            result = self.backend.insert(self.auth_token, atoms)
+        else:
+            result = self.backend.insert(self.auth_token, atoms, duplicates)
+        return self._written(result)
+
+    def update(self, atoms, upsert=False, replace=False):
+        return self._written(self.backend.update(self.auth_token, atoms,
+                                                 upsert, replace))
+
+    def remove(self, query, just_one=False):
+        return self._written(self.backend.remove(self.auth_token,
+                                                 self._filter(query), just_one))
+
+    def add_keys(self, query, kvp):
+        return self._written(self.backend.add_keys(self.auth_token,
+                                                   self._filter(query), kvp))
+
+    def remove_keys(self, query, keys):
+        return self._written(self.backend.remove_keys(self.auth_token,
+                                                      self._filter(query), keys))
+
+    def key_statistics(self):
+        """
+        Statistics of the keys in the whole database, see
+        :py:meth:`Backend.key_statistics`
+
+        :rtype: dict
+        """
+        return self.backend.key_statistics(self.auth_token)
+
+    def aggregate(self, query=None, group_by=[], metrics=[], bins=0):
+        """
+        Statistics of the metrics keys in groups of configurations, see
+        :py:meth:`Backend.aggregate`
+
+        :param query: Query, e.g. 'energy<0.6 elements~C'
+        :param list group_by: Keys whose values make the groups
+        :param list metrics: Keys to work out statistics of
+        :param int bins: Number of bins of the histograms. 0 for none
+        :rtype: list
+        """
+        return self.backend.aggregate(self.auth_token, self._filter(query), group_by,
+                                      metrics, bins)
+
+    def create_index(self, keys):
+        """
+        :param list keys: Keys whose queries should use an index
+        :return: Keys for which an index was created
+        :rtype: list
+        """
+        return self._written(self.backend.create_index(self.auth_token, list(keys)))
+
+    def list_indexes(self):
+        return self.backend.list_indexes(self.auth_token)
+
+    def drop_index(self, keys):
+        return self._written(self.backend.drop_index(self.auth_token, list(keys)))
+
+    def close(self):
+        self.backend.close()
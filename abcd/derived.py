@@ -0,0 +1,119 @@
+"""
+Scalar properties derived from the arrays of a configuration. Backends
+store them as ordinary numeric keys when a configuration is written, so
+that e.g. 'max_force<0.1' or 'min_distance>1.5' can be queried like any
+other key instead of decoding the forces or positions of every row.
+
+Further properties can be added with the derived_property decorator. The
+function gets the Atoms object and returns a number, or None if the
+property is not defined for it.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from ase import units
+from ase.neighborlist import neighbor_list
+
+# Name of the key -> function computing it
+derived_properties = OrderedDict()
+
+# Distance (A) within which min_distance first looks for neighbours
+MIN_DISTANCE_CUTOFF = 3.0
+
+
+def derived_property(name):
+    def decorator(func):
+        derived_properties[name] = func
+        return func
+    return decorator
+
+
+def calculated(atoms, name):
+    '''Returns the calculated property, or None if there is none'''
+    if atoms.calc is None:
+        return None
+    return atoms.calc.results.get(name)
+
+
+def periodic_volume(atoms):
+    '''Volume of the cell if it is periodic in all directions, else None'''
+    if not atoms.pbc.all():
+        return None
+    volume = abs(np.linalg.det(atoms.cell))
+    return volume if volume > 0 else None
+
+
+@derived_property('max_force')
+def max_force(atoms):
+    '''Largest magnitude of the force on an atom (eV/A)'''
+    forces = calculated(atoms, 'forces')
+    if forces is None or len(forces) == 0:
+        return None
+    return np.sqrt((np.asarray(forces)**2).sum(axis=1)).max()
+
+
+@derived_property('volume_per_atom')
+def volume_per_atom(atoms):
+    '''Volume of the cell per atom (A^3)'''
+    volume = periodic_volume(atoms)
+    if volume is None or len(atoms) == 0:
+        return None
+    return volume / len(atoms)
+
+
+@derived_property('density')
+def density(atoms):
+    '''Mass density (g/cm^3)'''
+    volume = periodic_volume(atoms)
+    if volume is None:
+        return None
+    # amu/A^3 -> g/cm^3
+    return atoms.get_masses().sum() / volume / units._Nav * 1e24
+
+
+@derived_property('min_distance')
+def min_distance(atoms):
+    '''
+    Shortest distance between two atoms (A), using the minimum image
+    convention. Neighbours are searched within a cutoff, which is doubled
+    until there are any, rather than working out all the distances.
+    '''
+    if len(atoms) < 2:
+        return None
+    # The distance of any pair bounds the cutoff
+    bound = atoms.get_distance(0, 1, mic=atoms.pbc.any())
+    cutoff = MIN_DISTANCE_CUTOFF
+    while True:
+        cutoff = min(cutoff, bound)
+        first, second, distances = neighbor_list('ijd', atoms, cutoff)
+        # Not the periodic images of an atom itself
+        distances = distances[first != second]
+        if len(distances):
+            return min(distances.min(), bound)
+        elif cutoff == bound:
+            return bound
+        cutoff *= 2
+
+
+@derived_property('stress_norm')
+def stress_norm(atoms):
+    '''Frobenius norm of the stress tensor (eV/A^3)'''
+    stress = calculated(atoms, 'stress')
+    if stress is None:
+        return None
+    stress = np.asarray(stress, dtype=float)
+    if stress.shape == (6,):
+        # Voigt order xx, yy, zz, yz, xz, xy: off-diagonal terms count twice
+        return np.sqrt((stress[:3]**2).sum() + 2 * (stress[3:]**2).sum())
+    return np.linalg.norm(stress)
+
+
+def derived_keys(atoms):
+    '''Returns a dictionary with the derived properties defined for atoms'''
+    keys = {}
+    for name, func in derived_properties.items():
+        value = func(atoms)
+        if value is not None:
+            keys[name] = float(value)
+    return keys
@@ -0,0 +1,216 @@
+"""
+Evaluates filters in the MongoDB format (as returned by
+:py:func:`abcd.query.translate`) on Atoms objects in memory. Backends use
+it for conditions they can't pass on to the database.
+
+Atoms are taken from an iterator in batches. Only the keys used by the
+filter are read from them, into one NumPy array per key, and every
+comparison is done on the whole batch at once:
+
+    >>> for atoms in filter_atoms(box.find(token, {}), translate(['n_H>2'])):
+    ...     print(atoms.info['uid'])
+
+The comparisons follow the SQL of the ASEdb backend, so that a filter
+gives the same result whichever part of it is evaluated here: a
+comparison only matches configurations which have the key with a value
+of the same type (text or number), e.g. 'k!=v' doesn't match configurations
+without "k".
+"""
+
+from itertools import islice
+
+import numpy as np
+from ase.data import atomic_numbers, chemical_symbols
+from six import string_types
+
+from .query import QueryError
+from .util import reduced_formula
+
+# Number of Atoms objects evaluated at once
+BATCH_SIZE = 1000
+
+logical_operators = ('$and', '$or', '$nor')
+
+
+def referenced_keys(filter):
+    '''Returns the set of keys a filter compares'''
+    keys = set()
+    for key, value in filter.items():
+        if key in logical_operators:
+            for sub_filter in value:
+                keys |= referenced_keys(sub_filter)
+        else:
+            keys.add(key)
+    return keys
+
+
+def element_count_key(key):
+    '''Whether the key is n_<symbol>, e.g. n_W'''
+    return key.startswith('n_') and atomic_numbers.get(key[2:], 0) > 0
+
+
+def atoms_value(atoms, key):
+    '''
+    Returns the value of the key for the Atoms object, or None if it
+    doesn't have it
+    '''
+    if key in atoms.info:
+        return atoms.info[key]
+    elif key in ('natoms', 'n_atoms'):
+        return len(atoms)
+    elif key == 'formula_reduced':
+        return reduced_formula(atoms.numbers)
+    elif key == 'pbc':
+        return ''.join('T' if p else 'F' for p in atoms.pbc)
+    elif atoms.calc is not None and key in atoms.calc.results:
+        return atoms.calc.results[key]
+    return None
+
+
+class Column(object):
+    '''Values of one key for a batch of configurations'''
+
+    def __init__(self, values):
+        self.present = np.array([v is not None for v in values], dtype=bool)
+        if all(isinstance(v, (int, float, np.number)) and not isinstance(v, bool)
+               for v in values if v is not None):
+            self.values = np.array([np.nan if v is None else v for v in values], dtype=float)
+        else:
+            self.values = np.empty(len(values), dtype=object)
+            self.values[:] = values
+
+    def same_type(self, val):
+        '''Which of the values are of the same type as val, text or number'''
+        if self.values.dtype == object:
+            return self.present & np.array(
+                [isinstance(v, string_types) == isinstance(val, string_types)
+                 for v in self.values], dtype=bool)
+        elif isinstance(val, string_types):
+            return np.zeros(len(self.present), dtype=bool)
+        return self.present
+
+    def compare(self, op, val):
+        if op == '$eq':
+            return self.present & (self.values == val)
+        elif op == '$ne':
+            return self.same_type(val) & ~self.compare('$eq', val)
+        elif op in ('$in', '$nin'):
+            if not isinstance(val, list):
+                val = [val]
+            mask = np.zeros(len(self.present), dtype=bool)
+            comparable = np.zeros(len(self.present), dtype=bool)
+            for v in val:
+                mask |= self.compare('$eq', v)
+                comparable |= self.same_type(v)
+            return mask if op == '$in' else comparable & ~mask
+        elif op in ('$gt', '$gte', '$lt', '$lte'):
+            # Only values of the same type can be ordered
+            comparable = self.same_type(val)
+            if self.values.dtype == object:
+                values = np.where(comparable, self.values, val)
+            else:
+                values = self.values
+            with np.errstate(invalid='ignore'):
+                result = {'$gt': np.greater, '$gte': np.greater_equal,
+                          '$lt': np.less, '$lte': np.less_equal}[op](values, val)
+            return comparable & np.asarray(result, dtype=bool)
+        elif op == '$exists':
+            return self.present if val else ~self.present
+        elif op == '$not':
+            return ~self.evaluate(val)
+        raise QueryError('{} {}'.format(op, val))
+
+    def evaluate(self, conditions):
+        mask = np.ones(len(self.present), dtype=bool)
+        for op, val in conditions.items():
+            mask &= self.compare(op, val)
+        return mask
+
+
+def composition_counts(atoms_list):
+    '''Returns the number of atoms of each element (columns) in each Atoms object (rows)'''
+    counts = np.zeros((len(atoms_list), len(chemical_symbols)), dtype=int)
+    if atoms_list:
+        lengths = [len(atoms) for atoms in atoms_list]
+        rows = np.repeat(np.arange(len(atoms_list)), lengths)
+        numbers = np.concatenate([atoms.numbers for atoms in atoms_list])
+        np.add.at(counts, (rows, numbers), 1)
+    return counts
+
+
+class CompositionColumn(Column):
+    '''The "numbers" key, from the counts of composition_counts'''
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.present = np.ones(len(counts), dtype=bool)
+
+    def compare(self, op, val):
+        has = self.counts > 0
+        if not isinstance(val, (list, dict)):
+            val = [val]
+        if op == '$in':
+            return has[:, val].any(axis=1)
+        elif op == '$nin':
+            return ~has[:, val].any(axis=1)
+        elif op == '$all':
+            return has[:, val].all(axis=1)
+        elif op == '$not' and list(val) == ['$elemMatch'] and list(val['$elemMatch']) == ['$nin']:
+            # No elements other than the given ones
+            others = np.ones(len(chemical_symbols), dtype=bool)
+            others[val['$elemMatch']['$nin']] = False
+            return ~has[:, others].any(axis=1)
+        raise QueryError('numbers {} {}'.format(op, val))
+
+
+def columns(atoms_list, keys):
+    '''Reads the keys of a batch of Atoms objects into columns'''
+    cols = {}
+    composition = None
+    for key in keys:
+        if key == 'numbers' or element_count_key(key):
+            if composition is None:
+                composition = CompositionColumn(composition_counts(atoms_list))
+            if key == 'numbers':
+                cols[key] = composition
+            else:
+                cols[key] = Column(list(composition.counts[:, atomic_numbers[key[2:]]]))
+        else:
+            cols[key] = Column([atoms_value(atoms, key) for atoms in atoms_list])
+    return cols
+
+
+def evaluate(filter, cols, n):
+    '''Returns a boolean array of which of the n configurations match'''
+    mask = np.ones(n, dtype=bool)
+    for key, value in filter.items():
+        if key == '$and':
+            for sub_filter in value:
+                mask &= evaluate(sub_filter, cols, n)
+        elif key in ('$or', '$nor'):
+            matches = np.zeros(n, dtype=bool)
+            for sub_filter in value:
+                matches |= evaluate(sub_filter, cols, n)
+            mask &= matches if key == '$or' else ~matches
+        elif isinstance(value, dict):
+            mask &= cols[key].evaluate(value)
+        else:
+            mask &= cols[key].compare('$eq', value)
+    return mask
+
+
+def match(filter, atoms_list):
+    '''Returns a boolean array of which Atoms objects match the filter'''
+    return evaluate(filter, columns(atoms_list, referenced_keys(filter)), len(atoms_list))
+
+
+def filter_atoms(atoms_it, filter, batch_size=None):
+    '''Yields the Atoms objects from the iterator which match the filter'''
+    batch_size = batch_size or BATCH_SIZE
+    atoms_it = iter(atoms_it)
+    while True:
+        batch = list(islice(atoms_it, batch_size))
+        if not batch:
+            return
+        for i in np.flatnonzero(match(filter, batch)):
+            yield batch[i]
@@ -0,0 +1,95 @@
+"""
+Cursor which gets the Atoms objects of another cursor ahead of its
+consumer. Reading and decoding the next configurations (row2atoms,
+dict2atoms, ...) then runs in a background thread while the consumer works
+on the current ones, e.g. writes them to files:
+
+    for atoms in PrefetchCursor(backend.find(...), size=200):
+        ase_write(...)
+
+The thread holds the GIL while decoding, so the gain comes from what the
+consumer and the backend do without it: file and socket I/O, SQLite and
+numpy calls. Reading only overlaps, and size only bounds the memory
+used, if the cursor reads its rows as it is iterated, as those of the
+MongoDB and ASEdb backends do (the latter not within a transaction with
+uncommitted writes, whose rows it reads at once).
+"""
+
+import threading
+
+from six.moves import queue
+
+from .backend import Cursor
+
+# Number of items read ahead by default
+PREFETCH_SIZE = 100
+
+# Seconds between checks of whether the cursor was closed, while the
+# background thread waits for room in the queue
+POLL_INTERVAL = 0.1
+
+
+class PrefetchCursor(Cursor):
+    '''
+    Gets the items of another cursor in a background thread, at most size
+    items ahead of the consumer, and returns them in the same order. An
+    error raised by the other cursor is raised when its place is reached.
+    The other cursor must not be used while this one is.
+    '''
+    def __init__(self, cursor, size=PREFETCH_SIZE):
+        self.cursor = cursor
+        # Items are (True, item), or (False, error or None) at the end
+        self.queue = queue.Queue(max(size, 1))
+        self.stopped = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        '''Waits for room in the queue unless closed. Returns whether it put the item.'''
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        try:
+            for item in self.cursor:
+                if not self._put((True, item)):
+                    return
+        except Exception as e:
+            self._put((False, e))
+        else:
+            self._put((False, None))
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        ok, item = self.queue.get()
+        if ok:
+            return item
+        self.finished = True
+        self.thread.join()
+        if item is not None:
+            raise item
+        raise StopIteration
+
+    def next(self):
+        return self.__next__()
+
+    def count(self):
+        '''Counts the items left, reading them'''
+        n = 0
+        for item in self:
+            n += 1
+        return n
+
+    def close(self):
+        '''Stops reading ahead, when the rest of the items are not needed'''
+        self.stopped.set()
+        self.finished = True
+        self.thread.join()
@@ -1,8 +1,11 @@
 __author__ = 'Patrick Szmucer'
 
+import re
 import shlex
 from ase.data import chemical_symbols
 
+from .util import reduced_formula
+
 # This is a list of operators that can be used on the command line
 operators = ['=', '!=', '>', '>=', '<', '<=', '~']
 
@@ -63,8 +66,22 @@ def interpret(query):
         elif is_float(v):
             vals[i] = float(v)
 
+    if key == 'formula_reduced':
+        # Formulas are compared in their canonical form, e.g. WC -> CW
+        vals = [reduced_formula(str(v)) for v in vals]
+
     dct = {}
-    if operator == '=' and len(vals) == 1:
+    if key == 'elements' and operator in ('=', '!='):
+        # Searching will be done on the 'numbers' array
+        elements2numbers(vals)
+        if operator == '=':
+            # Exactly these elements: all of them and no other
+            dct['numbers'] = {'$all': vals,
+                              '$not': {'$elemMatch': {'$nin': vals}}}
+        else:
+            # None of these elements
+            dct['numbers'] = {'$nin': vals}
+    elif operator == '=' and len(vals) == 1:
         dct[key] = {'$eq': vals[0]}
     elif operator == '=':
         dct[key] = {'$in': vals}
@@ -113,21 +130,136 @@ def update(d1, d2):
             d1[k] = v
 
 
+# Tokens of expressions combining queries: parentheses, "|" (or), "&" (and)
+# and "!" (not, unless it is a part of "!=")
+token_re = re.compile(r'''\s*(?:(?P<symbol>[()|&]|!(?!=))|(?P<query>(?:"[^"]*"|'[^']*'|[^\s()|&"'])+))''')
+
+
+# Operators of queries, longest first, and the symbols of expressions
+operator_re = re.compile(r'!=|>=|<=|=|>|<|~')
+symbol_re = re.compile(r'[()|&]|!(?!=)')
+
+
+def is_expression(q):
+    """
+    Whether the string combines queries with parentheses, |, & or !. Only
+    symbols outside of the values count, so that queries such as
+    config_type=a(b) or name=foo! are not taken to be expressions.
+    """
+    try:
+        words = shlex.split(q)
+    except ValueError:
+        words = q.split()
+    for word in words:
+        ops = list(operator_re.finditer(word))
+        # The key of a single query, or the whole word
+        outside = word[:ops[0].start()] if len(ops) == 1 else word
+        if symbol_re.search(outside):
+            return True
+    return False
+
+
+def tokenize(q):
+    tokens = []
+    pos = 0
+    q = q.strip()
+    while pos < len(q):
+        match = token_re.match(q, pos)
+        if match is None or match.end() == pos:
+            raise QueryError(q)
+        if match.group('symbol'):
+            tokens.append(match.group('symbol'))
+        else:
+            # Remove quotes around values with spaces in them
+            tokens.append(('query', ''.join(shlex.split(match.group('query')))))
+        pos = match.end()
+    return tokens
+
+
+class Parser(object):
+    """
+    Parses an expression such as '(a=1 & b=2) | !c=3' into a filter in the
+    MongoDB format. Queries next to each other without an operator are
+    ANDed, & binds more tightly than | and ! applies to the following
+    query or parenthesised expression.
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.tokens = tokenize(q)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise QueryError('Unexpected end of the query: {}'.format(self.q))
+        self.pos += 1
+        return token
+
+    def parse(self):
+        filters = self.parse_or()
+        if self.peek() is not None:
+            raise QueryError('Unexpected "{}" in: {}'.format(self.peek(), self.q))
+        return filters
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.peek() == '|':
+            self.take()
+            terms.append(self.parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        return [{'$or': [join(term) for term in terms]}]
+
+    def parse_and(self):
+        """Returns a list of filters which are ANDed"""
+        filters = self.parse_not()
+        while self.peek() not in (None, '|', ')'):
+            if self.peek() == '&':
+                self.take()
+            filters += self.parse_not()
+        return filters
+
+    def parse_not(self):
+        token = self.take()
+        if token == '!':
+            return [{'$nor': [join(self.parse_not())]}]
+        elif token == '(':
+            filters = self.parse_or()
+            if self.take() != ')':
+                raise QueryError('Missing ")" in: {}'.format(self.q))
+            return filters
+        elif isinstance(token, tuple):
+            return [interpret(token[1])]
+        raise QueryError('Unexpected "{}" in: {}'.format(token, self.q))
+
+
+def join(filters):
+    """ANDs a list of filters into one"""
+    return filters[0] if len(filters) == 1 else {'$and': filters}
+
+
 def translate(queries_lst):
-    """Translates a list of queries to the MongoDB format"""
+    """
+    Translates a list of queries to the MongoDB format. Queries can be
+    combined with parentheses, | (or), & (and) and ! (not), e.g.
+    '(config_type=bulk & energy<0) | !elements~H', which gives $or and
+    $nor (a negation in MongoDB) filters.
+    """
 
     # Pre-process the queries. Take care to not split key values
     # with spaces in them.
-    queries = []
+    mongodb_query = {'$and': []}
     for q in queries_lst:
         # Check the number of operators in the query.
         n = sum([q.count(op) for op in operators]) - sum(q.count(op) for op in ['!=', '>=', '<='])
-        if n > 1:
-            queries += shlex.split(q)
+        if is_expression(q):
+            mongodb_query['$and'] += Parser(q).parse()
+        elif n > 1:
+            mongodb_query['$and'] += [interpret(query) for query in shlex.split(q)]
         else:
-            queries.append(q)
-
-    mongodb_query = {'$and': []}
-    for query in queries:
-        mongodb_query['$and'].append(interpret(query))
+            mongodb_query['$and'].append(interpret(q))
     return mongodb_query
@@ -4,15 +4,29 @@ __author__ = 'Martin Uhrin'
 class Result(object):
     def __init__(self, msg=None):
         self._msg = msg
+        self._lock_wait = 0.
 
     @property
     def msg(self):
         return self._msg
 
+    @property
+    def lock_wait(self):
+        """
+        Seconds the backend waited for other writers of the database before
+        it could write
+        """
+        return self._lock_wait
+
+    @lock_wait.setter
+    def lock_wait(self, seconds):
+        self._lock_wait = seconds
+
 
 class RemoveResult(Result):
-    def __init__(self, removed_count=1, msg=None):
+    def __init__(self, removed_count=1, removed_ids=None, msg=None):
         self._removed_count = removed_count
+        self._removed_ids = removed_ids
         super(RemoveResult, self).__init__(msg)
 
     @property
@@ -23,6 +37,13 @@ class RemoveResult(Result):
         """
         return self._removed_count
 
+    @property
+    def removed_ids(self):
+        """
+        The ids of removed entries, or None if the backend doesn't report them
+        """
+        return self._removed_ids
+
 
 class InsertResult(Result):
     def __init__(self, inserted_ids, skipped_ids, msg=None):
@@ -0,0 +1,205 @@
+"""
+State kept between the commands of the interactive shell (abcd DB --shell)
+and of batch files (abcd DB --batch FILE).
+
+The backend is opened and the user authenticated once for the whole
+session. Translated queries and the results of recent finds are cached,
+so repeating or refining a query (e.g. --show after a summary of the
+same selection) doesn't go back to the database. Only results of up to
+PAGE_SIZE configurations are cached, and every find gets copies of them.
+Any write empties the cache of results.
+"""
+
+import copy
+import json
+from collections import deque
+from itertools import islice
+
+from .backend import Cursor
+from .database import cached_filter
+from .filtering import referenced_keys
+from .query import QueryError, translate
+from .structurebox import StructureBox
+from .util import LRUCache
+
+# Largest number of Atoms objects of a result that is cached
+PAGE_SIZE = 1000
+
+
+class ListCursor(Cursor):
+    '''Cursor over copies of Atoms objects that have already been fetched'''
+    def __init__(self, atoms_list):
+        self.atoms_list = atoms_list
+        self.position = 0
+
+    def __next__(self):
+        if self.position == len(self.atoms_list):
+            raise StopIteration
+        self.position += 1
+        return copy.deepcopy(self.atoms_list[self.position - 1])
+
+    def next(self):
+        return self.__next__()
+
+    def count(self):
+        '''Counts the Atoms objects which are left, as the cursors of backends do'''
+        n = len(self.atoms_list) - self.position
+        self.position = len(self.atoms_list)
+        return n
+
+
+class ChainCursor(Cursor):
+    '''Cursor over Atoms objects already read from a cursor, followed by the rest of it'''
+    def __init__(self, atoms_list, cursor):
+        self.atoms_list = deque(atoms_list)
+        self.cursor = cursor
+
+    def __next__(self):
+        if self.atoms_list:
+            return self.atoms_list.popleft()
+        return next(self.cursor)
+
+    def next(self):
+        return self.__next__()
+
+    def count(self):
+        return len(self.atoms_list) + self.cursor.count()
+
+
+class ShellBox(StructureBox):
+    '''StructureBox which remembers the results of recent finds'''
+
+    def __init__(self, backend, pages=16, autocommit=True, page_size=PAGE_SIZE):
+        super(ShellBox, self).__init__(backend)
+        self.pages = LRUCache(pages)
+        self.page_size = page_size
+        self.autocommit = autocommit
+
+    def find(self, auth_token, filter, sort={}, limit=0, keys=None, omit_keys=False, workers=1):
+        page_key = json.dumps([filter, sort, limit, keys, omit_keys], sort_keys=True)
+        if page_key in self.pages:
+            return ListCursor(self.pages[page_key])
+        cursor = super(ShellBox, self).find(auth_token, filter, sort, limit, keys, omit_keys,
+                                            workers)
+        atoms_list = list(islice(cursor, self.page_size + 1))
+        if len(atoms_list) > self.page_size:
+            # Too large to be kept
+            return ChainCursor(atoms_list, cursor)
+        self.pages[page_key] = atoms_list
+        return ListCursor(atoms_list)
+
+    def _written(self, result):
+        self.pages.clear()
+        if self.autocommit:
+            self.backend.commit()
+        return result
+
+    def insert(self, auth_token, atoms, duplicates=None):
+        return self._written(super(ShellBox, self).insert(auth_token, atoms,
+                                                          duplicates))
+
+    def update(self, auth_token, atoms, upsert=False, replace=False):
+        return self._written(super(ShellBox, self).update(auth_token, atoms,
+                                                          upsert, replace))
+
+    def remove(self, auth_token, filter, just_one=True):
+        return self._written(super(ShellBox, self).remove(auth_token, filter,
+                                                          just_one))
+
+    def add_keys(self, auth_token, filter, kvp):
+        return self._written(super(ShellBox, self).add_keys(auth_token, filter,
+                                                            kvp))
+
+    def remove_keys(self, auth_token, filter, keys):
+        return self._written(super(ShellBox, self).remove_keys(auth_token,
+                                                               filter, keys))
+
+    def create_index(self, auth_token, keys):
+        return self._written(super(ShellBox, self).create_index(auth_token, keys))
+
+    def drop_index(self, auth_token, keys):
+        return self._written(super(ShellBox, self).drop_index(auth_token, keys))
+
+
+class Session(object):
+    '''An open backend together with the caches of the shell'''
+
+    def __init__(self, backend, queries=128, pages=16, autocommit=True):
+        """
+        If autocommit is False, writes are left to be committed (or rolled
+        back) by the caller.
+        """
+        self.box = ShellBox(backend, pages, autocommit)
+        self.token = None
+        self._queries = LRUCache(queries)
+        backend.open()
+
+    def translate(self, queries_lst):
+        return cached_filter(self._queries, queries_lst)
+
+    def close(self):
+        self.box.backend.close()
+
+
+def command_action(args):
+    '''
+    Returns the name of the action a parsed command performs. The order
+    is the one in which cli.run() checks the options.
+    '''
+    for action in ('remove', 'write_to_file', 'extract_original_files',
+                   'store', 'update', 'add_keys', 'remove_keys', 'create_index',
+                   'drop_index', 'list_indexes', 'group_by', 'stats', 'count', 'ids', 'show',
+                   'long', 'list'):
+        if getattr(args, action):
+            return action
+    return 'summary'
+
+
+def changed_keys(args):
+    '''Returns the set of keys an --add-keys or --remove-keys command writes'''
+    action = command_action(args)
+    return set(item.split('=')[0].strip() for item in getattr(args, action).split(','))
+
+
+def can_merge(first, args):
+    '''
+    Whether the command can be merged into the group starting with first.
+    Commands are only merged if it gives the same result as running them
+    one after the other: all options other than the keys are the same and
+    the keys don't change which configurations the query selects.
+    '''
+    action = command_action(args)
+    if action not in ('add_keys', 'remove_keys') or command_action(first) != action:
+        return False
+    options = dict(vars(args), **{action: None})
+    if options != dict(vars(first), **{action: None}):
+        return False
+    try:
+        query_keys = referenced_keys(translate(list(args.query)))
+    except QueryError:
+        return False
+    return not (changed_keys(first) | changed_keys(args)) & query_keys
+
+
+def group_commands(commands):
+    '''
+    Takes a list of parsed commands and groups consecutive ones that can be
+    run as a single command (see can_merge). Returns a list of lists of
+    indices into commands.
+    '''
+    groups = []
+    for i, args in enumerate(commands):
+        if groups and can_merge(commands[groups[-1][0]], args):
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    return groups
+
+
+def merge_commands(commands):
+    '''Merges commands grouped by group_commands into one'''
+    merged = copy.copy(commands[0])
+    if len(commands) > 1:
+        action = command_action(merged)
+        setattr(merged, action, ','.join(getattr(args, action) for args in commands))
+    return merged
@@ -10,7 +10,7 @@ class StructureBox(object):
             self.did_open = False
 
         def __enter__(self):
-            if not self.backend.is_open:
+            if not self.backend.is_open():
                 self.backend.open()
                 self.did_open = True
             return self.backend
@@ -31,17 +31,31 @@ class StructureBox(object):
         with StructureBox.BackendOpen(self.backend):
             return self.backend.authenticate(credentials)
 
-    def insert(self, auth_token, atoms):
+    def insert(self, auth_token, atoms, duplicates=None):
         with StructureBox.BackendOpen(self.backend):
-            return self.backend.insert(auth_token, atoms)
+            if duplicates is None:
+                return self.backend.insert(auth_token, atoms)
+            return self.backend.insert(auth_token, atoms, duplicates)
 
     def update(self, auth_token, atoms, upsert=False, replace=False):
         with StructureBox.BackendOpen(self.backend):
             return self.backend.update(auth_token, atoms, upsert, replace)
 
-    def find(self, auth_token, filter, sort={}, limit=0, keys=None, omit_keys=False):
+    def find(self, auth_token, filter, sort={}, limit=0, keys=None, omit_keys=False, workers=1):
         with StructureBox.BackendOpen(self.backend):
-            return self.backend.find(auth_token, filter, sort, limit, keys, omit_keys)
+            if workers == 1:
+                return self.backend.find(auth_token, filter, sort, limit, keys, omit_keys)
+            return self.backend.find(auth_token, filter, sort, limit, keys, omit_keys, workers)
+
+    def count(self, auth_token, filter, limit=0):
+        with StructureBox.BackendOpen(self.backend):
+            if limit == 0:
+                return self.backend.count(auth_token, filter)
+            return self.backend.count(auth_token, filter, limit)
+
+    def explain(self, auth_token, filter, sort={}, limit=0):
+        with StructureBox.BackendOpen(self.backend):
+            return self.backend.explain(auth_token, filter, sort, limit)
 
     def remove(self, auth_token, filter, just_one=True):
         with StructureBox.BackendOpen(self.backend):
@@ -53,4 +67,24 @@ class StructureBox(object):
 
     def remove_keys(self, auth_token, filter, keys):
         with StructureBox.BackendOpen(self.backend):
-            return self.backend.remove_keys(auth_token, filter, keys)
\ No newline at end of file
+            return self.backend.remove_keys(auth_token, filter, keys)
+
+    def key_statistics(self, auth_token):
+        with StructureBox.BackendOpen(self.backend):
+            return self.backend.key_statistics(auth_token)
+
+    def aggregate(self, auth_token, filter, group_by, metrics, bins=0):
+        with StructureBox.BackendOpen(self.backend):
+            return self.backend.aggregate(auth_token, filter, group_by, metrics, bins)
+
+    def create_index(self, auth_token, keys):
+        with StructureBox.BackendOpen(self.backend):
+            return self.backend.create_index(auth_token, keys)
+
+    def list_indexes(self, auth_token):
+        with StructureBox.BackendOpen(self.backend):
+            return self.backend.list_indexes(auth_token)
+
+    def drop_index(self, auth_token, keys):
+        with StructureBox.BackendOpen(self.backend):
+            return self.backend.drop_index(auth_token, keys)
@@ -166,22 +166,12 @@ def print_keys_table(atoms_list, border=True, truncate=True, show_keys=[], omit_
         print('  Nothing to display')
         return
 
-    union = set()
-    intersection = set(dicts[0].keys())
     counter = collections.Counter()
     for dct in dicts:
-        keys = set(dct.keys())
-        counter.update(keys)
-        union = union | keys
-        intersection = intersection & keys
-    intersection = sorted(list(intersection))
-    union = sorted(list(union))
-
-    intersection = filter_keys(intersection, show_keys, omit_keys)
-    union = filter_keys(union, show_keys, omit_keys)
+        counter.update(dct.keys())
 
     ranges = {}
-    for key in union:
+    for key in filter_keys(list(counter), show_keys, omit_keys):
         # Find the minimum for this key
         values = []
         for dct in dicts:
@@ -193,6 +183,36 @@ def print_keys_table(atoms_list, border=True, truncate=True, show_keys=[], omit_
             rang = ('...', '...')
         ranges[key] = rang
 
+    print_summary(len(dicts), counter, ranges, border, truncate, show_keys, omit_keys)
+
+
+def print_key_statistics(stats, border=True, truncate=True, show_keys=[], omit_keys=[]):
+    '''
+    Prints the same tables as print_keys_table from statistics of the keys
+    kept by the backend (see Backend.key_statistics)
+    '''
+    if stats['rows'] == 0:
+        print('  Nothing to display')
+        return
+
+    counter = {key: s['count'] for key, s in stats['keys'].items()}
+    # The backend may not know the range of some keys, e.g. of text values
+    ranges = {key: tuple('...' if v is None else v for v in (s['min'], s['max']))
+              for key, s in stats['keys'].items()}
+    print_summary(stats['rows'], counter, ranges, border, truncate, show_keys, omit_keys)
+
+
+def print_summary(no_rows, counter, ranges, border=True, truncate=True, show_keys=[], omit_keys=[]):
+    '''
+    Prints the Intersection and Union tables, given the number of
+    configurations which have each key and the range of its values
+    '''
+    union = sorted(counter)
+    intersection = [key for key in union if counter[key] == no_rows]
+
+    intersection = filter_keys(intersection, show_keys, omit_keys)
+    union = filter_keys(union, show_keys, omit_keys)
+
     if truncate:
         max_key_len = 50
         max_val_len = 40
@@ -230,7 +250,7 @@ def print_keys_table(atoms_list, border=True, truncate=True, show_keys=[], omit_
 
     comment = '' if border else '# '
     s = ''
-    s += '\n' + comment + 'ROWS: {}'.format(len(dicts)) + '\n'
+    s += '\n' + comment + 'ROWS: {}'.format(no_rows) + '\n'
     s += '\n' + comment + 'INTERSECTION'
     s += '\n' + comment + table_string(intersection) + '\n'
     s += '\n' + comment + 'UNION'
@@ -238,6 +258,58 @@ def print_keys_table(atoms_list, border=True, truncate=True, show_keys=[], omit_
     print(s)
 
 
+def print_aggregate(entries, group_by, metrics, border=True, truncate=True):
+    '''
+    Prints a table with a row for each group of Backend.aggregate: the
+    values of the group_by keys, the number of configurations and the
+    mean, min and max of each of the metrics. Histograms follow the table.
+    '''
+    if not entries:
+        print('  Nothing to display')
+        return
+
+    max_val_len = 12 if truncate else 100
+
+    def number(value):
+        if value is None:
+            return '-'
+        return trim('{:.6g}'.format(value), max_val_len)
+
+    headers = list(group_by) + ['Rows']
+    for key in metrics:
+        headers += ['{} ({})'.format(key, stat) for stat in ('n', 'mean', 'min', 'max')]
+    t = PrettyTable(headers)
+    if border:
+        t.padding_width = 0
+        t.border = True
+    else:
+        t.padding_width = 1
+        t.border = False
+        t.align = 'l'
+
+    for entry in entries:
+        row = [trim(format_value(value, key), max_val_len) for key, value in entry['group'].items()]
+        row.append(entry['count'])
+        for key in metrics:
+            stats = entry['stats'][key]
+            row += [stats['count'], number(stats['mean']), number(stats['min']), number(stats['max'])]
+        t.add_row(row)
+    print(t.get_string())
+
+    for key in metrics:
+        if 'histogram' not in entries[0]['stats'][key]:
+            continue
+        edges = entries[0]['stats'][key]['histogram']['edges']
+        if not edges:
+            continue
+        print('\nHistogram of {} (bins from {} to {}):'.format(key, number(edges[0]),
+                                                              number(edges[-1])))
+        for entry in entries:
+            group = ' '.join('{}={}'.format(k, v) for k, v in entry['group'].items())
+            counts = entry['stats'][key]['histogram']['counts']
+            print('  {}{}'.format(group + ': ' if group else '', ' '.join(str(c) for c in counts)))
+
+
 def print_long_row(atoms):
     '''Prints full information about one configuration'''
 
@@ -1,11 +1,180 @@
 __author__ = 'Martin Uhrin, Patrick Szmucer'
 
+import hashlib
+import threading
 import numpy as np
+from collections import OrderedDict
+from random import randint
 from ase.atoms import Atoms
-from ase.calculators.calculator import get_calculator, all_properties
+from ase.calculators.calculator import all_properties
 from ase.calculators.singlepoint import SinglePointCalculator
+from ase.data import chemical_symbols
+from ase.formula import Formula
+from ase.neighborlist import neighbor_list
 from six import string_types
 
+# Distance (A) up to which the interatomic distances are in the fingerprint
+FINGERPRINT_CUTOFF = 6.0
+
+
+class LRUCache(object):
+    '''A small dictionary-like cache which discards the least recently
+        used entries once it holds more than "size" of them. It can be
+        shared by several threads.'''
+
+    def __init__(self, size=128):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, key):
+        # Move the entry to the end so it is discarded last
+        with self._lock:
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def is_number_string(s):
+    '''Whether the string reads as a number, e.g. "123" or "6e81"'''
+    try:
+        float(s)
+    except ValueError:
+        return False
+    return True
+
+
+def random_uid():
+    '''
+    Returns a random uid. Hexadecimal strings which read as numbers are
+    avoided, because ASEdb doesn't store such strings as text.
+    '''
+    while True:
+        uid = '%x' % randint(16**14, 16**15 - 1)
+        if not is_number_string(uid):
+            return uid
+
+
+def short_digest(sha):
+    '''
+    Returns 15 hexadecimal digits of the hash, the first ones which don't
+    read as a number (see random_uid)
+    '''
+    digest = sha.hexdigest()
+    for i in range(len(digest) - 14):
+        if not is_number_string(digest[i:i + 15]):
+            return digest[i:i + 15]
+    return digest[:15]
+
+
+def content_uid(atoms, decimals=6):
+    '''
+    Returns a uid which is a hash of the atomic numbers, positions, cell, pbc
+    and calculated properties of the configuration. Storing the same
+    configuration twice therefore gives the same uid. Floating point values
+    are rounded to "decimals" decimal places first.
+    '''
+    sha = hashlib.sha1()
+
+    def add(value, dtype):
+        value = np.asarray(value, dtype=dtype)
+        if dtype == np.float64:
+            # Adding 0.0 turns -0.0 into 0.0
+            value = np.round(value, decimals) + 0.0
+        sha.update(np.ascontiguousarray(value).tobytes())
+
+    add(atoms.numbers, np.int64)
+    add(atoms.positions, np.float64)
+    add(atoms.cell, np.float64)
+    add(atoms.pbc, np.int8)
+    if atoms.calc is not None:
+        for name, value in sorted(atoms.calc.results.items()):
+            sha.update(name.encode())
+            add(value, np.float64)
+    return short_digest(sha)
+
+
+def fingerprint(atoms, tolerance=1e-3):
+    '''
+    Returns a fingerprint of the structure which doesn't change when the
+    atoms are permuted or translated (or the whole structure is rotated).
+    It is a hash of the composition, the pbc, the lengths and angles of
+    the cell and the sorted interatomic distances up to FINGERPRINT_CUTOFF
+    (with those to periodic images), which are found with a neighbour list.
+    Lengths are rounded to multiples of "tolerance" first, so configurations
+    which differ by less than it usually (but not always, at the rounding
+    boundaries) share the fingerprint.
+    '''
+    sha = hashlib.sha1()
+    numbers, counts = np.unique(atoms.numbers, return_counts=True)
+    sha.update(np.ascontiguousarray([numbers, counts], dtype=np.int64).tobytes())
+    sha.update(np.ascontiguousarray(atoms.pbc, dtype=np.int8).tobytes())
+
+    def add(lengths):
+        lengths = np.round(np.asarray(lengths, dtype=np.float64) / tolerance)
+        sha.update(np.ascontiguousarray(lengths.astype(np.int64)).tobytes())
+
+    if atoms.pbc.any():
+        cellpar = atoms.cell.cellpar()
+        add(cellpar[:3])
+        # Angles in degrees, rounded on the same scale as the lengths
+        add(cellpar[3:])
+    if len(atoms) > 1:
+        add(np.sort(neighbor_list('d', atoms, FINGERPRINT_CUTOFF)))
+    return short_digest(sha)
+
+
+def element_counts(numbers):
+    '''
+    Returns the numbers of atoms of each element as a dictionary with keys
+    "n_<symbol>", e.g. {'n_H': 2, 'n_O': 1} for water
+    '''
+    Zs, counts = np.unique(numbers, return_counts=True)
+    return {'n_' + chemical_symbols[Z]: int(n) for Z, n in zip(Zs, counts)}
+
+
+def reduced_formula(formula):
+    '''
+    Returns the reduced formula (in the Hill order) of a formula given as
+    a string or a list of atomic numbers, e.g. "CW" for "W2C2"
+    '''
+    if not isinstance(formula, string_types):
+        formula = Formula.from_list([chemical_symbols[Z] for Z in formula])
+    else:
+        formula = Formula(formula)
+    if len(formula) == 0:
+        return ''
+    return formula.reduce()[0].format('hill')
+
+
+# Ways of generating uids for new configurations
+uid_schemes = {
+    'random': lambda atoms: random_uid(),
+    'content': content_uid}
+
 
 def filter_keys(keys_list, keys, omit_keys):
     '''Decides which keys to show given keys and omit_keys'''
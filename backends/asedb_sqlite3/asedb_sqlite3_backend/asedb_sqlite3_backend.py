@@ -1,29 +1,105 @@
 __author__ = 'Patrick Szmucer'
 
+import copy
 import glob
 import json
+import multiprocessing
 import numpy as np
 import os
 import re
+import sqlite3
+import time
 import abcd.backend
 import abcd.results as results
+from abcd.aggregation import group_entry, group_order, key_stats, overall_range, set_histograms
 from abcd.authentication import AuthenticationError
-from abcd.backend import Backend, ReadError, WriteError
+from abcd.backend import Backend, ReadError, RemoteCall, WriteError
+from abcd.derived import derived_keys
+from abcd.filtering import CompositionColumn, Column, evaluate, referenced_keys
 from abcd.query import QueryError, translate
-from abcd.util import get_info_and_arrays, atoms2dict, dict2atoms, filter_keys
+from abcd.util import (LRUCache, get_info_and_arrays, atoms2dict, dict2atoms, filter_keys, random_uid,
+                       fingerprint, reduced_formula)
 from ase.atoms import Atoms
 from ase.calculators.calculator import all_properties
 from ase.calculators.singlepoint import SinglePointCalculator
+from ase.data import chemical_symbols
 from ase.db import connect
+from ase.db.core import check, now
+from ase.db.sqlite import all_tables
 from ase.utils import plural
 from base64 import b64encode
-
-from .mongodb2asedb import translate_query
-from random import randint
-from .remote import communicate_with_remote
+from contextlib import contextmanager
+from six import string_types
+
+from .catalog import backfill_statements, catalog_statements, merge_entries, refresh_query
+from .mongodb2sql import (Plan, aggregate_sql, composition_backfill, composition_statements,
+                          drop_index_statements, group_value, histogram_sql, index_statements,
+                          indexed_key, order_by, pbc_string, placeholders, query_shape,
+                          quote_identifier, species_key, system_columns, value_table,
+                          X_BIT)
+from .locking import begin_immediate, hand_over
+from .pool import ConnectionPool
+from .remote import communicate_with_remote, interpret_response, ssh_args
 from .util import get_dbs_path, reserved_usernames
 
 
+# Number of compiled queries each backend remembers
+PLAN_CACHE_SIZE = 256
+
+# Number of ids put into one statement when working on chunks of rows.
+# SQLite allows at most 999 variables in a statement.
+CHUNK_SIZE = 500
+
+
+# Number of configurations inserted or updated in one transaction, after
+# which other writers can take the lock of the database
+WRITE_BATCH_SIZE = 500
+
+# Number of chunks find(..., workers=N) gives to each of the processes, at least
+WORKER_CHUNKS = 4
+
+
+def chunks(lst, size=None):
+    size = size or CHUNK_SIZE
+    for i in range(0, len(lst), size):
+        yield lst[i:i + size]
+
+
+# Version of the changes this backend makes to the data in the database.
+# It is kept in the "information" table of ASEdb, as "abcd_version".
+SCHEMA_VERSION = 6
+
+# Statements adding to the ASEdb schema what this backend needs. They are
+# run whenever a writable database is opened.
+schema_statements = [
+    # Lookups of configurations by uid and fingerprint use an index. It only
+    # holds these keys: text values can be large (e.g. original_files).
+    "CREATE INDEX IF NOT EXISTS text_uid_index ON text_key_values(value, id) WHERE key='uid'",
+    "CREATE INDEX IF NOT EXISTS text_fingerprint_index ON text_key_values(value, id) "
+    "WHERE key='fingerprint'",
+    # Queries on numeric keys, such as the derived ones, use an index. It
+    # covers the ids, so conditions on the values are answered from it alone.
+    'CREATE INDEX IF NOT EXISTS number_value_index ON number_key_values(key, value, id)']
+
+
+def query_plan(cur, sql, args):
+    '''
+    Returns the lines of SQLite's EXPLAIN QUERY PLAN for the statement,
+    indented to show which steps belong to which
+    '''
+    depths = {}
+    lines = []
+    for row in cur.execute('EXPLAIN QUERY PLAN ' + sql, args):
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            # Rows are (selectid, order, from, detail), without the tree
+            lines.append(row[-1])
+            continue
+        id, parent, notused, detail = row
+        depths[id] = depths.get(parent, -1) + 1
+        lines.append('  ' * depths[id] + detail)
+    return lines
+
+
 def row2atoms(row, keys, omit_keys):
     """
     keys: keys to show. None for all
@@ -55,6 +131,71 @@ def row2atoms(row, keys, omit_keys):
     return atoms
 
 
+def writable_copy(atoms):
+    '''
+    Copy of the Atoms object whose info, arrays and calculator results can
+    be changed without changing the original. The values are shared.
+    '''
+    new = copy.copy(atoms)
+    new.info = dict(atoms.info)
+    new.arrays = dict(atoms.arrays)
+    if atoms.calc is not None:
+        new.calc = copy.copy(atoms.calc)
+        new.calc.results = dict(atoms.calc.results)
+    return new
+
+
+def decode_rows(task):
+    '''
+    Returns the Atoms objects of the rows with the given ids of the
+    database, in the order of the ids. Runs in the worker processes of
+    find, each reading through a connection of its own.
+    '''
+    filename, ids, keys, omit_keys = task
+    db = connect(filename, type='db')
+    con = db._connect()
+    try:
+        db._initialize(con)
+        sql = 'SELECT * FROM systems WHERE id IN ({})'.format(placeholders(len(ids)))
+        rows = {}
+        for values in con.execute(sql, ids):
+            row = db._convert_tuple_to_row(tuple(values))
+            rows[row.id] = row
+    finally:
+        con.close()
+    return [row2atoms(rows[id], keys, omit_keys) for id in ids if id in rows]
+
+
+def decode_in_chunks(filename, ids, keys, omit_keys):
+    '''
+    Yields the Atoms objects of the rows with the ids, in their order,
+    reading CHUNK_SIZE rows at a time when they are needed. The rows are
+    read by the thread iterating, e.g. that of abcd.prefetch.PrefetchCursor.
+    '''
+    for chunk in chunks(ids):
+        for atoms in decode_rows((filename, chunk, keys, omit_keys)):
+            yield atoms
+
+
+def decode_in_processes(filename, ids, keys, omit_keys, workers):
+    '''
+    Yields the Atoms objects of the rows with the ids, in their order,
+    decoded by a pool of worker processes in chunks of ids
+    '''
+    if not ids:
+        return
+    # Small enough chunks for each worker to get several
+    size = max(1, min(CHUNK_SIZE, -(-len(ids) // (workers * WORKER_CHUNKS))))
+    pool = multiprocessing.Pool(workers)
+    try:
+        tasks = [(filename, chunk, keys, omit_keys) for chunk in chunks(ids, size)]
+        for atoms_list in pool.imap(decode_rows, tasks):
+            for atoms in atoms_list:
+                yield atoms
+    finally:
+        pool.terminate()
+
+
 class ASEdbSQlite3Backend(Backend):
 
     class Cursor(abcd.backend.Cursor):
@@ -84,14 +225,33 @@ class ASEdbSQlite3Backend(Backend):
         return func_wrapper
 
     def read_only(func):
+        '''
+        Decorates methods which write. Their writes are done in a transaction
+        holding the write lock of the database, see _writing, and the result
+        tells how long they waited for it.
+        '''
         def func_wrapper(*args, **kwargs):
             if args[0].readonly:
                 raise WriteError('No write access')
-            else:
+            elif args[0].remote:
                 return func(*args, **kwargs)
+            with args[0]._writing():
+                result = func(*args, **kwargs)
+                if isinstance(result, results.Result):
+                    result.lock_wait = args[0].lock_wait
+                return result
         return func_wrapper
 
-    def __init__(self, database=None, user=None, password=None, remote=None):
+    def __init__(self, database=None, user=None, password=None, remote=None, pooled=False):
+        '''
+        pooled: make the backend safe to use from several threads at once.
+        Each thread reads through its own SQLite connection and writes go
+        through a single connection, one call at a time, see pool.py. The
+        database is switched to WAL journaling, so reads are not blocked
+        by writes. Each write is committed at the end of the call, unless
+        the thread called begin().
+        '''
+
         if user == 'all':
             raise RuntimeError('Invalid username: '.format('all'))
         self.user = user
@@ -100,6 +260,24 @@ class ASEdbSQlite3Backend(Backend):
         self.root_dir = None
         self.remote = remote
         self.readonly = True
+        self.in_transaction = False
+        # Whether the database has the "abcd_composition" table
+        self.composition = False
+        # Whether the database has the "abcd_catalog" table
+        self.catalog = False
+        # Keys stored in columns of "systems" which have an index
+        self.indexed = frozenset()
+        # Compiled queries, see _split
+        self.plans = LRUCache(PLAN_CACHE_SIZE)
+        # Connections of the pooled mode
+        self.pool = None
+        # Whether remote calls are returned instead of done, see remote_calls
+        self.deferred = False
+        # Connection of the transaction of the current write, if this backend
+        # began it (see _writing)
+        self.batch = None
+        # Seconds the last write waited for other writers to finish
+        self.lock_wait = 0.
 
         # Get the user. If the script is running locally, we have access
         # to all databases.
@@ -124,6 +302,10 @@ class ASEdbSQlite3Backend(Backend):
                 raise RuntimeError('The database name can only contain alphanumeric characters and underscores.')
             self.database = self.database + '.db'
             self.connect_to_database()
+            if pooled and not self.remote:
+                self.pool = ConnectionPool(self.connection.filename, wal=not self.readonly)
+        # Each remote call runs a process of its own
+        self.thread_safe = self.pool is not None or bool(self.remote)
 
         # Check if the $databases/all directory exists.
         all_path = os.path.join(self.dbs_path, 'all')
@@ -134,42 +316,132 @@ class ASEdbSQlite3Backend(Backend):
         super(ASEdbSQlite3Backend, self).__init__()
 
     def _select(self, query, sort={}, limit=0):
-        query = translate_query(query)
+        '''Returns the rows matching the MongoDB query'''
+        sql, args, rest = self._select_sql(query, sort, limit)
+        with self._cursor() as cur:
+            if rest is None:
+                return self._fetch_rows(cur, sql, args)
+            return self._fetch_ids(cur, self._select_ids(cur, query, sort, limit))
+
+    def _select_sql(self, query, sort={}, limit=0, columns='systems.*'):
+        '''
+        Returns the SQL selecting the rows for _select, its arguments and
+        the part of the query left to be evaluated on the rows (or None)
+        '''
+        where, args, rest = self._split(query)
+        sql = 'SELECT {} FROM systems WHERE '.format(columns) + where
         if sort == {}:
-            sort = 'id'
-            reverse = False
+            sql += ' ORDER BY systems.id'
         else:
             # This backend does not support multicolumn sorting.
             # Only sort by first column.
-            sort, direction = next(iter(sort.items()))
-            if direction == abcd.Direction.ASCENDING:
-                reverse = False
-            else:
-                reverse = True
-        rows = []
-        ids = []
-        for q in query:
-            rows_iter = self.connection.select(q, sort=sort, limit=limit)
-            for row in rows_iter:
-                if 'uid' not in row.key_value_pairs:
-                    rows.append(row)
-                elif row.key_value_pairs['uid'] not in ids:
-                    rows.append(row)
-                    ids.append(row.key_value_pairs['uid'])
-
-        # Because a union was created, items are not in a sorted order
-        # anymore.
-        if sort:
-            rows.sort(key=lambda x: getattr(x, sort), reverse=reverse)
-
-        if limit != 0 and len(rows) > limit:
-            return rows[:limit]
-        else:
-            return rows
+            key, direction = next(iter(sort.items()))
+            order = 'ASC' if direction == abcd.Direction.ASCENDING else 'DESC'
+            sql += ' ORDER BY {} {}, systems.id'.format(order_by(key), order)
+        if limit != 0 and rest is None:
+            sql += ' LIMIT {}'.format(int(limit))
+        return sql, args, rest
+
+    def _fetch_rows(self, cur, sql, args):
+        cur.execute(sql, args)
+        return [self.connection._convert_tuple_to_row(tuple(values))
+                for values in cur.fetchall()]
+
+    def _fetch_ids(self, cur, ids):
+        '''Returns the rows with the ids, in their order'''
+        rows = {}
+        for chunk in chunks(ids):
+            sql = 'SELECT systems.* FROM systems WHERE id IN ({})'.format(placeholders(len(chunk)))
+            rows.update((row.id, row) for row in self._fetch_rows(cur, sql, chunk))
+        return [rows[id] for id in ids]
+
+    def _split(self, filter):
+        '''
+        Returns the SQL condition for the filter, its arguments and the
+        part of the filter which couldn't be translated to SQL (or None).
+        Filters which differ only in the compared values share a compiled
+        Plan, so for them only the arguments are worked out.
+        '''
+        key = (self.composition, self.indexed, query_shape(filter))
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = Plan(filter, self.composition, self.indexed)
+            self.plans[key] = plan
+        args, rest = plan.bind(filter)
+        return plan.where, args, rest
+
+    def _filter_ids(self, cur, ids, filter):
+        '''
+        Returns the ids of the rows which match the filter, see
+        abcd.filtering. Only the values of the keys it compares are read,
+        the rows aren't decoded.
+        '''
+        keys = sorted(referenced_keys(filter))
+        value_keys = [key for key in keys if key != 'numbers']
+        columns = ', '.join(['systems.id'] + [group_value(key) for key in value_keys])
+        selected = []
+        for chunk in chunks(ids):
+            cur.execute('SELECT {} FROM systems WHERE id IN ({})'.format(
+                columns, placeholders(len(chunk))), chunk)
+            values = {row[0]: row[1:] for row in cur.fetchall()}
+            cols = {}
+            for i, key in enumerate(value_keys):
+                column = [values[id][i] for id in chunk]
+                if key == 'pbc':
+                    column = [None if v is None else pbc_string(v) for v in column]
+                cols[key] = Column(column)
+            if 'numbers' in keys:
+                cols['numbers'] = CompositionColumn(self._composition_counts(cur, chunk))
+            mask = evaluate(filter, cols, len(chunk))
+            selected += [id for id, selected_id in zip(chunk, mask) if selected_id]
+        return selected
+
+    def _composition_counts(self, cur, ids):
+        '''Returns the number of atoms of each element in the rows, as abcd.filtering does'''
+        counts = np.zeros((len(ids), len(chemical_symbols)), dtype=int)
+        rows = {id: i for i, id in enumerate(ids)}
+        cur.execute('SELECT id, Z, n FROM species WHERE id IN ({})'.format(placeholders(len(ids))),
+                    ids)
+        for id, Z, n in cur.fetchall():
+            counts[rows[id], Z] = n
+        return counts
+
+    def _select_ids(self, cur, filter, sort={}, limit=0):
+        '''Returns the ids of the rows matching the filter'''
+        sql, args, rest = self._select_sql(filter, sort, limit, columns='systems.id')
+        ids = [row[0] for row in cur.execute(sql, args)]
+        if rest is not None:
+            # Conditions which SQL can't express are evaluated on the values
+            # of the keys they compare
+            ids = self._filter_ids(cur, ids, rest)
+            if limit != 0:
+                ids = ids[:limit]
+        return ids
+
+    def _remote(self, command, decode=None):
+        '''
+        Sends the command to the remote server and returns the response,
+        made into the result by decode if given
+        '''
+        if self.deferred:
+            def decode_output(stdout, stderr):
+                response = interpret_response(stdout, stderr)
+                return decode(response) if decode else response
+            return RemoteCall(ssh_args(self.remote), command, decode_output)
+
+        response = communicate_with_remote(self.remote, command)
+        return decode(response) if decode else response
+
+    def remote_calls(self):
+        if not self.remote:
+            return None
+        backend = copy.copy(self)
+        backend.deferred = True
+        return backend
 
     def list(self, auth_token):
         if self.remote:
-            dbs = communicate_with_remote(self.remote, 'list')
+            return self._remote('list', lambda dbs: [os.path.basename(db) for db in dbs])
         else:
             dbs_write = glob.glob(os.path.join(self.root_dir, '*.db'))
             dbs_read = glob.glob(os.path.join(self.root_dir + '_readonly', '*.db'))
@@ -231,6 +503,142 @@ class ASEdbSQlite3Backend(Backend):
             self.connection = connect(read_db_path)
             self.readonly = True
 
+        if self.readonly:
+            with self._cursor() as cur:
+                self._read_schema(cur)
+            return
+
+        # Opening doesn't wait for other writers, unless the database has to
+        # be upgraded. Processes opening it at the same time upgrade it one
+        # after the other, each checking again once it holds the lock.
+        with self._cursor() as cur:
+            self._read_schema(cur)
+            if self._up_to_date(cur):
+                return
+        with self._writing():
+            with self._cursor() as cur:
+                self._read_schema(cur)
+                if self._up_to_date(cur):
+                    return
+                for statement in schema_statements + composition_statements + catalog_statements():
+                    cur.execute(statement)
+                if not self.composition:
+                    # Rows written before the table was created
+                    cur.execute(composition_backfill)
+                    self.composition = True
+                if not self.catalog:
+                    for statement in backfill_statements():
+                        cur.execute(statement)
+                    self.catalog = True
+                self._migrate(cur)
+
+    def _schema_version(self, cur):
+        '''Returns the version of the changes made to the database, see SCHEMA_VERSION'''
+        cur.execute("SELECT value FROM information WHERE name='abcd_version'")
+        row = cur.fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def _up_to_date(self, cur):
+        '''Whether the database has what this version of the backend needs'''
+        return self.composition and self.catalog and self._schema_version(cur) >= SCHEMA_VERSION
+
+    def _read_schema(self, cur):
+        '''Finds out which of the tables and indexes of this backend the database has'''
+        cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='abcd_composition'")
+        self.composition = cur.fetchone()[0] > 0
+        cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='abcd_catalog'")
+        self.catalog = cur.fetchone()[0] > 0
+        self.indexed = self._indexed_columns(cur)
+
+    def _migrate(self, cur):
+        '''
+        Brings rows written by older versions of this backend (or by ASE
+        directly) up to SCHEMA_VERSION. Runs in a write of its own (see
+        _writing) and commits rows in batches, so other writers can get in
+        between. The steps can be run again if they are interrupted.
+        '''
+        version = self._schema_version(cur)
+        if version >= SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            # Reduced formulas, grouped so each one is set in one go
+            cur.execute("SELECT id, Z, n FROM species WHERE id NOT IN "
+                        "(SELECT id FROM keys WHERE key='formula_reduced') ORDER BY id")
+            counts = {}
+            for id, Z, n in cur.fetchall():
+                counts.setdefault(id, []).extend([Z] * n)
+            formulas = {}
+            for id, numbers in counts.items():
+                formulas.setdefault(reduced_formula(numbers), []).append(id)
+            cur.execute('CREATE TEMP TABLE IF NOT EXISTS selection (id INTEGER PRIMARY KEY)')
+            for formula, ids in formulas.items():
+                cur.execute('DELETE FROM selection')
+                cur.executemany('INSERT INTO selection VALUES (?)', [(id,) for id in ids])
+                self._set_selection_kvp(cur, {'formula_reduced': formula})
+
+        if version < 2:
+            # Derived keys need the arrays of the rows
+            cur.execute('SELECT id FROM systems ORDER BY id')
+            self._backfill_keys(cur, [row[0] for row in cur.fetchall()], derived_keys)
+
+        if version < 3:
+            # The index of all text values is replaced by those of schema_statements,
+            # and the catalog only counts the rows having text values
+            cur.execute('DROP INDEX IF EXISTS text_key_value_index')
+            for type in ('insert', 'delete'):
+                cur.execute('DROP TRIGGER IF EXISTS abcd_catalog_text_' + type)
+            for statement in catalog_statements():
+                cur.execute(statement)
+            cur.execute("UPDATE abcd_catalog SET min = NULL, max = NULL, distinct_count = NULL, "
+                        "stale = 0 WHERE type = 'text'")
+
+        if version < 4:
+            # The numeric values of all keys are in number_value_index, which
+            # replaces the one without the ids and those made by create_index
+            cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND "
+                        "tbl_name='number_key_values' AND name LIKE 'abcd!_number!_index!_%' "
+                        "ESCAPE '!'")
+            names = [row[0] for row in cur.fetchall()] + ['number_key_value_index']
+            for name in names:
+                cur.execute('DROP INDEX IF EXISTS ' + quote_identifier(name))
+
+        if version < 5:
+            # X (Z = 0) has a bit of its own in the composition masks
+            for type in ('insert', 'delete'):
+                cur.execute('DROP TRIGGER IF EXISTS abcd_composition_' + type)
+            for statement in composition_statements:
+                cur.execute(statement)
+            cur.execute('UPDATE abcd_composition SET mask1 = mask1 | (1 << {}) '
+                        'WHERE id IN (SELECT id FROM species WHERE Z = 0)'.format(X_BIT))
+
+        if version < 6:
+            # Fingerprints of the rows stored without them, to be found as
+            # duplicates
+            cur.execute("SELECT id FROM systems WHERE id NOT IN "
+                        "(SELECT id FROM text_key_values WHERE key='fingerprint') ORDER BY id")
+            self._backfill_keys(cur, [row[0] for row in cur.fetchall()],
+                                lambda atoms: {'fingerprint': fingerprint(atoms)})
+
+        cur.execute("DELETE FROM information WHERE name='abcd_version'")
+        cur.execute("INSERT INTO information VALUES ('abcd_version', ?)", (str(SCHEMA_VERSION),))
+
+    def _backfill_keys(self, cur, ids, keys):
+        '''
+        Sets the key-value pairs keys(atoms) on the rows with the ids,
+        committing every WRITE_BATCH_SIZE rows (see _next_batch)
+        '''
+        for chunk in chunks(ids, WRITE_BATCH_SIZE):
+            cur.execute('SELECT systems.* FROM systems WHERE id IN ({})'
+                        .format(placeholders(len(chunk))), chunk)
+            rows = [self.connection._convert_tuple_to_row(tuple(values))
+                    for values in cur.fetchall()]
+            for row in rows:
+                kvp = keys(row.toatoms())
+                if kvp:
+                    self._set_row_kvp(cur, row.id, kvp)
+            self._next_batch()
+
     def _preprocess(self, atoms):
         '''
         Load capitalised special key-value pairs into
@@ -240,11 +648,11 @@ class ASEdbSQlite3Backend(Backend):
         atoms.info.pop('id', None)
 
         results = {}
-        for key in atoms.info.keys():
+        for key in list(atoms.info.keys()):
             if key.lower() in all_properties:
                 results[key.lower()] = atoms.info[key]
                 del atoms.info[key]
-        for key in atoms.arrays.keys():
+        for key in list(atoms.arrays.keys()):
             if key.lower() in all_properties:
                 results[key.lower()] = atoms.arrays[key]
                 del atoms.arrays[key]
@@ -258,16 +666,26 @@ class ASEdbSQlite3Backend(Backend):
                 # Use the existing calculator
                 atoms.calc.results.update(results)
 
-    def _insert_one_atoms(self, atoms):
+    def _insert_one_atoms(self, atoms, keys={}):
         '''
         Inserts one Atoms object into the database, without checking if its
         uid is already present in the database. Returns a uid of the inserted
-        object.
+        object. The keys are stored with it. The Atoms object is left as it
+        is: the keys written with it are added to a copy.
         '''
+        atoms = writable_copy(atoms)
+        atoms.info.update(keys)
         if not 'uid' in atoms.info or atoms.info['uid'] is None:
-            atoms.info['uid'] = '%x' % randint(16**14, 16**15 - 1)
+            atoms.info['uid'] = random_uid()
+        if len(atoms):
+            # Used by formula_reduced=... queries
+            atoms.info['formula_reduced'] = reduced_formula(atoms.numbers)
 
         self._preprocess(atoms)
+        atoms.info.update(derived_keys(atoms))
+        # Every configuration has one, so that later inserts find it as
+        # a duplicate, see insert()
+        atoms.info['fingerprint'] = keys.get('fingerprint') or fingerprint(atoms)
         info, arrays = get_info_and_arrays(atoms, plain_arrays=False)
 
         # Write it to the database
@@ -279,16 +697,26 @@ class ASEdbSQlite3Backend(Backend):
         '''
         Checks if a configuration with this uid already exists in the database.
         '''
-        query = 'uid={}'.format(uid)
-        rows_it = self.connection.select(query, limit=1)
-        if sum(1 for _ in rows_it) != 0:
-            return True
-        else:
-            return False
+        with self._cursor() as cur:
+            cur.execute("SELECT 1 FROM {} WHERE key='uid' AND value=? LIMIT 1"
+                        .format(value_table(uid)), (uid,))
+            return cur.fetchone() is not None
+
+    def _fingerprint_uid(self, fp):
+        '''
+        Returns the uid of a configuration with this fingerprint, or None
+        if there is no such configuration in the database.
+        '''
+        with self._cursor() as cur:
+            cur.execute("SELECT uid.value FROM text_key_values AS fp "
+                        "JOIN text_key_values AS uid ON uid.id=fp.id AND uid.key='uid' "
+                        "WHERE fp.key='fingerprint' AND fp.value=? LIMIT 1", (fp,))
+            row = cur.fetchone()
+            return row[0] if row is not None else None
 
     @require_database
     @read_only
-    def insert(self, auth_token, atoms_list):
+    def insert(self, auth_token, atoms_list, duplicates=None):
 
         # Make sure we have a list
         if isinstance(atoms_list, Atoms):
@@ -298,13 +726,23 @@ class ASEdbSQlite3Backend(Backend):
             dcts_list = [atoms2dict(atoms, True) for atoms in atoms_list]
             data = b64encode(json.dumps(dcts_list))
             cmd = 'insert {} {}'.format(self.database, data)
-            return communicate_with_remote(self.remote, cmd)
+            if duplicates is not None:
+                cmd += ' --duplicates {}'.format(duplicates)
+            return self._remote(cmd)
+
+        if duplicates not in (None, 'skip', 'link'):
+            raise ValueError('Unknown duplicates option: {}'.format(duplicates))
 
         inserted_ids = []
         skipped_ids = []
+        seen = set()
+        # Fingerprints of configurations inserted by this call
+        fingerprints = {}
         n_atoms = 0
 
         for atoms in atoms_list:
+            if n_atoms and n_atoms % WRITE_BATCH_SIZE == 0:
+                self._next_batch()
             n_atoms += 1
 
             # Check if it already exists in the database
@@ -316,16 +754,35 @@ class ASEdbSQlite3Backend(Backend):
                 exists = False
 
             # Check if this uid has already been "seen". If yes, skip it.
-            if (uid is not None) and uid in (inserted_ids + skipped_ids):
+            if (uid is not None) and uid in seen:
                 continue
 
+            keys = {}
+            if not exists and duplicates is not None:
+                # Look for the same structure under a different uid
+                fp = fingerprint(atoms)
+                duplicate_uid = fingerprints.get(fp) or self._fingerprint_uid(fp)
+                keys['fingerprint'] = fp
+                if duplicate_uid is not None and duplicates == 'skip':
+                    # Report the uid of the configuration already stored
+                    skipped_ids.append(duplicate_uid)
+                    if uid is not None:
+                        seen.add(uid)
+                    continue
+                elif duplicate_uid is not None:
+                    keys['duplicate_of'] = duplicate_uid
+
             if not exists:
                 # Insert it
-                ins_uid = self._insert_one_atoms(atoms)
+                ins_uid = self._insert_one_atoms(atoms, keys)
                 inserted_ids.append(ins_uid)
+                if 'fingerprint' in keys:
+                    fingerprints.setdefault(keys['fingerprint'], ins_uid)
             else:
                 # It exists - skip it
+                ins_uid = uid
                 skipped_ids.append(uid)
+            seen.add(ins_uid)
 
         msg = 'Inserted {}/{} configurations.'.format(len(inserted_ids), n_atoms)
         return results.InsertResult(inserted_ids=inserted_ids, skipped_ids=skipped_ids, msg=msg)
@@ -347,7 +804,7 @@ class ASEdbSQlite3Backend(Backend):
                 cmd += ' --upsert'
             if replace:
                 cmd += ' --replace'
-            return communicate_with_remote(self.remote, cmd)
+            return self._remote(cmd)
 
         def update_atoms_dct(d1, d2):
             # Update info and arrays
@@ -368,9 +825,12 @@ class ASEdbSQlite3Backend(Backend):
         skipped_ids = []
         upserted_ids = []
         replaced_ids = []
+        seen = set()
         n_atoms = 0
 
         for atoms in atoms_list:
+            if n_atoms and n_atoms % WRITE_BATCH_SIZE == 0:
+                self._next_batch()
             n_atoms += 1
 
             # Check if it already exists in the database
@@ -382,8 +842,9 @@ class ASEdbSQlite3Backend(Backend):
                 exists = False
 
             # Check if this uid has already been "seen". If yes, skip it.
-            if (uid is not None) and uid in (upserted_ids + skipped_ids + updated_ids + replaced_ids):
+            if (uid is not None) and uid in seen:
                 continue
+            seen.add(uid)
 
             if not exists:
                 if upsert:
@@ -432,19 +893,26 @@ class ASEdbSQlite3Backend(Backend):
             cmd = 'remove {} {}'.format(self.database, b64encode(json.dumps(filter)))
             if just_one:
                 cmd += ' --just-one'
-            return communicate_with_remote(self.remote, cmd)
+            return self._remote(cmd)
+
+        with self._cursor() as cur:
+            # Stop at the first match if just_one
+            ids = self._select_ids(cur, filter, limit=1 if just_one else 0)
+            uids = self._uids(cur, ids)
+            self._delete_rows(cur, ids)
 
-        if just_one:
-            limit = 1
-        else:
-            limit = 0
-        ids = [dct['id'] for dct in self._select(filter, limit=limit)]
-        self.connection.delete(ids)
         msg = 'Deleted {}'.format(plural(len(ids), 'row'))
-        return results.RemoveResult(removed_count=len(ids), msg=msg)
+        return results.RemoveResult(removed_count=len(ids), removed_ids=uids, msg=msg)
 
     @require_database
-    def find(self, auth_token, filter, sort, limit, keys, omit_keys):
+    def find(self, auth_token, filter, sort, limit, keys, omit_keys, workers=1):
+        '''
+        workers: number of processes decoding the rows, see decode_rows.
+        Unless there are writes not committed yet, which other connections
+        wouldn't see, the ids of the rows are selected first and the rows
+        are read in chunks as the cursor is iterated. Rows removed in the
+        meantime are left out.
+        '''
 
         if self.remote:
             filter_out = b64encode(json.dumps(filter))
@@ -457,14 +925,66 @@ class ASEdbSQlite3Backend(Backend):
             cmd += ' --limit {}'.format(limit)
             cmd += ' --keys {}'.format(keys_out)
             cmd += ' --omit-keys {}'.format(omit_keys_out)
-            atoms_dcts_list = communicate_with_remote(self.remote, cmd)
-            return ASEdbSQlite3Backend.Cursor(iter([dict2atoms(dct, True) for dct in atoms_dcts_list]))
+            return self._remote(cmd, lambda atoms_dcts_list: ASEdbSQlite3Backend.Cursor(
+                iter([dict2atoms(dct, True) for dct in atoms_dcts_list])))
+
+        if not self._uncommitted():
+            with self._cursor() as cur:
+                ids = self._select_ids(cur, filter, sort, limit)
+            if workers > 1:
+                return ASEdbSQlite3Backend.Cursor(
+                    decode_in_processes(self.connection.filename, ids, keys, omit_keys, workers))
+            return ASEdbSQlite3Backend.Cursor(
+                decode_in_chunks(self.connection.filename, ids, keys, omit_keys))
 
         rows_iter = self._select(filter, sort=sort, limit=limit)
 
         # Convert it to the Atoms iterator.
         return ASEdbSQlite3Backend.Cursor(map(lambda x: row2atoms(x, keys, omit_keys), rows_iter))
 
+    @require_database
+    def explain(self, auth_token, filter, sort, limit):
+
+        if self.remote:
+            cmd = 'explain {} {}'.format(self.database, b64encode(json.dumps(filter)))
+            cmd += ' --sort {}'.format(b64encode(json.dumps(sort)))
+            cmd += ' --limit {}'.format(limit)
+            return self._remote(cmd)
+
+        sql, args, rest = self._select_sql(filter, sort, limit)
+        times = {}
+        with self._cursor() as cur:
+            if rest is None:
+                plan = query_plan(cur, sql, args)
+                started = time.time()
+                rows = self._fetch_rows(cur, sql, args)
+                times['sql'] = time.time() - started
+                rows_scanned = len(rows)
+            else:
+                sql, args, rest = self._select_sql(filter, sort, limit, columns='systems.id')
+                plan = query_plan(cur, sql, args)
+                started = time.time()
+                ids = [row[0] for row in cur.execute(sql, args)]
+                times['sql'] = time.time() - started
+                rows_scanned = len(ids)
+
+                started = time.time()
+                ids = self._filter_ids(cur, ids, rest)
+                if limit != 0:
+                    ids = ids[:limit]
+                times['filter'] = time.time() - started
+                started = time.time()
+                rows = self._fetch_ids(cur, ids)
+                times['sql'] += time.time() - started
+
+        started = time.time()
+        for row in rows:
+            row2atoms(row, None, False)
+        times['decode'] = time.time() - started
+
+        return {'queries': [sql], 'arguments': args, 'plan': plan, 'untranslated': rest,
+                'rows_scanned': rows_scanned, 'rows_returned': len(rows), 'times': times}
+
     @require_database
     @read_only
     def add_keys(self, auth_token, filter, kvp):
@@ -472,11 +992,19 @@ class ASEdbSQlite3Backend(Backend):
         if self.remote:
             cmd = 'add-keys {} {} {}'.format(self.database, b64encode(json.dumps(filter)),
                     b64encode(json.dumps(kvp)))
-            return communicate_with_remote(self.remote, cmd)
-
-        ids = [dct['id'] for dct in self._select(filter)]
-        n = self.connection.update(ids, [], **kvp)[0]
-        msg = 'Added {} key-value pairs in total to {} configurations'.format(n, len(ids))
+            return self._remote(cmd)
+
+        check(kvp)
+        n = 0
+        with self._cursor() as cur:
+            n_rows = self._select_into_selection(cur, filter)
+            for key in kvp:
+                # Only keys which were not there before are counted as added
+                cur.execute('SELECT COUNT(*) FROM keys WHERE key=? AND id IN (SELECT id FROM selection)', (key,))
+                n += n_rows - cur.fetchone()[0]
+            self._set_selection_kvp(cur, kvp)
+
+        msg = 'Added {} key-value pairs in total to {} configurations'.format(n, n_rows)
         return results.AddKvpResult(modified_ids=[], no_of_kvp_added=n, msg=msg)
 
     @require_database
@@ -486,18 +1014,441 @@ class ASEdbSQlite3Backend(Backend):
         if self.remote:
             cmd = 'remove-keys {} {} {}'.format(self.database, b64encode(json.dumps(filter)),
                     b64encode(json.dumps(keys)))
-            return communicate_with_remote(self.remote, cmd)
+            return self._remote(cmd)
+
+        n = 0
+        with self._cursor() as cur:
+            self._select_into_selection(cur, filter)
+            for key in keys:
+                cur.execute('SELECT COUNT(*) FROM keys WHERE key=? AND id IN (SELECT id FROM selection)', (key,))
+                n += cur.fetchone()[0]
+                self._delete_keys_of_selection(cur, key)
+            self._update_selection_kvp(cur, {}, keys)
+            ids = [row[0] for row in cur.execute('SELECT id FROM selection')]
 
-        ids = [dct['id'] for dct in self._select(filter)]
-        n = self.connection.update(ids, keys)[1]
         msg = 'Removed {} keys in total from {} configurations'.format(n, len(ids))
         return results.RemoveKeysResult(modified_ids=ids, no_of_keys_removed=n, msg=msg)
 
+    @require_database
+    def key_statistics(self, auth_token):
+
+        if self.remote:
+            return self._remote('key-statistics {}'.format(self.database))
+
+        if not self.catalog:
+            # It is made when the database is opened with write access
+            return None
+
+        refreshed = {}
+        with self._cursor() as cur:
+            cur.execute('SELECT key, type FROM abcd_catalog WHERE stale')
+            for key, type in cur.fetchall():
+                sql, args = refresh_query(key, type)
+                cur.execute(sql, args)
+                refreshed[key, type] = cur.fetchone()
+                if not self.readonly and self.pool is None:
+                    # Readers of the pooled mode don't write
+                    cur.execute('UPDATE abcd_catalog SET min=?, max=?, stale=0 WHERE key=? AND type=?',
+                                refreshed[key, type] + (key, type))
+            cur.execute('SELECT key, type, count, min, max, distinct_count FROM abcd_catalog')
+            entries = [(key, type, count) + refreshed.get((key, type), (min, max)) + (distinct,)
+                       for key, type, count, min, max, distinct in cur.fetchall()]
+
+        stats = merge_entries(entries)
+        rows = stats.pop('id', {'count': 0})['count']
+        return {'rows': rows, 'keys': stats}
+
+    @require_database
+    def aggregate(self, auth_token, filter, group_by, metrics, bins=0):
+
+        if self.remote:
+            cmd = 'aggregate {} {}'.format(self.database, b64encode(json.dumps(filter)))
+            cmd += ' --group-by {}'.format(b64encode(json.dumps(group_by)))
+            cmd += ' --metrics {}'.format(b64encode(json.dumps(metrics)))
+            cmd += ' --bins {}'.format(bins)
+            return self._remote(cmd)
+
+        where, args, rest = self._split(filter)
+        if rest is not None:
+            # Part of the filter is evaluated on the configurations
+            return super(ASEdbSQlite3Backend, self).aggregate(auth_token, filter, group_by,
+                                                              metrics, bins)
+
+        n = len(group_by)
+        entries = []
+        with self._cursor() as cur:
+            for row in cur.execute(aggregate_sql(where, group_by, metrics), args):
+                if row[n] == 0:
+                    # No rows at all, without GROUP BY
+                    continue
+                entry = group_entry(group_by, row[:n], row[n])
+                for i, key in enumerate(metrics):
+                    entry['stats'][key] = key_stats(*row[n + 1 + 4 * i:n + 5 + 4 * i])
+                entries.append(entry)
+            entries.sort(key=lambda entry: group_order(entry['group'].values()))
+
+            if bins:
+                for key in metrics:
+                    ranges = overall_range(entries, key)
+                    counts = {}
+                    if ranges is not None:
+                        sql, hist_args = histogram_sql(where, group_by, key, ranges[0],
+                                                       ranges[1], bins)
+                        for row in cur.execute(sql, hist_args + args):
+                            counts[tuple(row[:n]), row[n]] = row[n + 1]
+                    set_histograms(entries, key, ranges, bins, counts)
+        return entries
+
+    @require_database
+    @read_only
+    def create_index(self, auth_token, keys):
+
+        if self.remote:
+            cmd = 'create-index {} {}'.format(self.database, b64encode(json.dumps(keys)))
+            return self._remote(cmd)
+
+        for key in keys:
+            if key == 'numbers' or species_key(key) is not None:
+                # These use the "abcd_composition" and "species" tables
+                raise WriteError('Queries on elements are indexed already: {}'.format(key))
+
+        created = []
+        with self._cursor() as cur:
+            indexed = self._indexed_keys(cur)
+            for key in keys:
+                if key in indexed or key in created:
+                    continue
+                for statement in index_statements(key):
+                    cur.execute(statement)
+                created.append(key)
+            self.indexed = self._indexed_columns(cur)
+        return created
+
+    @require_database
+    def list_indexes(self, auth_token):
+
+        if self.remote:
+            return self._remote('list-indexes {}'.format(self.database))
+
+        with self._cursor() as cur:
+            return sorted(self._indexed_keys(cur))
+
+    @require_database
+    @read_only
+    def drop_index(self, auth_token, keys):
+
+        if self.remote:
+            cmd = 'drop-index {} {}'.format(self.database, b64encode(json.dumps(keys)))
+            return self._remote(cmd)
+
+        dropped = []
+        with self._cursor() as cur:
+            indexed = self._indexed_keys(cur)
+            for key in keys:
+                if key in indexed and key not in dropped:
+                    for statement in drop_index_statements(key):
+                        cur.execute(statement)
+                    dropped.append(key)
+            self.indexed = self._indexed_columns(cur)
+        return dropped
+
+    def _indexed_columns(self, cur):
+        '''
+        Returns the set of keys stored in columns of "systems" which are
+        the first column of an index, whoever made it
+        '''
+        keys = {column: key for key, column in system_columns.items() if key != 'id'}
+        indexed = set()
+        cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='systems'")
+        for name, in cur.fetchall():
+            cur.execute('PRAGMA index_info({})'.format(quote_identifier(name)))
+            columns = cur.fetchall()
+            if columns and columns[0][2] in keys:
+                indexed.add(keys[columns[0][2]])
+        return frozenset(indexed)
+
+    def _indexed_keys(self, cur):
+        '''Returns the set of keys which have indexes made by create_index'''
+        cur.execute("SELECT name, tbl_name FROM sqlite_master WHERE type='index'")
+        keys = set(indexed_key(name, table) for name, table in cur.fetchall())
+        keys.discard(None)
+        return keys
+
+    @contextmanager
+    def _cursor(self):
+        '''
+        Yields a cursor for working on the SQLite database directly. If the
+        backend is open its connection is used, and changes are committed
+        by commit() or close(). Otherwise a new connection is made and
+        committed at the end.
+        '''
+        if self.pool is not None:
+            yield self.pool.connection().cursor()
+            return
+
+        con = self.connection.connection
+        if con is not None:
+            yield con.cursor()
+            return
+
+        con = self.connection._connect()
+        try:
+            self.connection._initialize(con)
+            yield con.cursor()
+            con.commit()
+        except:
+            con.rollback()
+            raise
+        finally:
+            con.close()
+
+    def _uncommitted(self):
+        '''Whether writes of this backend may not have been committed yet'''
+        if self.pool is not None:
+            return self.pool.writing()
+        con = self.connection.connection
+        # Python 2 connections don't tell
+        return con is not None and getattr(con, 'in_transaction', True)
+
+    @contextmanager
+    def _writing(self):
+        '''
+        Runs a write in a transaction holding the write lock of the database,
+        waiting while other processes hold it (see locking.py), and commits
+        it at the end. Large inserts and updates commit every
+        WRITE_BATCH_SIZE configurations (see _next_batch), letting other
+        writers in between. In a transaction of begin(), which already
+        holds the lock, the writes are part of it.
+        '''
+        if self.pool is not None:
+            with self._pooled_writer():
+                self.lock_wait = self.pool.lock_wait
+                yield
+            return
+        if self.in_transaction or self.batch is not None:
+            # Called by another write, or in a transaction of begin()
+            yield
+            return
+
+        con = self.connection.connection
+        opened = con is None
+        if opened:
+            con = self.connection._connect()
+            self.connection._initialize(con)
+            self.connection.connection = con
+        try:
+            # Earlier writes not committed yet hold the lock already. Python 2
+            # connections don't tell, but writes outside begin() are committed
+            # at the end of each call.
+            self.lock_wait = 0. if getattr(con, 'in_transaction', False) else begin_immediate(con)
+            self.batch = con
+            self.connection.change_count = 1
+            yield
+            con.commit()
+        except:
+            con.rollback()
+            raise
+        finally:
+            self.batch = None
+            if opened:
+                self.connection.connection = None
+                con.close()
+
+    def _next_batch(self):
+        '''
+        Commits the writes done so far by the current write and waits for
+        the lock again, if the write has a transaction of its own. Writers
+        waiting for the lock take it in between.
+        '''
+        if self.batch is None:
+            return
+        self.batch.commit()
+        self.lock_wait += hand_over(self.batch)
+        self.lock_wait += begin_immediate(self.batch)
+        # ASEdb commits by itself every 5000 changes of an open connection
+        self.connection.change_count = 1
+
+    @contextmanager
+    def _pooled_writer(self):
+        '''
+        Holds the writer connection of the pool, which ASEdb then writes
+        through, and commits at the end unless in a transaction
+        '''
+        with self.pool.writer() as con:
+            outer = self.connection.connection is None
+            if outer:
+                self.connection.connection = con
+                self.connection.change_count = 0
+            try:
+                yield con
+            finally:
+                if outer:
+                    self.connection.connection = None
+
+    def _select_into_selection(self, cur, filter):
+        '''
+        Stores the ids of rows matching the filter in the temporary table
+        "selection" and returns their number.
+        '''
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS selection (id INTEGER PRIMARY KEY)')
+        cur.execute('DELETE FROM selection')
+        where, args, rest = self._split(filter)
+        if rest is None:
+            cur.execute('INSERT INTO selection SELECT systems.id FROM systems WHERE ' + where, args)
+        else:
+            cur.executemany('INSERT INTO selection VALUES (?)',
+                            [(id,) for id in self._select_ids(cur, filter)])
+        cur.execute('SELECT COUNT(*) FROM selection')
+        return cur.fetchone()[0]
+
+    def _uids(self, cur, ids):
+        '''Returns uids of the rows with given ids (None for rows without one)'''
+        uids = {}
+        for chunk in chunks(ids):
+            cur.execute("SELECT id, value FROM text_key_values WHERE key='uid' AND id IN ({})"
+                        .format(placeholders(len(chunk))), chunk)
+            uids.update(cur.fetchall())
+        return [uids.get(id) for id in ids]
+
+    def _delete_rows(self, cur, ids):
+        '''Deletes rows in chunks small enough for SQLite's limit of variables'''
+        for chunk in chunks(ids):
+            for table in reversed(all_tables):
+                cur.execute('DELETE FROM {} WHERE id IN ({})'
+                            .format(table, placeholders(len(chunk))), chunk)
+
+    def _set_selection_kvp(self, cur, kvp):
+        '''Sets the key-value pairs on all the selected rows'''
+        for key, value in kvp.items():
+            self._delete_keys_of_selection(cur, key)
+            cur.execute('INSERT INTO keys SELECT ?, id FROM selection', (key,))
+            if not isinstance(value, string_types):
+                value = float(value)
+            cur.execute('INSERT INTO {} SELECT ?, ?, id FROM selection'.format(value_table(value)),
+                        (key, value))
+        self._update_selection_kvp(cur, kvp, [])
+
+    def _set_row_kvp(self, cur, id, kvp):
+        '''Sets the key-value pairs on the row with the given id'''
+        cur.execute('SELECT key_value_pairs FROM systems WHERE id=?', (id,))
+        dct = json.loads(cur.fetchone()[0])
+        dct.update(kvp)
+        for key, value in kvp.items():
+            for table in ('keys', 'text_key_values', 'number_key_values'):
+                cur.execute('DELETE FROM {} WHERE key=? AND id=?'.format(table), (key, id))
+            cur.execute('INSERT INTO keys VALUES (?, ?)', (key, id))
+            cur.execute('INSERT INTO {} VALUES (?, ?, ?)'.format(value_table(value)),
+                        (key, value, id))
+        cur.execute('UPDATE systems SET key_value_pairs=? WHERE id=?', (json.dumps(dct), id))
+
+    def _delete_keys_of_selection(self, cur, key):
+        for table in ('keys', 'text_key_values', 'number_key_values'):
+            cur.execute('DELETE FROM {} WHERE key=? AND id IN (SELECT id FROM selection)'.format(table),
+                        (key,))
+
+    def _update_selection_kvp(self, cur, kvp, remove_keys):
+        '''
+        Updates the key-value pairs which ASEdb keeps as JSON in the
+        "systems" table for the selected rows. If SQLite was built without
+        the JSON functions, the rows are rewritten in chunks instead.
+        '''
+        mtime = now()
+        args = [mtime]
+        sql = 'key_value_pairs'
+        if remove_keys:
+            sql = 'json_remove({}, {})'.format(sql, placeholders(len(remove_keys)))
+            args += ['$."{}"'.format(key) for key in remove_keys]
+        if kvp:
+            sql = 'json_set({}, {})'.format(sql, ', '.join(['?, json(?)'] * len(kvp)))
+            for key, value in kvp.items():
+                args += ['$."{}"'.format(key), json.dumps(value)]
+        try:
+            cur.execute('UPDATE systems SET mtime=?, key_value_pairs={} '
+                        'WHERE id IN (SELECT id FROM selection)'.format(sql), args)
+            return
+        except sqlite3.OperationalError:
+            # No JSON support
+            pass
+
+        ids = [row[0] for row in cur.execute('SELECT id FROM selection')]
+        for chunk in chunks(ids):
+            cur.execute('SELECT id, key_value_pairs FROM systems WHERE id IN ({})'
+                        .format(placeholders(len(chunk))), chunk)
+            updated = []
+            for id, text in cur.fetchall():
+                dct = json.loads(text)
+                for key in remove_keys:
+                    dct.pop(key, None)
+                dct.update(kvp)
+                updated.append((mtime, json.dumps(dct), id))
+            cur.executemany('UPDATE systems SET mtime=?, key_value_pairs=? WHERE id=?', updated)
+
+    @require_database
+    def count(self, auth_token, filter, limit=0):
+
+        if self.remote:
+            return self.find(auth_token, filter, {}, limit, None, False).count()
+
+        where, args, rest = self._split(filter)
+
+        # Rows are counted without being fetched
+        with self._cursor() as cur:
+            if rest is not None:
+                return len(self._select_ids(cur, filter, limit=limit))
+            sql = 'SELECT systems.id FROM systems WHERE ' + where
+            if limit != 0:
+                sql += ' LIMIT {}'.format(int(limit))
+            cur.execute('SELECT COUNT(*) FROM ({})'.format(sql), args)
+            return cur.fetchone()[0]
+
     def open(self):
-        pass
+        '''
+        Keeps one SQLite connection open until close() is called, so that
+        consecutive calls don't have to reconnect. Writes are committed at
+        the end of each call, or by commit() in a transaction of begin().
+        '''
+        if self.pool is not None:
+            # Connections are made by the threads using them
+            return
+        if self.connection is not None and self.connection.connection is None:
+            self.connection.__enter__()
 
     def close(self):
-        pass
+        if self.pool is not None:
+            self.pool.end()
+            self.pool.close()
+        elif self.connection is not None and self.connection.connection is not None:
+            self.connection.__exit__(None, None, None)
+        self.in_transaction = False
 
     def is_open(self):
-        return True
+        if self.remote or self.connection is None or self.pool is not None:
+            # Nothing to keep open
+            return True
+        return self.connection.connection is not None
+
+    def begin(self):
+        if self.pool is not None:
+            # Other threads' writes wait until commit() or rollback()
+            self.pool.begin()
+            self.lock_wait = self.pool.lock_wait
+        self.open()
+        con = self.connection.connection if self.connection is not None else None
+        if con is not None and not self.remote and not getattr(con, 'in_transaction', False):
+            # Other processes' writes wait until commit() or rollback()
+            self.lock_wait = begin_immediate(con)
+        self.in_transaction = True
+
+    def commit(self):
+        if self.pool is not None:
+            self.pool.end(commit=True)
+        elif self.connection is not None and self.connection.connection is not None:
+            self.connection.connection.commit()
+        self.in_transaction = False
+
+    def rollback(self):
+        if self.pool is not None:
+            self.pool.end(commit=False)
+        elif self.connection is not None and self.connection.connection is not None:
+            self.connection.connection.rollback()
+        self.in_transaction = False
@@ -0,0 +1,160 @@
+"""
+The "abcd_catalog" table: for every key, the number of rows which have it
+and, for numbers, the smallest and largest value and the number of
+distinct values. Text values can be large (e.g. original_files) and aren't
+indexed, so only the rows having them are counted. It is kept up to date
+by triggers on the tables of ASEdb, whatever writes to the database, so
+summaries of the whole database don't read any rows.
+
+Keys of key-value pairs have an entry for each of the tables their values
+are in ("number" and "text"). The columns of "systems" in catalog_columns
+have entries of type "column"; the one of "id" counts the rows.
+
+Deleting the smallest or largest value of a key marks its entry as stale:
+its min and max are then bounds which may be too wide, and are worked out
+again by refresh_query when the catalog is read.
+"""
+
+catalog_table = """CREATE TABLE IF NOT EXISTS abcd_catalog (
+    key TEXT NOT NULL,
+    type TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    min,
+    max,
+    distinct_count INTEGER,
+    stale INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, type))"""
+
+# Columns of "systems" which are in the catalog
+catalog_columns = ['id', 'energy']
+
+# Key-value tables and the type of their entries
+value_tables = {'number_key_values': 'number', 'text_key_values': 'text'}
+
+
+def added_statements(key, type, value, distinct):
+    """Statements of a trigger counting a new value of the key"""
+    ranges = '' if type == 'text' else """
+        min = CASE WHEN count = 0 OR {0} < min THEN {0} ELSE min END,
+        max = CASE WHEN count = 0 OR {0} > max THEN {0} ELSE max END,""".format(value)
+    return [
+        "INSERT OR IGNORE INTO abcd_catalog (key, type, distinct_count) "
+        "SELECT {0}, '{1}', 0 WHERE {2} IS NOT NULL;".format(key, type, value),
+        """UPDATE abcd_catalog
+    SET count = count + 1,{4}
+        distinct_count = {3}
+    WHERE key = {0} AND type = '{1}' AND {2} IS NOT NULL;""".format(key, type, value, distinct,
+                                                                 ranges)]
+
+
+def removed_statements(key, type, value, distinct):
+    """Statements of a trigger uncounting a deleted value of the key"""
+    ranges = '' if type == 'text' else """
+        stale = stale OR {0} <= min OR {0} >= max,""".format(value)
+    return [
+        """UPDATE abcd_catalog
+    SET count = count - 1,{4}
+        distinct_count = {3}
+    WHERE key = {0} AND type = '{1}' AND {2} IS NOT NULL;""".format(key, type, value, distinct,
+                                                                 ranges),
+        "DELETE FROM abcd_catalog WHERE key = {0} AND type = '{1}' AND count <= 0;".format(key, type)]
+
+
+def trigger(name, event, statements):
+    return 'CREATE TRIGGER IF NOT EXISTS {} {}\nBEGIN\n    {}\nEND'.format(
+        name, event, '\n    '.join(statements))
+
+
+def catalog_statements():
+    """Returns the statements creating the table and its triggers"""
+    statements = [catalog_table]
+    for table, type in sorted(value_tables.items()):
+        # Whether the value is the first (or the last) one of its kind.
+        # These are index lookups, see schema_statements of the backend.
+        first = ('distinct_count + (SELECT COUNT(*) = 1 FROM (SELECT 1 FROM {} '
+                 'WHERE key = NEW.key AND value = NEW.value LIMIT 2))'.format(table))
+        last = ('distinct_count - (NOT EXISTS (SELECT 1 FROM {} '
+                'WHERE key = OLD.key AND value = OLD.value))'.format(table))
+        if type == 'text':
+            first = last = 'NULL'
+        statements.append(trigger(
+            'abcd_catalog_{}_insert'.format(type), 'AFTER INSERT ON ' + table,
+            added_statements('NEW.key', type, 'NEW.value', first)))
+        statements.append(trigger(
+            'abcd_catalog_{}_delete'.format(type), 'AFTER DELETE ON ' + table,
+            removed_statements('OLD.key', type, 'OLD.value', last)))
+
+    added = []
+    removed = []
+    for column in catalog_columns:
+        # Ids are unique, other columns don't keep the number of distinct values
+        distinct = 'count + 1' if column == 'id' else 'NULL'
+        added += added_statements("'{}'".format(column), 'column', 'NEW.' + column, distinct)
+        distinct = 'count - 1' if column == 'id' else 'NULL'
+        removed += removed_statements("'{}'".format(column), 'column', 'OLD.' + column, distinct)
+    statements.append(trigger('abcd_catalog_systems_insert', 'AFTER INSERT ON systems', added))
+    statements.append(trigger('abcd_catalog_systems_delete', 'AFTER DELETE ON systems', removed))
+    statements.append(trigger(
+        'abcd_catalog_systems_update',
+        'AFTER UPDATE OF {} ON systems'.format(', '.join(catalog_columns[1:])),
+        [s for column in catalog_columns[1:]
+         for s in (removed_statements("'{}'".format(column), 'column', 'OLD.' + column, 'NULL') +
+                   added_statements("'{}'".format(column), 'column', 'NEW.' + column, 'NULL'))]))
+    return statements
+
+
+def backfill_statements():
+    """Returns the statements filling the catalog for rows already in the database"""
+    statements = []
+    for table, type in sorted(value_tables.items()):
+        stats = 'MIN(value), MAX(value), COUNT(DISTINCT value)'
+        if type == 'text':
+            stats = 'NULL, NULL, NULL'
+        statements.append(
+            "INSERT INTO abcd_catalog (key, type, count, min, max, distinct_count) "
+            "SELECT key, '{}', COUNT(*), {} FROM {} GROUP BY key".format(type, stats, table))
+    for column in catalog_columns:
+        distinct = 'COUNT(*)' if column == 'id' else 'NULL'
+        statements.append(
+            "INSERT INTO abcd_catalog (key, type, count, min, max, distinct_count) "
+            "SELECT '{0}', 'column', COUNT({0}), MIN({0}), MAX({0}), {1} FROM systems "
+            "HAVING COUNT({0}) > 0".format(column, distinct))
+    return statements
+
+
+def refresh_query(key, type):
+    """Returns the query and its arguments giving the min and max of a stale entry"""
+    if type == 'column':
+        return 'SELECT MIN({0}), MAX({0}) FROM systems'.format(key), []
+    table = [t for t, ty in value_tables.items() if ty == type][0]
+    return 'SELECT MIN(value), MAX(value) FROM {} WHERE key = ?'.format(table), [key]
+
+
+def merge_entries(entries):
+    """
+    Merges the entries of the catalog into statistics of each key. Keys with
+    values of both types are of type "mixed", and their min and max follow
+    the order of SQLite, where numbers come before strings. Keys with text
+    values have no max.
+    """
+    stats = {}
+    for key, type, count, min, max, distinct in entries:
+        if type == 'column':
+            type = 'number'
+        if key not in stats:
+            stats[key] = {'type': type, 'count': count, 'min': min, 'max': max,
+                          'distinct': distinct}
+            continue
+        s = stats[key]
+        s['count'] += count
+        if s['type'] != type:
+            s['type'] = 'mixed'
+            if type == 'number':
+                s['min'] = min
+            else:
+                s['max'] = max
+        if s['distinct'] is not None and distinct is not None:
+            s['distinct'] += distinct
+        else:
+            s['distinct'] = None
+    return stats
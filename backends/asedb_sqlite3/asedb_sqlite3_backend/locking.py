@@ -0,0 +1,135 @@
+"""
+Taking the write lock of an SQLite database which several processes
+write to at once (e.g. jobs storing into the same database).
+
+SQLite lets one connection write at a time. A transaction which reads
+before it writes can fail with "database is locked" when it tries to
+write while another one holds the lock, whatever the busy timeout. Writes
+of the backend therefore start their transaction with BEGIN IMMEDIATE,
+which takes the lock before anything is read, and retry it with
+exponential backoff while another writer holds it.
+
+Long writes commit in batches and begin the next transaction at once,
+while the writers waiting for the lock are asleep between attempts. So
+that they get their turn, writers hold a shared lock on the file
+<database>-waiters while they wait, and hand_over() leaves the lock of
+the database to them after a batch.
+"""
+
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from abcd.backend import WriteError
+
+try:
+    import fcntl
+except ImportError:  # Windows, writers don't take turns
+    fcntl = None
+
+# Seconds to wait for the lock before giving up
+LOCK_TIMEOUT = 600
+
+# Seconds between the first attempts, doubled after each one up to
+# MAX_DELAY
+FIRST_DELAY = 0.005
+MAX_DELAY = 0.5
+
+# Longest a writer leaves the lock to the waiting ones, longer than they
+# sleep between attempts
+HAND_OVER = 2 * MAX_DELAY
+
+
+def is_locked(error):
+    '''Whether the sqlite3 error is about a lock held by another connection'''
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+def _waiters_file(con):
+    '''Opens the <database>-waiters file of the connection, or None if it can't be used'''
+    if fcntl is None:
+        return None
+    for _, name, filename in con.execute('PRAGMA database_list').fetchall():
+        if name == 'main' and filename:
+            try:
+                return open(filename + '-waiters', 'a')
+            except (IOError, OSError):
+                # e.g. a read-only directory
+                return None
+    return None
+
+
+@contextmanager
+def _waiting(con):
+    '''Marks the block as waiting for the lock of the database'''
+    f = _waiters_file(con)
+    try:
+        if f is not None:
+            fcntl.flock(f, fcntl.LOCK_SH)
+        yield
+    finally:
+        if f is not None:
+            # Releases the lock
+            f.close()
+
+
+def hand_over(con, timeout=HAND_OVER):
+    '''
+    Waits while other writers wait for the lock of the database, until one
+    of them took it (or timeout), so that they get their turn between the
+    transactions of a long write. Returns the seconds waited.
+    '''
+    started = time.time()
+    f = _waiters_file(con)
+    if f is None:
+        return 0.
+    try:
+        while time.time() - started < timeout:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (IOError, OSError):
+                time.sleep(FIRST_DELAY)
+    finally:
+        f.close()
+    return time.time() - started
+
+
+def _try_begin(con):
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        return True
+    except sqlite3.OperationalError as e:
+        if not is_locked(e):
+            raise
+        return False
+
+
+def begin_immediate(con, timeout=LOCK_TIMEOUT):
+    '''
+    Starts a transaction of the connection holding the write lock,
+    waiting while another connection holds it. Returns the seconds waited.
+    '''
+    started = time.time()
+    delay = FIRST_DELAY
+    # Attempts return at once, the waiting is done here
+    busy_timeout = con.execute('PRAGMA busy_timeout').fetchone()[0]
+    con.execute('PRAGMA busy_timeout=0')
+    try:
+        if _try_begin(con):
+            return time.time() - started
+        with _waiting(con):
+            while True:
+                waited = time.time() - started
+                if waited >= timeout:
+                    raise WriteError('The database is locked by another writer. '
+                                     'Gave up after {:.0f} s'.format(waited))
+                # Writers waiting at the same time try again at different times
+                time.sleep(min(delay * random.uniform(0.5, 1.5), timeout - waited))
+                delay = min(2 * delay, MAX_DELAY)
+                if _try_begin(con):
+                    return time.time() - started
+    finally:
+        con.execute('PRAGMA busy_timeout={}'.format(int(busy_timeout)))
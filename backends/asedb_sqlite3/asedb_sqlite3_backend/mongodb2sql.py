@@ -0,0 +1,530 @@
+"""
+Translates the MongoDB query into SQL working directly on the tables of
+an ASEdb SQLite3 database. One filter always becomes a single statement,
+so it can be used as a sub-query selecting the ids of matching rows.
+
+The semantics follow ASEdb: a comparison on a key only matches rows which
+have this key, e.g. 'k!=v' doesn't match rows without "k".
+
+Conditions on the elements present in a configuration use the bitmasks
+of the "abcd_composition" table when the database has it (see
+composition_statements), otherwise the "species" table of ASEdb.
+"""
+
+import json
+
+from ase.data import atomic_numbers
+from six import string_types
+
+from abcd.query import QueryError
+
+# Keys stored in the columns of the "systems" table and their column names
+system_columns = {
+    'id': 'id',
+    'energy': 'energy',
+    'magmom': 'magmom',
+    'ctime': 'ctime',
+    'mtime': 'mtime',
+    'user': 'username',
+    'calculator': 'calculator',
+    'natoms': 'natoms',
+    'pbc': 'pbc',
+    'unique_id': 'unique_id',
+    'fmax': 'fmax',
+    'smax': 'smax',
+    'volume': 'volume',
+    'mass': 'mass',
+    'charge': 'charge'}
+
+sql_operators = {
+    '$eq': '=',
+    '$ne': '!=',
+    '$gt': '>',
+    '$gte': '>=',
+    '$lt': '<',
+    '$lte': '<='}
+
+
+# Elements with 0 < Z < 64 are bits of mask0 and the rest bits of mask1, so
+# that both masks fit into SQLite's signed 64-bit integers. X (Z = 0, e.g.
+# a placeholder atom) has the last bit of mask1, which no element reaches.
+MASK_BITS = 63
+X_BIT = MASK_BITS - 1
+
+
+def mask_bits(Z):
+    """SQL expressions of the bits of the atomic number Z in mask0 and mask1"""
+    return ('(CASE WHEN {0} BETWEEN 1 AND 63 THEN 1 << ({0} - 1) ELSE 0 END)'.format(Z),
+            '(CASE WHEN {0} >= 64 THEN 1 << ({0} - 64) WHEN {0} = 0 THEN 1 << {1} '
+            'ELSE 0 END)'.format(Z, X_BIT))
+
+
+# Statements creating the "abcd_composition" table, which holds a bitmask
+# of the elements present in each row. It is kept up to date by triggers
+# on the "species" table, whatever writes to the database.
+composition_statements = [
+    """CREATE TABLE IF NOT EXISTS abcd_composition (
+    id INTEGER PRIMARY KEY,
+    mask0 INTEGER NOT NULL DEFAULT 0,
+    mask1 INTEGER NOT NULL DEFAULT 0)""",
+    """CREATE TRIGGER IF NOT EXISTS abcd_composition_insert AFTER INSERT ON species
+BEGIN
+    INSERT OR IGNORE INTO abcd_composition (id) VALUES (NEW.id);
+    UPDATE abcd_composition
+    SET mask0 = mask0 | {},
+        mask1 = mask1 | {}
+    WHERE id = NEW.id;
+END""".format(*mask_bits('NEW.Z')),
+    """CREATE TRIGGER IF NOT EXISTS abcd_composition_delete AFTER DELETE ON species
+BEGIN
+    UPDATE abcd_composition
+    SET mask0 = mask0 & ~{},
+        mask1 = mask1 & ~{}
+    WHERE id = OLD.id;
+END""".format(*mask_bits('OLD.Z')),
+    """CREATE TRIGGER IF NOT EXISTS abcd_composition_remove AFTER DELETE ON systems
+BEGIN
+    DELETE FROM abcd_composition WHERE id = OLD.id;
+END"""]
+
+# Fills the "abcd_composition" table for rows written before it existed.
+# Bits of different elements don't overlap, so their sum is their union.
+composition_backfill = """INSERT INTO abcd_composition (id, mask0, mask1)
+SELECT id, SUM({}), SUM({})
+FROM species WHERE id NOT IN (SELECT id FROM abcd_composition) GROUP BY id""".format(
+    *mask_bits('Z'))
+
+
+def composition_masks(numbers):
+    """Returns the bitmasks (mask0, mask1) of the atomic numbers, see mask_bits"""
+    masks = [0, 0]
+    for Z in numbers:
+        if Z == 0:
+            masks[1] |= 1 << X_BIT
+        else:
+            masks[(Z - 1) // MASK_BITS] |= 1 << ((Z - 1) % MASK_BITS)
+    return masks
+
+
+def quote(s):
+    """Quotes a string so it can be used as an SQL literal"""
+    return "'" + str(s).replace("'", "''") + "'"
+
+
+def placeholders(n):
+    return ', '.join(['?'] * n)
+
+
+def value_table(value):
+    """Returns the key-value table in which ASEdb stores the value"""
+    if isinstance(value, string_types):
+        return 'text_key_values'
+    return 'number_key_values'
+
+
+def as_list(val):
+    return list(val) if isinstance(val, list) else [val]
+
+
+def pbc_value(pbc):
+    """ASEdb stores the pbc as an integer, e.g. 'TFT' -> 5"""
+    return sum(2**i for i, c in enumerate(pbc) if c == 'T')
+
+
+def pbc_string(value):
+    """The inverse of pbc_value, e.g. 5 -> 'TFT'"""
+    return ''.join('T' if value & 2**i else 'F' for i in range(3))
+
+
+# The functions below return an SQL condition for one comparison, and a
+# function which takes the compared value and returns the arguments of the
+# condition. The SQL only depends on the shape of the value (see
+# value_shape), so it can be reused for other values of the same shape.
+
+def column_condition(key, op, val, indexed=False):
+    column = 'systems.' + system_columns[key]
+    convert = pbc_value if key == 'pbc' else (lambda v: v)
+    if op in ('$in', '$nin'):
+        sql = '{} {} ({})'.format(column, 'IN' if op == '$in' else 'NOT IN',
+                                  placeholders(len(val)))
+    else:
+        sql = '{}{}?'.format(column, sql_operators[op])
+    if indexed:
+        # SQLite would rather scan "systems" in the order of ids than use
+        # the index of the column, so the index is searched in a sub-query
+        sql = 'systems.id IN (SELECT id FROM systems WHERE {})'.format(sql)
+    return sql, lambda val: [convert(v) for v in as_list(val)]
+
+
+def matches_zero(op, val):
+    """Whether zero satisfies the comparison"""
+    if op in ('$in', '$nin'):
+        return (0 in as_list(val)) == (op == '$in')
+    return {'$eq': 0 == val, '$ne': 0 != val, '$gt': 0 > val, '$gte': 0 >= val,
+            '$lt': 0 < val, '$lte': 0 <= val}[op]
+
+
+def species_condition(Z, op, val):
+    """Comparison on the number of atoms of the element Z"""
+    # Rows without the element have zero atoms of it, but they are not in
+    # the species table. If they match, the condition is on the rows which
+    # don't match the inverse.
+    zero = matches_zero(op, val)
+    if op in ('$in', '$nin'):
+        sql = 'systems.id {} (SELECT id FROM species WHERE Z={} AND n {} ({}))'.format(
+            'NOT IN' if zero else 'IN', Z,
+            'IN' if zero == (op == '$nin') else 'NOT IN', placeholders(len(as_list(val))))
+        return sql, as_list
+    sql_op = sql_operators[op]
+    if zero:
+        inverse = {'=': '!=', '!=': '=', '>': '<=', '>=': '<',
+                   '<': '>=', '<=': '>'}[sql_op]
+        sql = 'systems.id NOT IN (SELECT id FROM species WHERE Z={} AND n{}?)'
+        return sql.format(Z, inverse), as_list
+    sql = 'systems.id IN (SELECT id FROM species WHERE Z={} AND n{}?)'
+    return sql.format(Z, sql_op), as_list
+
+
+def numbers_elements(op, val):
+    """Returns the atomic numbers compared by a condition on numbers"""
+    if op == '$not':
+        if list(val) != ['$elemMatch'] or list(val['$elemMatch']) != ['$nin']:
+            raise QueryError('numbers {} {}'.format(op, val))
+        val = val['$elemMatch']['$nin']
+    return as_list(val)
+
+
+def numbers_condition(op, val, composition=True):
+    """
+    Condition on the atomic numbers present in a configuration. Besides
+    $in (any of the elements) and $nin (none of them) it understands $all
+    (all of them) and $not: {$elemMatch: {$nin: ...}} (no other elements).
+    """
+    if op not in ('$in', '$nin', '$all', '$not'):
+        raise QueryError('numbers {} {}'.format(op, val))
+    n = len(numbers_elements(op, val))
+
+    if composition:
+        masks = lambda val: composition_masks(numbers_elements(op, val))
+        if op in ('$in', '$nin'):
+            # Contains at least one / none of the elements
+            sql = 'systems.id {} (SELECT id FROM abcd_composition WHERE mask0 & ? OR mask1 & ?)'
+            return sql.format('IN' if op == '$in' else 'NOT IN'), masks
+        elif op == '$all':
+            sql = 'systems.id IN (SELECT id FROM abcd_composition WHERE mask0 & ? = ? AND mask1 & ? = ?)'
+            return sql, lambda val: [m for m in masks(val) for _ in range(2)]
+        else:
+            sql = 'systems.id NOT IN (SELECT id FROM abcd_composition WHERE mask0 & ~? OR mask1 & ~?)'
+            return sql, masks
+
+    elements = lambda val: numbers_elements(op, val)
+    if op == '$all':
+        sql = ('systems.id IN (SELECT id FROM species WHERE Z IN ({}) '
+               'GROUP BY id HAVING COUNT(*) = ?)'.format(placeholders(n)))
+        return sql, lambda val: elements(val) + [len(set(elements(val)))]
+    sql = {'$in': 'systems.id IN (SELECT id FROM species WHERE Z IN ({}))',
+           '$nin': 'systems.id NOT IN (SELECT id FROM species WHERE Z IN ({}))',
+           '$not': 'systems.id NOT IN (SELECT id FROM species WHERE Z NOT IN ({}))'}[op]
+    return sql.format(placeholders(n)), elements
+
+
+def key_value_condition(key, op, val):
+    """Condition on a key-value pair stored in the key-value tables"""
+    if op in ('$in', '$nin'):
+        # Values of different types are in different tables
+        tables = [table for table in ('text_key_values', 'number_key_values')
+                  if any(value_table(v) == table for v in as_list(val))]
+        conditions = []
+        for table in tables:
+            n = len([v for v in as_list(val) if value_table(v) == table])
+            conditions.append('(SELECT id FROM {} WHERE key={} AND value {} ({}))'.format(
+                table, quote(key), 'IN' if op == '$in' else 'NOT IN', placeholders(n)))
+        # For $nin the key has to be present with a value which is none of
+        # vals. A row has the value in one of the tables, so it is enough
+        # that it isn't in the values of that table.
+        sql = ' OR '.join('systems.id IN ' + c for c in conditions)
+        return '(' + sql + ')', lambda val: [v for table in tables for v in as_list(val)
+                                             if value_table(v) == table]
+
+    sql = 'systems.id IN (SELECT id FROM {} WHERE key={} AND value{}?)'.format(
+        value_table(val), quote(key), sql_operators[op])
+    return sql, as_list
+
+
+def element_count_key(key):
+    """Whether the key is n_<symbol>, e.g. n_W"""
+    return key.startswith('n_') and atomic_numbers.get(key[2:], 0) > 0
+
+
+def species_key(key):
+    """Returns Z if the key compares the number of atoms of an element"""
+    if key in atomic_numbers and key not in system_columns:
+        return atomic_numbers[key]
+    elif element_count_key(key):
+        # n_<symbol>, the number of atoms of the element
+        return atomic_numbers[key[2:]]
+    return None
+
+
+def condition(key, op, val, composition=True, indexed=()):
+    """
+    Returns an SQL condition for one comparison and a function returning
+    its arguments for the value. indexed are the keys stored in columns
+    of "systems" which have an index.
+    """
+    if key == 'numbers':
+        return numbers_condition(op, val, composition)
+
+    if op not in sql_operators and op not in ('$in', '$nin'):
+        raise QueryError('{} {} {}'.format(key, op, val))
+
+    if key in system_columns:
+        return column_condition(key, op, val, key in indexed)
+    elif species_key(key) is not None:
+        return species_condition(species_key(key), op, val)
+    else:
+        return key_value_condition(key, op, val)
+
+
+def value_shape(val):
+    """What the SQL of a comparison depends on: the types of the values"""
+    if isinstance(val, list):
+        return [value_shape(v) for v in val]
+    elif isinstance(val, dict):
+        return {k: value_shape(v) for k, v in val.items()}
+    return 's' if isinstance(val, string_types) else 'n'
+
+
+def query_shape(query):
+    """
+    Returns a string which is the same for queries that only differ in the
+    compared values and can share one Plan
+    """
+    def shape(query):
+        if isinstance(query, list):
+            return [shape(q) for q in query]
+        dct = {}
+        for key, value in query.items():
+            if key.startswith('$'):
+                dct[key] = shape(value)
+            elif not isinstance(value, dict):
+                dct[key] = value_shape(value)
+            else:
+                dct[key] = {}
+                for op, val in value.items():
+                    dct[key][op] = value_shape(val)
+                    if species_key(key) is not None and (op in sql_operators or
+                                                         op in ('$in', '$nin')):
+                        # Whether rows without the element match
+                        dct[key][op] = [dct[key][op], matches_zero(op, val)]
+        return dct
+    return json.dumps(shape(query), sort_keys=True)
+
+
+def sorted_items(query):
+    return sorted(query.items(), key=lambda item: item[0])
+
+
+def leaves(query):
+    """Yields the comparisons (key, op, val) of a query in a fixed order"""
+    for key, value in sorted_items(query):
+        if key in ('$and', '$or', '$nor'):
+            for q in value:
+                for leaf in leaves(q):
+                    yield leaf
+        elif isinstance(value, dict):
+            for op, val in sorted_items(value):
+                yield key, op, val
+        else:
+            yield key, '$eq', value
+
+
+def compile_condition(query, composition, binders, indexed=()):
+    """
+    Returns the SQL condition for a query, and appends the functions
+    binding its arguments to binders, in the order of leaves(query)
+    """
+    conditions = []
+    for key, value in sorted_items(query):
+        if key in ('$and', '$or', '$nor'):
+            parts = [compile_condition(q, composition, binders, indexed) for q in value]
+            if not parts:
+                sql = '1' if key != '$or' else '0'
+            elif len(parts) == 1 and key != '$nor':
+                sql = parts[0]
+            else:
+                sql = '({})'.format((' AND ' if key == '$and' else ' OR ').join(parts))
+            if key == '$nor':
+                sql = 'NOT ({})'.format(sql)
+            conditions.append(sql)
+        elif key.startswith('$'):
+            raise QueryError(key)
+        else:
+            if not isinstance(value, dict):
+                value = {'$eq': value}
+            for op, val in sorted_items(value):
+                sql, bind = condition(key, op, val, composition, indexed)
+                conditions.append(sql)
+                binders.append(bind)
+
+    if not conditions:
+        return '1'
+    if len(conditions) == 1:
+        return conditions[0]
+    return '({})'.format(' AND '.join(conditions))
+
+
+def top_level(query):
+    """The list of queries which are ANDed at the top level of a query"""
+    return list(query.get('$and', [])) + [{k: v} for k, v in sorted_items(query) if k != '$and']
+
+
+class Plan(object):
+    """
+    A compiled query: the SQL condition for the parts of the query which
+    can be translated to SQL, and the functions binding their arguments.
+    It can be used for any query with the same shape (see query_shape),
+    as long as the same columns are indexed (see condition).
+
+    Besides comparisons, the query can contain $and, $or and $nor (not
+    any of) with lists of queries, nested in any way.
+    """
+
+    def __init__(self, query, composition=True, indexed=()):
+        self.binders = []
+        self.translated = []
+        self.untranslated = []
+        conditions = []
+        for i, single_query in enumerate(top_level(query)):
+            binders = []
+            try:
+                sql = compile_condition(single_query, composition, binders, indexed)
+            except QueryError:
+                self.untranslated.append(i)
+            else:
+                conditions.append(sql)
+                self.binders += binders
+                self.translated.append(i)
+        self.where = ' AND '.join(conditions) if conditions else '1'
+
+    def bind(self, query):
+        """
+        Returns the arguments of the SQL condition for the query and a
+        filter of the parts which were not translated (or None)
+        """
+        queries = top_level(query)
+        args = []
+        comparisons = (leaf for i in self.translated for leaf in leaves(queries[i]))
+        for bind, (key, op, val) in zip(self.binders, comparisons):
+            args += bind(val)
+        rest = [queries[i] for i in self.untranslated]
+        return args, {'$and': rest} if rest else None
+
+
+def order_by(key):
+    """Returns an SQL expression to sort the rows of "systems" by the key"""
+    if key in system_columns:
+        return 'systems.' + system_columns[key]
+    # The key can be in either of the tables
+    return ('COALESCE((SELECT value FROM number_key_values WHERE key={0} AND id=systems.id), '
+            '(SELECT value FROM text_key_values WHERE key={0} AND id=systems.id))'.format(quote(key)))
+
+
+def group_value(key):
+    """Returns an SQL expression of the value of the key, to group the rows of "systems" by"""
+    if element_count_key(key):
+        return 'COALESCE((SELECT n FROM species WHERE Z={} AND id=systems.id), 0)'.format(
+            atomic_numbers[key[2:]])
+    return order_by(key)
+
+
+def number_value(key):
+    """Returns an SQL expression of the value of the key if it is a number, else NULL"""
+    if key in system_columns or element_count_key(key):
+        value = group_value(key)
+        return "CASE WHEN typeof({0}) IN ('integer', 'real') THEN {0} END".format(value)
+    return '(SELECT value FROM number_key_values WHERE key={} AND id=systems.id)'.format(quote(key))
+
+
+def aggregate_sql(where, group_by, metrics):
+    """
+    Returns the statement giving the values of the group_by keys, the
+    number of rows and the count, min, max and mean of each of the metrics
+    for the groups of the rows matching the condition
+    """
+    columns = (['{} AS g{}'.format(group_value(key), i) for i, key in enumerate(group_by)] +
+               ['{} AS m{}'.format(number_value(key), i) for i, key in enumerate(metrics)])
+    selected = 'SELECT {} FROM systems WHERE {}'.format(', '.join(columns or ['1']), where)
+    groups = ['g{}'.format(i) for i in range(len(group_by))]
+    stats = ['COUNT(*)'] + ['COUNT(m{0}), MIN(m{0}), MAX(m{0}), AVG(m{0})'.format(i)
+                            for i in range(len(metrics))]
+    sql = 'SELECT {} FROM ({})'.format(', '.join(groups + stats), selected)
+    if groups:
+        sql += ' GROUP BY ' + ', '.join(groups)
+    return sql
+
+
+def histogram_sql(where, group_by, key, low, high, bins):
+    """
+    Returns the statement giving the number of values of the key in each
+    of the bins from low to high, for the groups of aggregate_sql, and its
+    arguments, which come before those of the condition
+    """
+    columns = (['{} AS g{}'.format(group_value(k), i) for i, k in enumerate(group_by)] +
+               ['{} AS m'.format(number_value(key))])
+    selected = 'SELECT {} FROM systems WHERE {}'.format(', '.join(columns), where)
+    groups = ['g{}'.format(i) for i in range(len(group_by))]
+    if high == low:
+        bin, args = '0', []
+    else:
+        # The largest value is in the last bin
+        bin, args = 'MIN(CAST((m - ?) / ? * ? AS INTEGER), ?)', [low, high - low, bins, bins - 1]
+    return ('SELECT {} FROM ({}) WHERE m IS NOT NULL GROUP BY {}'.format(
+        ', '.join(groups + [bin + ' AS bin', 'COUNT(*)']), selected, ', '.join(groups + ['bin'])),
+        args)
+
+
+# Prefixes of the names of the indexes made by index_statements, by the
+# table they are on
+index_prefixes = {
+    'systems': 'abcd_index_',
+    'text_key_values': 'abcd_text_index_'}
+
+
+def quote_identifier(s):
+    """Quotes a string so it can be used as an SQL identifier"""
+    return '"' + str(s).replace('"', '""') + '"'
+
+
+def index_statements(key):
+    """
+    Returns the statements creating the indexes for queries on the key.
+    Keys stored in the columns of "systems" get an index of the column.
+    Other keys get a partial index of the text values, holding only the
+    rows of this key and covering the ids, so the conditions of
+    key_value_condition are answered from the index alone. The numeric
+    values of all keys have such an index already (see schema_statements
+    of the backend).
+    """
+    if key in system_columns:
+        return ['CREATE INDEX IF NOT EXISTS {} ON systems({})'.format(
+            quote_identifier(index_prefixes['systems'] + key), system_columns[key])]
+    return ['CREATE INDEX IF NOT EXISTS {} ON text_key_values(key, value, id) WHERE key={}'.format(
+        quote_identifier(index_prefixes['text_key_values'] + key), quote(key))]
+
+
+def drop_index_statements(key):
+    """Returns the statements dropping the indexes made by index_statements"""
+    return ['DROP INDEX IF EXISTS ' + quote_identifier(prefix + key)
+            for prefix in sorted(index_prefixes.values())]
+
+
+def indexed_key(name, table):
+    """
+    Returns the key indexed by the index with the given name on the table,
+    or None if it wasn't made by index_statements
+    """
+    prefix = index_prefixes.get(table)
+    if prefix is None or not name.startswith(prefix):
+        return None
+    return name[len(prefix):]
@@ -0,0 +1,142 @@
+"""
+SQLite connections of a backend used from several threads (see the
+"pooled" argument of ASEdbSQlite3Backend).
+
+Each thread reads through a connection of its own, made the first time it
+reads. All writes go through one writer connection, which one thread at a
+time holds for a whole backend call, and are committed at the end of it.
+The database is switched to WAL journaling, where readers see the last
+committed state and neither block the writer nor wait for it, so queries
+keep running during a long --store.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .locking import begin_immediate
+
+# Seconds a connection waits for a lock held by another process
+TIMEOUT = 20
+
+
+class ConnectionPool(object):
+    def __init__(self, filename, wal=True, timeout=TIMEOUT):
+        '''
+        wal: switch the database to WAL journaling. This needs write
+        access to the directory of the database.
+        '''
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._writer_lock = threading.RLock()
+        self._writer = None
+        # Seconds the last transaction of the writer waited for the lock of
+        # the database, held by other processes
+        self.lock_wait = 0.
+        # The lock is only needed to switch, databases already in WAL mode
+        # are opened while others write
+        if wal and self._journal_mode() != 'wal':
+            with self._writing() as con:
+                con.execute('PRAGMA journal_mode=WAL')
+
+    def _journal_mode(self):
+        con = sqlite3.connect(self.filename, timeout=self.timeout)
+        try:
+            return con.execute('PRAGMA journal_mode').fetchone()[0]
+        finally:
+            con.close()
+
+    def _connect(self):
+        # Connections are made and used in one thread, but close() may
+        # be called from another one
+        con = sqlite3.connect(self.filename, timeout=self.timeout, check_same_thread=False)
+        with self._lock:
+            self._connections.append(con)
+        return con
+
+    def reader(self):
+        '''Returns the connection of the current thread for reading'''
+        con = getattr(self._local, 'connection', None)
+        if con is None:
+            con = self._local.connection = self._connect()
+            con.execute('PRAGMA query_only=1')
+        return con
+
+    @contextmanager
+    def _writing(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            yield self._writer
+
+    @contextmanager
+    def writer(self):
+        '''
+        Holds the writer connection for the block and commits its changes
+        at the end, or rolls them back if it raises. Blocks of other
+        threads wait; nested blocks of the same thread are part of the
+        outer one.
+        '''
+        with self._writing() as con:
+            depth = getattr(self._local, 'writing', 0)
+            self._local.writing = depth + 1
+            try:
+                if depth == 0:
+                    self.lock_wait = begin_immediate(con)
+                yield con
+                if depth == 0:
+                    con.commit()
+            except:
+                if depth == 0:
+                    con.rollback()
+                raise
+            finally:
+                self._local.writing = depth
+
+    def begin(self):
+        '''
+        Holds the writer connection for the current thread until end() is
+        called, so that its writes in between are one transaction
+        '''
+        self._writer_lock.acquire()
+        try:
+            if self._writer is None:
+                self._writer = self._connect()
+            if not self.writing():
+                self.lock_wait = begin_immediate(self._writer)
+        except:
+            self._writer_lock.release()
+            raise
+        self._local.writing = getattr(self._local, 'writing', 0) + 1
+
+    def end(self, commit=True):
+        '''Commits (or rolls back) the transaction of begin() and releases the writer'''
+        if not self.writing():
+            return
+        try:
+            if commit:
+                self._writer.commit()
+            else:
+                self._writer.rollback()
+        finally:
+            self._local.writing -= 1
+            self._writer_lock.release()
+
+    def writing(self):
+        '''Whether the current thread holds the writer connection'''
+        return getattr(self._local, 'writing', 0) > 0
+
+    def connection(self):
+        '''Returns the connection the current thread should use'''
+        return self._writer if self.writing() else self.reader()
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for con in connections:
+            con.close()
+        self._local = threading.local()
+        self._writer = None
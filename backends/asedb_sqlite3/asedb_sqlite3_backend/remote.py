@@ -20,6 +20,12 @@ def result_from_dct(result_type, **kwargs):
     """
     Re-creates a result that was converted to a dictionary.
     """
+    result = make_result(result_type, **kwargs)
+    result.lock_wait = kwargs.get('_lock_wait', 0.)
+    return result
+
+
+def make_result(result_type, **kwargs):
     if result_type == 'InsertResult':
         return results.InsertResult(kwargs['_inserted_ids'],
                                      kwargs['_skipped_ids'],
@@ -32,6 +38,7 @@ def result_from_dct(result_type, **kwargs):
                                     kwargs['_msg'])
     elif result_type == 'RemoveResult':
         return results.RemoveResult(kwargs['_removed_count'],
+                                    kwargs.get('_removed_ids'),
                                     kwargs['_msg'])
     elif result_type == 'AddKvpResult':
         return results.AddKvpResult(kwargs['_modified_ids'],
@@ -45,17 +52,35 @@ def result_from_dct(result_type, **kwargs):
         raise NotImplementedError(result_type)
 
 
+def ssh_args(host):
+    """
+    Returns the command line of the process which passes its input to the
+    server on the remote host.
+    """
+    # The host can have options of ssh after it, as in a shell
+    return ['ssh', '-q', '-T'] + host.split()
+
+
 def communicate_with_remote(host, command):
     """
     Sends a command to the remote host and interprets and returns the response.
     """
 
-    tty_flag = '-T'
-    ssh_call = 'ssh -q {} {} '.format(tty_flag, host)
-
     # Pipe the command to the remote host via ssh
-    process = Popen(ssh_call, shell=True, stdout=PIPE, stderr=PIPE, stdin=PIPE)
+    process = Popen(ssh_args(host), stdout=PIPE, stderr=PIPE, stdin=PIPE)
     stdout, stderr = process.communicate(command)
+    return interpret_response(stdout, stderr)
+
+
+def interpret_response(stdout, stderr):
+    """
+    Returns the result of a response of the server (see server.py), or
+    raises the error it reports.
+    """
+
+    if not isinstance(stdout, str):
+        stdout = stdout.decode()
+        stderr = stderr.decode()
 
     if len(stdout) < 5 or stdout[3] != ':':
         raise CommunicationError(stdout + '\n' + stderr)
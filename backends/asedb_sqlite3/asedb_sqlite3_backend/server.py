@@ -57,11 +57,11 @@ def backendList(user):
 
 
 @error_handler
-def backendInsert(database, user, atoms):
+def backendInsert(database, user, atoms, duplicates):
     box = StructureBox(Backend(database=database, user=user))
     atoms_dcts_list = json.loads(b64decode(atoms))
     atoms_list = [dict2atoms(atoms_dct, plain_arrays=True) for atoms_dct in atoms_dcts_list]
-    res = box.insert(auth_token='', atoms=atoms_list)
+    res = box.insert(auth_token='', atoms=atoms_list, duplicates=duplicates)
     print('220:' + b64encode(json.dumps(res.__dict__)))
 
 
@@ -96,6 +96,15 @@ def backendFind(database, user, filter, sort, limit, keys, omit_keys):
     print('204:' + b64encode(json.dumps(atoms_dcts_list)))
 
 
+@error_handler
+def backendExplain(database, user, filter, sort, limit):
+    box = StructureBox(Backend(database=database, user=user))
+    report = box.explain(auth_token='', filter=json.loads(b64decode(filter)),
+                         sort=json.loads(b64decode(sort)),
+                         limit=limit)
+    print('203:' + b64encode(json.dumps(report)))
+
+
 @error_handler
 def backendAddKeys(database, user, filter, kvp):
     box = StructureBox(Backend(database=database, user=user))
@@ -114,6 +123,41 @@ def backendRemoveKeys(database, user, filter, keys):
     print('224:' + b64encode(json.dumps(res.__dict__)))
 
 
+@error_handler
+def backendKeyStatistics(database, user):
+    box = StructureBox(Backend(database=database, user=user))
+    print('203:' + b64encode(json.dumps(box.key_statistics(auth_token=''))))
+
+
+@error_handler
+def backendAggregate(database, user, filter, group_by, metrics, bins):
+    box = StructureBox(Backend(database=database, user=user))
+    entries = box.aggregate(auth_token='', filter=json.loads(b64decode(filter)),
+                            group_by=json.loads(b64decode(group_by)),
+                            metrics=json.loads(b64decode(metrics)), bins=bins)
+    print('203:' + b64encode(json.dumps(entries)))
+
+
+@error_handler
+def backendCreateIndex(database, user, keys):
+    box = StructureBox(Backend(database=database, user=user))
+    created = box.create_index(auth_token='', keys=json.loads(b64decode(keys)))
+    print('202:' + b64encode(json.dumps(created)))
+
+
+@error_handler
+def backendListIndexes(database, user):
+    box = StructureBox(Backend(database=database, user=user))
+    print('202:' + b64encode(json.dumps(box.list_indexes(auth_token=''))))
+
+
+@error_handler
+def backendDropIndex(database, user, keys):
+    box = StructureBox(Backend(database=database, user=user))
+    dropped = box.drop_index(auth_token='', keys=json.loads(b64decode(keys)))
+    print('202:' + b64encode(json.dumps(dropped)))
+
+
 def main():
     # Get the username
     #
@@ -145,6 +189,7 @@ def main():
     insert_parser = subparsers.add_parser('insert')
     insert_parser.add_argument('database')
     insert_parser.add_argument('atoms')
+    insert_parser.add_argument('--duplicates', choices=['skip', 'link'], default=None)
 
     update_parser = subparsers.add_parser('update')
     update_parser.add_argument('database')
@@ -165,6 +210,12 @@ def main():
     find_parser.add_argument('--keys', default='++')
     find_parser.add_argument('--omit-keys', default=[])
 
+    explain_parser = subparsers.add_parser('explain')
+    explain_parser.add_argument('database')
+    explain_parser.add_argument('filter')
+    explain_parser.add_argument('--sort', default={})
+    explain_parser.add_argument('--limit', type=int, default=0)
+
     add_keys_parser = subparsers.add_parser('add-keys')
     add_keys_parser.add_argument('database')
     add_keys_parser.add_argument('filter')
@@ -175,6 +226,27 @@ def main():
     remove_keys_parser.add_argument('filter')
     remove_keys_parser.add_argument('keys')
 
+    key_statistics_parser = subparsers.add_parser('key-statistics')
+    key_statistics_parser.add_argument('database')
+
+    aggregate_parser = subparsers.add_parser('aggregate')
+    aggregate_parser.add_argument('database')
+    aggregate_parser.add_argument('filter')
+    aggregate_parser.add_argument('--group-by', default=[])
+    aggregate_parser.add_argument('--metrics', default=[])
+    aggregate_parser.add_argument('--bins', type=int, default=0)
+
+    create_index_parser = subparsers.add_parser('create-index')
+    create_index_parser.add_argument('database')
+    create_index_parser.add_argument('keys')
+
+    list_indexes_parser = subparsers.add_parser('list-indexes')
+    list_indexes_parser.add_argument('database')
+
+    drop_index_parser = subparsers.add_parser('drop-index')
+    drop_index_parser.add_argument('database')
+    drop_index_parser.add_argument('keys')
+
     args = parser.parse_args(arguments)
 
     try:
@@ -188,7 +260,7 @@ def main():
         backendList(user)
 
     elif args.subparser_name == 'insert':
-        backendInsert(args.database, user, args.atoms)
+        backendInsert(args.database, user, args.atoms, args.duplicates)
 
     elif args.subparser_name == 'update':
         backendUpdate(args.database, user, args.atoms, args.upsert, args.replace)
@@ -200,8 +272,26 @@ def main():
         backendFind(args.database, user, args.filter, args.sort,
                     args.limit, args.keys, args.omit_keys)
 
+    elif args.subparser_name == 'explain':
+        backendExplain(args.database, user, args.filter, args.sort, args.limit)
+
     elif args.subparser_name == 'add-keys':
         backendAddKeys(args.database, user, args.filter, args.kvp)
 
     elif args.subparser_name == 'remove-keys':
         backendRemoveKeys(args.database, user, args.filter, args.keys)
+
+    elif args.subparser_name == 'key-statistics':
+        backendKeyStatistics(args.database, user)
+
+    elif args.subparser_name == 'aggregate':
+        backendAggregate(args.database, user, args.filter, args.group_by, args.metrics, args.bins)
+
+    elif args.subparser_name == 'create-index':
+        backendCreateIndex(args.database, user, args.keys)
+
+    elif args.subparser_name == 'list-indexes':
+        backendListIndexes(args.database, user)
+
+    elif args.subparser_name == 'drop-index':
+        backendDropIndex(args.database, user, args.keys)
@@ -0,0 +1,120 @@
+"""
+Measures queries from several threads while another thread stores
+configurations, with the pooled backend and with one backend shared
+behind a lock (the backend is not thread-safe otherwise). The database is
+made in a temporary directory:
+
+    python benchmark_concurrency.py [--rows 2000] [--readers 8] [--seconds 5]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from ase.build import bulk
+from ase.calculators.singlepoint import SinglePointCalculator
+
+import asedb_sqlite3_backend.util as asedb_util
+from abcd.query import translate
+
+
+def configurations(n, start=0):
+    atoms_list = []
+    for i in range(start, start + n):
+        atoms = bulk('Si', cubic=True)
+        atoms.info['config_type'] = 'bulk' if i % 2 else 'surface'
+        atoms.info['n'] = i
+        atoms.calc = SinglePointCalculator(atoms, energy=-float(i),
+                                           forces=np.zeros((len(atoms), 3)))
+        atoms_list.append(atoms)
+    return atoms_list
+
+
+class Locked(object):
+    '''Calls of the backend one at a time'''
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                result = method(*args, **kwargs)
+                return list(result) if name == 'find' else result
+        return locked
+
+
+def run(backend, readers, seconds, start):
+    latencies = []
+    stop = threading.Event()
+    stored = [0]
+
+    def read(i):
+        query = translate(['n>={}'.format(i * 10), 'config_type=bulk'])
+        while not stop.is_set():
+            started = time.time()
+            list(backend.find('', query, {}, 50, None, False))
+            backend.count('', translate(['energy<-{}'.format(i)]))
+            latencies.append(time.time() - started)
+
+    def write():
+        n = start
+        while not stop.is_set():
+            backend.insert('', configurations(100, n))
+            n += 100
+            stored[0] += 100
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / float(seconds), np.percentile(latencies, 99), stored[0] / float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(tmp, 'all'))
+        asedb_util.CONFIG_PATH = os.path.join(tmp, 'config')
+        with open(asedb_util.CONFIG_PATH, 'w') as f:
+            f.write('[ase-db]\ndbs_path = {}\n'.format(tmp))
+        from asedb_sqlite3_backend.asedb_sqlite3_backend import ASEdbSQlite3Backend
+
+        backend = ASEdbSQlite3Backend(database='benchmark')
+        backend.insert('', configurations(args.rows))
+
+        print('{} readers, {} rows at the start'.format(args.readers, args.rows))
+        print('{:>8} {:>12} {:>16} {:>14}'.format('', 'queries/s', 'p99 latency (s)', 'stored/s'))
+        start = args.rows
+        for name in ('locked', 'pooled'):
+            if name == 'locked':
+                tested = Locked(ASEdbSQlite3Backend(database='benchmark'))
+            else:
+                tested = ASEdbSQlite3Backend(database='benchmark', pooled=True)
+            rate, p99, stored = run(tested, args.readers, args.seconds, start)
+            start += 10 ** 6
+            tested.close()
+            print('{:>8} {:>12.1f} {:>16.4f} {:>14.1f}'.format(name, rate, p99, stored))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares storing arrays as BSON Binary (mongobackend.codec) with storing
+them as nested lists, as the backend used to. Documents of configurations
+with forces are encoded to BSON and decoded back, without a server:
+
+    python benchmark_codec.py [--atoms 1000] [--configurations 200]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from ase.build import bulk
+from ase.calculators.singlepoint import SinglePointCalculator
+from bson import decode, encode
+
+from mongobackend import codec
+from mongobackend.mongobackend import atoms2document, document2atoms
+
+
+def to_lists(son):
+    if isinstance(son, dict):
+        if son.get('_type') == codec.ARRAY_TYPE:
+            return {'_type': codec.LIST_ARRAY_TYPE, 'value': codec.decode_array(son).tolist()}
+        return {key: to_lists(value) for key, value in son.items()}
+    elif isinstance(son, list):
+        return [to_lists(value) for value in son]
+    return son
+
+
+def from_lists(son):
+    if isinstance(son, dict):
+        if son.get('_type') == codec.LIST_ARRAY_TYPE:
+            return np.array(son['value'])
+        return {key: from_lists(value) for key, value in son.items()}
+    elif isinstance(son, list):
+        return [from_lists(value) for value in son]
+    return son
+
+
+def configurations(n_atoms, n):
+    atoms = bulk('Cu', cubic=True).repeat((int(np.ceil((n_atoms / 4.) ** (1 / 3.))),) * 3)
+    atoms = atoms[:n_atoms]
+    atoms.calc = SinglePointCalculator(atoms, energy=-1.0, forces=np.random.rand(len(atoms), 3))
+    return [atoms] * n
+
+
+def timed(func, items):
+    start = time.time()
+    results = [func(item) for item in items]
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--atoms', type=int, default=1000)
+    parser.add_argument('--configurations', type=int, default=200)
+    args = parser.parse_args()
+
+    atoms_list = configurations(args.atoms, args.configurations)
+    docs = [atoms2document(atoms) for atoms in atoms_list]
+
+    paths = [
+        ('lists', lambda doc: encode(to_lists(doc)),
+         lambda data: document2atoms(from_lists(decode(data)))),
+        ('binary', lambda doc: encode(doc),
+         lambda data: document2atoms(decode(data)))]
+
+    print('{} configurations of {} atoms'.format(args.configurations, len(atoms_list[0])))
+    print('{:>8} {:>12} {:>12} {:>12}'.format('', 'encode (s)', 'decode (s)', 'size (MB)'))
+    for name, encoder, decoder in paths:
+        encode_time, encoded = timed(encoder, docs)
+        decode_time, _ = timed(decoder, encoded)
+        size = sum(len(data) for data in encoded) / 1e6
+        print('{:>8} {:>12.3f} {:>12.3f} {:>12.1f}'.format(name, encode_time, decode_time, size))
+
+
+if __name__ == '__main__':
+    main()
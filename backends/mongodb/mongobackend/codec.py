@@ -0,0 +1,88 @@
+"""
+Storage of NumPy arrays in documents. An array is a subdocument holding its
+dtype, its shape and its data as BSON Binary:
+
+    {'_type': 'ndarray', 'dtype': '<f8', 'shape': [2, 3], 'data': Binary(...)}
+
+which keeps the dtype and takes a single copy of the buffer each way.
+decode_array returns a read-only view of the Binary (np.frombuffer), so
+arrays are only copied if the Atoms object copies them.
+
+The arrays of atoms2dict are at known places of a document (see
+array_fields), so they are encoded and decoded there, without walking the
+whole document. Other NumPy values (e.g. in calculator parameters) are
+handled by the fallback encoder of codec_options.
+"""
+
+import numpy as np
+from bson.binary import Binary
+from bson.codec_options import CodecOptions, TypeRegistry
+
+ARRAY_TYPE = 'ndarray'
+
+# Arrays stored by versions of the backend writing them as lists
+LIST_ARRAY_TYPE = 'nparray'
+
+
+def is_array(value):
+    return isinstance(value, np.ndarray) or (
+        hasattr(value, '__array__') and not isinstance(value, np.generic))
+
+
+def encode_array(value):
+    """Returns the subdocument of an array"""
+    value = np.ascontiguousarray(value)
+    if value.dtype.hasobject:
+        # Python objects have no buffer to store
+        return [encode_value(v) for v in value.tolist()]
+    return {'_type': ARRAY_TYPE,
+            'dtype': value.dtype.str,
+            'shape': list(value.shape),
+            'data': Binary(value.tobytes())}
+
+
+def decode_array(value):
+    """Returns the array of a subdocument made by encode_array, other values unchanged"""
+    if not isinstance(value, dict):
+        return value
+    _type = value.get('_type')
+    if _type == ARRAY_TYPE:
+        return np.frombuffer(value['data'], dtype=np.dtype(value['dtype'])).reshape(value['shape'])
+    elif _type == LIST_ARRAY_TYPE:
+        return np.array(value['value'])
+    return value
+
+
+def encode_value(value):
+    """Encodes arrays and NumPy scalars, returns other values unchanged"""
+    if isinstance(value, np.generic):
+        return value.item()
+    elif is_array(value):
+        return encode_array(value)
+    return value
+
+
+def encode_fields(doc, fields):
+    """Encodes the given fields of the document in place"""
+    for key in fields:
+        if key in doc:
+            doc[key] = encode_value(doc[key])
+    return doc
+
+
+def decode_fields(doc, fields):
+    """Decodes the given fields of the document in place"""
+    for key in fields:
+        if key in doc:
+            doc[key] = decode_array(doc[key])
+    return doc
+
+
+def fallback_encoder(value):
+    """Encodes the NumPy values BSON doesn't know, wherever they are"""
+    if isinstance(value, np.generic) or is_array(value):
+        return encode_value(value)
+    return value
+
+
+codec_options = CodecOptions(type_registry=TypeRegistry(fallback_encoder=fallback_encoder))
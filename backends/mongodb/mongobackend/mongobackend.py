@@ -2,125 +2,515 @@ from abcd import util, results
 
 __author__ = 'Martin Uhrin'
 
+from itertools import islice
+
 import numpy as np
-from pymongo import MongoClient
-from pymongo.son_manipulator import SONManipulator
-from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, DeleteOne, InsertOne, MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 import ase.atoms
-import ase.db.row
+from ase.calculators.calculator import all_properties
+from ase.data import chemical_symbols
 
-from abcd.backend import Backend
+from abcd.aggregation import group_entry, group_order, key_stats, overall_range, set_histograms
+from abcd.backend import Backend, Direction, WriteError
+from abcd.derived import derived_keys
+from abcd.filtering import element_count_key
 import abcd.authentication as authentication
 import abcd.backend
 import abcd.results as results
 import abcd.util as util
 
+from .codec import codec_options, decode_fields, encode_fields, encode_value
+
+
+# Number of operations sent to the server in one bulk write
+BULK_SIZE = 1000
+
+# Error code of writes violating a unique index
+DUPLICATE_KEY_ERROR = 11000
+
+# Fields of a stored document which are not keys of Atoms.info
+structure_fields = set(['_id', 'numbers', 'positions', 'cell', 'pbc', 'initial_magmoms',
+                        'initial_charges', 'masses', 'tags', 'momenta', 'constraints',
+                        'calculator', 'calculator_parameters', 'arrays']) | set(all_properties)
+
+# Results of comparing zero using the query operators
+zero_matches = {
+    '$eq': lambda v: v == 0,
+    '$ne': lambda v: v != 0,
+    '$gt': lambda v: 0 > v,
+    '$gte': lambda v: 0 >= v,
+    '$lt': lambda v: 0 < v,
+    '$lte': lambda v: 0 <= v,
+    '$in': lambda v: 0 in v,
+    '$nin': lambda v: 0 not in v}
+
+
+# Prefix of the names of the indexes made by create_index
+index_prefix = 'abcd_index_'
+
+
+def atoms2document(atoms, keys={}):
+    """
+    Converts the Atoms object to the stored document, with the keys
+    added to those of Atoms.info (which is left as it is). Besides the
+    dictionary from atoms2dict, it holds the number of atoms of each
+    element present (n_<symbol>), the reduced formula, the fingerprint
+    (see abcd.util.fingerprint) and the derived properties (see
+    abcd.derived), so that queries on them are answered by the database.
+    Keys of Atoms.info are at the top level, where queries look for them,
+    and "numbers" is a plain list for queries on the elements. Other
+    arrays are stored by the codec.
+    """
+    doc = util.atoms2dict(atoms)
+    doc.update(doc.pop('info'))
+    doc.update(keys)
+    doc.update(util.element_counts(atoms.numbers))
+    doc['formula_reduced'] = util.reduced_formula(atoms.numbers)
+    if 'fingerprint' not in keys:
+        doc['fingerprint'] = util.fingerprint(atoms)
+    doc.update(derived_keys(atoms))
+    encode_fields(doc, list(doc))
+    encode_fields(doc['arrays'], list(doc['arrays']))
+    for constraint in doc.get('constraints', []):
+        encode_fields(constraint.get('kwargs', {}), list(constraint.get('kwargs', {})))
+    doc['numbers'] = atoms.numbers.tolist()
+    return doc
+
+
+def document2atoms(doc):
+    """Converts a document stored by atoms2document back to an Atoms object"""
+    dct = {key: value for key, value in doc.items() if key in structure_fields}
+    decode_fields(dct, list(dct))
+    decode_fields(dct.get('arrays', {}), list(dct.get('arrays', {})))
+    for constraint in dct.get('constraints', []):
+        decode_fields(constraint.get('kwargs', {}), list(constraint.get('kwargs', {})))
+    dct['info'] = {key: value for key, value in doc.items()
+                   if key not in structure_fields and not element_count_key(key)}
+    return util.dict2atoms(dct)
+
+
+def projection(keys, omit_keys):
+    """
+    Returns the projection reading only the keys of Atoms.info to be
+    shown (see abcd.util.filter_keys), or None for whole documents. The
+    fields of the structure are always read.
+    """
+    if keys is None and not omit_keys:
+        return None
+    if omit_keys and keys is not None:
+        omitted = [key for key in keys if key not in structure_fields]
+        return {key: False for key in omitted} or None
+    fields = {key: True for key in structure_fields}
+    for key in keys or []:
+        fields[key] = True
+    return fields
+
+
+def sort_spec(sort):
+    """
+    Returns the pymongo sort specification of a sort dictionary (key ->
+    abcd.Direction), in its order. Ties are broken by the order of insertion.
+    """
+    spec = [(key, DESCENDING if direction == Direction.DESCENDING else ASCENDING)
+            for key, direction in sort.items()]
+    return spec + [('_id', ASCENDING)]
+
+
+def group_field(key):
+    """Returns the aggregation expression of the value of a group_by key"""
+    if element_count_key(key):
+        # Documents have n_<symbol> only for the elements they contain
+        return {'$ifNull': ['$' + key, 0]}
+    return {'$ifNull': ['$' + key, None]}
+
+
+def number_field(key):
+    """Returns the aggregation expression of the value of the key if it is a number, else null"""
+    if element_count_key(key):
+        return group_field(key)
+    return {'$cond': [{'$isNumber': '$' + key}, '$' + key, None]}
+
+
+def aggregate_pipeline(filter, group_by, metrics):
+    """
+    Returns the pipeline giving the number of documents and the count,
+    min, max and mean of each of the metrics for the groups of documents
+    matching the filter
+    """
+    fields = {'g{}'.format(i): group_field(key) for i, key in enumerate(group_by)}
+    fields.update({'m{}'.format(i): number_field(key) for i, key in enumerate(metrics)})
+    group = {'_id': {'g{}'.format(i): '$g{}'.format(i) for i in range(len(group_by))},
+             'count': {'$sum': 1}}
+    for i in range(len(metrics)):
+        m = '$m{}'.format(i)
+        group['count{}'.format(i)] = {'$sum': {'$cond': [{'$eq': [m, None]}, 0, 1]}}
+        group['min{}'.format(i)] = {'$min': m}
+        group['max{}'.format(i)] = {'$max': m}
+        group['mean{}'.format(i)] = {'$avg': m}
+    return [{'$match': composition_filter(filter)}, {'$project': fields or {'_id': 1}},
+            {'$group': group}]
+
+
+def histogram_pipeline(filter, group_by, key, low, high, bins):
+    """
+    Returns the pipeline giving the number of values of the key in each of
+    the bins from low to high, for the groups of aggregate_pipeline
+    """
+    fields = {'g{}'.format(i): group_field(k) for i, k in enumerate(group_by)}
+    fields['m'] = number_field(key)
+    if high == low:
+        bin = {'$literal': 0}
+    else:
+        # The largest value is in the last bin
+        bin = {'$min': [{'$floor': {'$multiply': [
+            {'$divide': [{'$subtract': ['$m', low]}, high - low]}, bins]}}, bins - 1]}
+    groups = {'g{}'.format(i): 1 for i in range(len(group_by))}
+    groups['bin'] = bin
+    ids = {'g{}'.format(i): '$g{}'.format(i) for i in range(len(group_by))}
+    ids['bin'] = '$bin'
+    return [{'$match': composition_filter(filter)}, {'$project': fields},
+            {'$match': {'m': {'$ne': None}}}, {'$project': groups},
+            {'$group': {'_id': ids, 'count': {'$sum': 1}}}]
+
+
+def batches(iterable, size=None):
+    """Yields lists of up to size items of the iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size or BULK_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def composition_filter(filter):
+    """
+    Documents only have n_<symbol> for the elements they contain.
+    Comparisons which zero satisfies (e.g. n_W<2) are extended to match
+    documents without the field. Empty $and lists (of the empty query),
+    which MongoDB rejects, are left out.
+    """
+    if isinstance(filter, list):
+        return [composition_filter(f) for f in filter]
+    if not isinstance(filter, dict):
+        return filter
+
+    new_filter = {}
+    extended = []
+    for key, value in filter.items():
+        if key == '$and' and not value:
+            continue
+        if (key.startswith('n_') and key[2:] in chemical_symbols[1:] and
+                isinstance(value, dict) and
+                all(op in zero_matches and zero_matches[op](v) for op, v in value.items())):
+            extended.append({'$or': [{key: value}, {key: {'$exists': False}}]})
+        else:
+            new_filter[key] = composition_filter(value)
+    if not extended:
+        return new_filter
+    return {'$and': [new_filter] + extended} if new_filter else {'$and': extended}
 
-class MongoDBBackend(Backend):
-    class Transform(SONManipulator):
-        def transform_incoming(self, son, collection):
-            for key, value in son.items():
-                if isinstance(value, np.ndarray):
-                    son[key] = {"_type": "nparray", "value": value.tolist()}
-                elif isinstance(value, dict):  # Make sure we recurse into sub-docs
-                    son[key] = self.transform_incoming(value, collection)
-            return son
-
-        def transform_outgoing(self, son, collection):
-            for key, value in son.items():
-                if isinstance(value, dict):
-                    if "_type" in value and value["_type"] == "nparray":
-                        son[key] = np.array(value["value"])
-                    else:  # Again, make sure to recurse into sub-docs
-                        son[key] = self.transform_outgoing(value, collection)
-            return son
 
+class MongoDBBackend(Backend):
     class Cursor(abcd.backend.Cursor):
-        def __init__(self, pymongo_cursor):
+        """Decodes the documents of the pymongo cursor as they are read"""
+        def __init__(self, pymongo_cursor, keys=None, omit_keys=False):
             self.pymongo_cursor = pymongo_cursor
+            self.keys = keys
+            self.omit_keys = omit_keys
 
         def __next__(self):
-            return ase.db.row.AtomsRow(next(self.pymongo_cursor)).toatoms()
+            atoms = document2atoms(next(self.pymongo_cursor))
+            if self.keys is not None or self.omit_keys:
+                shown = util.filter_keys(list(atoms.info), self.keys, self.omit_keys)
+                atoms.info = {key: atoms.info[key] for key in shown}
+            return atoms
+
+        def next(self):
+            return self.__next__()
 
         def count(self):
-            return self.pymongo_cursor.count()
+            n = 0
+            for doc in self.pymongo_cursor:
+                n += 1
+            return n
 
-    def __init__(self, host, port, database='abcd', collection='structures',
-                 user=None, password=None):
+    # MongoClient is thread-safe and keeps a pool of connections
+    thread_safe = True
+
+    def __init__(self, host='localhost', port=27017, database='abcd', collection='structures',
+                 user=None, password=None, client=None, batch_size=None):
+        """
+        client is an already connected MongoClient (or an object with the
+        same interface, such as mongomock.MongoClient) to use instead of
+        connecting to host and port. batch_size is the number of documents
+        find receives from the server at a time (by default, as many as fit
+        in a message).
+        """
         super(MongoDBBackend, self).__init__()
 
         self.host = host
         self.port = port
         self.database_name = database
         self.collection_name = collection
-        self.connection = MongoClient(self.host, self.port)
+        self.batch_size = batch_size
+        if client is not None:
+            self.connection = client
+        elif user:
+            self.connection = MongoClient(self.host, self.port, username=user, password=password,
+                                          authSource=self.database_name)
+        else:
+            self.connection = MongoClient(self.host, self.port)
         self.db = self.connection[self.database_name]
-        if user:
-            self.db.authenticate(user, password)
-        self.collection = self.db[self.collection_name]
+        self.collection = self.db.get_collection(self.collection_name,
+                                                 codec_options=codec_options)
 
-        self.db.add_son_manipulator(MongoDBBackend.Transform())
+        # Inserting a uid which is already stored fails, even if two
+        # writers do it at the same time
+        self.collection.create_index([('uid', ASCENDING)], unique=True, name='uid_unique')
 
     def authenticate(self, credentials):
         return authentication.AuthToken(credentials.username)
 
     def list(self, auth_token):
-        return self.db.collection_names(False)
+        return self.db.list_collection_names()
 
-    def insert(self, auth_token, atoms, kvp):
-        ids = []
+    def _bulk_write(self, requests):
+        """
+        Sends the requests in one unordered bulk write. Returns the indices
+        of requests which failed because their uid is already stored.
+        """
+        if not requests:
+            return set()
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            other = [error for error in errors if error.get('code') != DUPLICATE_KEY_ERROR]
+            if other or e.details.get('writeConcernErrors'):
+                raise WriteError(str(other[0]['errmsg'] if other else e.details['writeConcernErrors']))
+            return set(error['index'] for error in errors)
+        return set()
+
+    def _stored_uids(self, uids):
+        """Returns the set of the uids which are in the collection"""
+        uids = [uid for uid in uids if uid is not None]
+        if not uids:
+            return set()
+        return set(doc['uid'] for doc in self.collection.find({'uid': {'$in': uids}}, {'uid': 1}))
+
+    def _fingerprint_uids(self, fps):
+        """Returns a dictionary of the stored uids with the given fingerprints"""
+        found = {}
+        for doc in self.collection.find({'fingerprint': {'$in': list(fps)}},
+                                        {'fingerprint': 1, 'uid': 1}):
+            found.setdefault(doc['fingerprint'], doc['uid'])
+        return found
+
+    def insert(self, auth_token, atoms, duplicates=None):
         if isinstance(atoms, ase.atoms.Atoms):
-            # We're just inserting one
-            ids.append(self.collection.insert(util.atoms2dict(atoms)))
-        else:
-            # Assume atoms is an iterable
-            dicts = [util.atoms2dict(a) for a in atoms]
-            ids.extend(self.collection.insert(dicts))
-
-        return results.InsertResult(ids)
-
-    def update(self, auth_token, atoms):
-        if 'uid' not in atoms.info:
-            return results.UpdateResult(None, "Cannot update a structure"
-                                              "without a valid uid")
-        uid = atoms.info.uid
-        doc = util.atoms2dict(atoms)
-        self.collection.update({'_id': ObjectId(uid)},
-                               {'$set': doc})
-
-        return results.UpdateResult([uid])
-
-    def remove(self, auth_token, filter, just_one, confirm):
-        return results.RemoveResult(self.collection.remove(
-            filter, multi=not just_one)["n"])
-
-    def find(self, auth_token, filter, sort, reverse, limit, keys, omit_keys):
-        cur = self.collection.find(filter)
-        if sort:
-            cur.sort({sort: 1})
+            atoms = [atoms]
+        if duplicates not in (None, 'skip', 'link'):
+            raise ValueError('Unknown duplicates option: {}'.format(duplicates))
+
+        inserted_ids = []
+        skipped_ids = []
+        seen = set()
+        # Fingerprints of configurations inserted by this call
+        fingerprints = {}
+        n_atoms = 0
+
+        for batch in batches(atoms):
+            n_atoms += len(batch)
+            stored = self._stored_uids([a.info.get('uid') for a in batch])
+            if duplicates is not None:
+                fps = [util.fingerprint(a) for a in batch]
+                stored_fps = self._fingerprint_uids(set(fps))
+
+            docs = []
+            for i, a in enumerate(batch):
+                uid = a.info.get('uid')
+                if uid is not None and uid in seen:
+                    continue
+                if uid in stored:
+                    skipped_ids.append(uid)
+                    seen.add(uid)
+                    continue
+                # Keys stored with the configuration, but not set on it
+                keys = {}
+                if uid is None:
+                    keys['uid'] = uid = util.random_uid()
+                seen.add(uid)
+
+                if duplicates is not None:
+                    fp = fps[i]
+                    duplicate_uid = fingerprints.get(fp) or stored_fps.get(fp)
+                    if duplicate_uid is not None and duplicates == 'skip':
+                        # Report the uid of the configuration already stored
+                        skipped_ids.append(duplicate_uid)
+                        continue
+                    keys['fingerprint'] = fp
+                    if duplicate_uid is not None:
+                        keys['duplicate_of'] = duplicate_uid
+                    fingerprints.setdefault(fp, uid)
+                docs.append(atoms2document(a, keys))
+
+            failed = self._bulk_write([InsertOne(doc) for doc in docs])
+            for i, doc in enumerate(docs):
+                # Configurations stored meanwhile by someone else are skipped
+                (skipped_ids if i in failed else inserted_ids).append(doc['uid'])
+
+        msg = 'Inserted {}/{} configurations.'.format(len(inserted_ids), n_atoms)
+        return results.InsertResult(inserted_ids=inserted_ids, skipped_ids=skipped_ids, msg=msg)
+
+    def update(self, auth_token, atoms, upsert=False, replace=False):
+        if isinstance(atoms, ase.atoms.Atoms):
+            atoms = [atoms]
+
+        updated_ids = []
+        skipped_ids = []
+        upserted_ids = []
+        replaced_ids = []
+        seen = set()
+        n_atoms = 0
+
+        for batch in batches(atoms):
+            n_atoms += len(batch)
+            stored = self._stored_uids([a.info.get('uid') for a in batch])
+            requests = []
+            ids = []
+            for a in batch:
+                uid = a.info.get('uid')
+                if uid is not None and uid in seen:
+                    continue
+                seen.add(uid)
+
+                if uid not in stored:
+                    if not upsert:
+                        skipped_ids.append(uid)
+                        continue
+                    if uid is None:
+                        uid = util.random_uid()
+                    requests.append(InsertOne(atoms2document(a, {'uid': uid})))
+                    ids.append((upserted_ids, uid))
+                elif replace:
+                    requests.append(ReplaceOne({'uid': uid}, atoms2document(a)))
+                    ids.append((replaced_ids, uid))
+                else:
+                    # Fields of the new version are set, the rest is kept
+                    doc = atoms2document(a)
+                    for key, value in doc.pop('arrays', {}).items():
+                        doc['arrays.' + key] = value
+                    requests.append(UpdateOne({'uid': uid}, {'$set': doc}))
+                    ids.append((updated_ids, uid))
+
+            failed = self._bulk_write(requests)
+            for i, (lst, uid) in enumerate(ids):
+                (skipped_ids if i in failed else lst).append(uid)
+
+        msg = 'Updated {}/{} configurations.'.format(len(updated_ids), n_atoms)
+        return results.UpdateResult(updated_ids=updated_ids, skipped_ids=skipped_ids,
+                                    upserted_ids=upserted_ids, replaced_ids=replaced_ids, msg=msg)
+
+    def remove(self, auth_token, filter, just_one):
+        cur = self.collection.find(composition_filter(filter), {'uid': 1})
+        if just_one:
+            cur = cur.limit(1)
+        docs = list(cur)
+        for batch in batches(docs):
+            self.collection.bulk_write([DeleteOne({'_id': doc['_id']}) for doc in batch])
+        msg = 'Deleted {} configurations'.format(len(docs))
+        return results.RemoveResult(removed_count=len(docs),
+                                    removed_ids=[doc.get('uid') for doc in docs], msg=msg)
+
+    def find(self, auth_token, filter, sort, limit, keys, omit_keys, workers=1):
+        # Documents are decoded by pymongo as they arrive, in this process
+        cur = self.collection.find(composition_filter(filter), projection(keys, omit_keys))
+        cur.sort(sort_spec(sort or {}))
         if limit:
             cur.limit(limit)
-        return MongoDBBackend.Cursor(cur)
+        if self.batch_size:
+            cur.batch_size(self.batch_size)
+        return MongoDBBackend.Cursor(cur, keys, omit_keys)
+
+    def count(self, auth_token, filter, limit=0):
+        if limit != 0:
+            return self.collection.count_documents(composition_filter(filter), limit=limit)
+        return self.collection.count_documents(composition_filter(filter))
 
     def add_keys(self, auth_token, filter, kvp):
-        modified = [str(doc['_id']) for doc in self.collection.find(filter)]
-        self.collection.update(filter,
-                               {'$set': kvp},
-                               {'multi': True})
-        return results.AddKvpResult(modified, len(kvp))
+        filter = composition_filter(filter)
+        modified = [doc['uid'] for doc in self.collection.find(filter, {'uid': 1})]
+        # Only keys which were not there before are counted as added
+        n = sum(self.collection.count_documents({'$and': [filter, {key: {'$exists': False}}]})
+                for key in kvp)
+        self.collection.update_many(filter, {'$set': {key: encode_value(value) for key, value in kvp.items()}})
+        msg = 'Added {} key-value pairs in total to {} configurations'.format(n, len(modified))
+        return results.AddKvpResult(modified_ids=modified, no_of_kvp_added=n, msg=msg)
 
     def remove_keys(self, auth_token, filter, keys):
-        modified = [str(doc['_id']) for doc in self.collection.find(filter)]
-        self.collection.update(filter,
-                               {'$unset': {k: "" for k in keys}},
-                               {'multi': True})
-        return results.RemoveKeysResult(modified, len(keys))
+        filter = composition_filter(filter)
+        modified = [doc['uid'] for doc in self.collection.find(filter, {'uid': 1})]
+        n = sum(self.collection.count_documents({'$and': [filter, {key: {'$exists': True}}]})
+                for key in keys)
+        self.collection.update_many(filter, {'$unset': {k: "" for k in keys}})
+        msg = 'Removed {} keys in total from {} configurations'.format(n, len(modified))
+        return results.RemoveKeysResult(modified_ids=modified, no_of_keys_removed=n, msg=msg)
+
+    def aggregate(self, auth_token, filter, group_by, metrics, bins=0):
+        n = len(group_by)
+        entries = []
+        for doc in self.collection.aggregate(aggregate_pipeline(filter, group_by, metrics)):
+            values = [doc['_id'].get('g{}'.format(i)) for i in range(n)]
+            entry = group_entry(group_by, values, doc['count'])
+            for i, key in enumerate(metrics):
+                entry['stats'][key] = key_stats(*[doc[stat + str(i)]
+                                                  for stat in ('count', 'min', 'max', 'mean')])
+            entries.append(entry)
+        entries.sort(key=lambda entry: group_order(entry['group'].values()))
+
+        if bins:
+            for key in metrics:
+                ranges = overall_range(entries, key)
+                counts = {}
+                if ranges is not None:
+                    pipeline = histogram_pipeline(filter, group_by, key, ranges[0], ranges[1], bins)
+                    for doc in self.collection.aggregate(pipeline):
+                        values = tuple(doc['_id'].get('g{}'.format(i)) for i in range(n))
+                        counts[values, int(doc['_id']['bin'])] = doc['count']
+                set_histograms(entries, key, ranges, bins, counts)
+        return entries
+
+    def create_index(self, auth_token, keys):
+        indexed = self.list_indexes(auth_token)
+        created = []
+        for key in keys:
+            if key in indexed or key in created:
+                continue
+            self.collection.create_index([(key, ASCENDING)], name=index_prefix + key)
+            created.append(key)
+        return created
+
+    def list_indexes(self, auth_token):
+        return sorted(name[len(index_prefix):]
+                      for name in self.collection.index_information()
+                      if name.startswith(index_prefix))
+
+    def drop_index(self, auth_token, keys):
+        indexed = self.list_indexes(auth_token)
+        dropped = []
+        for key in keys:
+            if key in indexed and key not in dropped:
+                self.collection.drop_index(index_prefix + key)
+                dropped.append(key)
+        return dropped
 
     def open(self):
         pass
 
     def close(self):
-        pass
+        self.connection.close()
 
     def is_open(self):
         return True
@@ -0,0 +1,50 @@
+"""
+Testing the asyncio interface (abcd.aio) on the ASEdb SQLite3 backend.
+
+"""
+
+import asyncio
+import sys
+
+import pytest
+
+asedb = pytest.importorskip('asedb_sqlite3_backend.asedb_sqlite3_backend')
+
+from abcd import Direction
+from abcd.aio import AsyncStructureBox
+from abcd.query import translate
+from test_asedb_sqlite3_backend import backend, configurations
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_async(backend, pooled):
+    local = asedb.ASEdbSQlite3Backend(database='test', pooled=pooled)
+
+    async def run():
+        async with AsyncStructureBox(local) as box:
+            await asyncio.gather(*[box.insert('', configurations(4)) for i in range(3)])
+            counts = await asyncio.gather(box.count('', translate(['config_type=bulk'])),
+                                          box.count('', {}))
+            cursor = await box.find('', translate(['n>=2']), {'n': Direction.ASCENDING})
+            return counts, [atoms.info['n'] async for atoms in cursor]
+
+    counts, found = asyncio.run(run())
+    assert counts == [6, 12]
+    assert found == [2, 2, 2, 3, 3, 3]
+    local.close()
+
+
+def test_async_remote(backend, monkeypatch):
+    # The "server" answers with the words of the command
+    server = ('import sys, json, base64; words = sys.stdin.read().split(); '
+              'sys.stdout.write("204:" + base64.b64encode(json.dumps(words).encode()).decode())')
+    monkeypatch.setattr(asedb, 'ssh_args', lambda host: [sys.executable, '-c', server])
+    remote = asedb.ASEdbSQlite3Backend(database='test', remote='host')
+    assert remote.thread_safe
+    assert remote.remote_calls().deferred and not remote.deferred
+
+    async def run():
+        box = AsyncStructureBox(remote)
+        return await asyncio.gather(box.key_statistics(''), box.list_indexes(''))
+
+    assert asyncio.run(run()) == [['key-statistics', 'test.db'], ['list-indexes', 'test.db']]
@@ -0,0 +1,703 @@
+"""
+Testing the ASEdb SQLite3 backend on a database in a temporary directory.
+
+"""
+
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pytest
+from ase.build import bulk, molecule
+from ase.calculators.singlepoint import SinglePointCalculator
+
+asedb = pytest.importorskip('asedb_sqlite3_backend.asedb_sqlite3_backend')
+import asedb_sqlite3_backend.locking as locking
+import asedb_sqlite3_backend.remote as asedb_remote
+import asedb_sqlite3_backend.util as asedb_util
+
+from abcd import Direction
+from abcd.aggregation import aggregate_atoms
+from abcd.prefetch import PrefetchCursor
+from abcd.query import translate
+from abcd.util import content_uid
+
+
+@pytest.fixture()
+def backend(tmpdir, monkeypatch):
+    config = tmpdir.join('config')
+    config.write('[ase-db]\ndbs_path = {}\n'.format(tmpdir))
+    tmpdir.mkdir('all')
+    monkeypatch.setattr(asedb_util, 'CONFIG_PATH', str(config))
+    return asedb.ASEdbSQlite3Backend(database='test')
+
+
+def configurations(n):
+    atoms_list = []
+    for i in range(n):
+        if i % 2:
+            atoms = bulk('Si', cubic=True)
+            atoms.info['config_type'] = 'bulk'
+        else:
+            atoms = molecule('H2O')
+            atoms.info['config_type'] = 'molecule'
+        atoms.info['n'] = i
+        atoms.calc = SinglePointCalculator(atoms, energy=-float(i),
+                                           forces=np.zeros((len(atoms), 3)))
+        atoms_list.append(atoms)
+    return atoms_list
+
+
+def find(backend, query):
+    return list(backend.find('', translate(query), {}, 0, None, False))
+
+
+def test_add_keys(backend):
+    backend.insert('', configurations(6))
+    result = backend.add_keys('', translate(['config_type=bulk']),
+                              {'split': 'train', 'weight': 1.5})
+    assert result.no_of_kvp_added == 6
+    selected = find(backend, ['split=train'])
+    assert [atoms.info['n'] for atoms in selected] == [1, 3, 5]
+    assert all(atoms.info['weight'] == 1.5 for atoms in selected)
+    assert len(find(backend, ['weight>1'])) == 3
+
+    # Overwriting a key doesn't count as adding it
+    result = backend.add_keys('', translate(['n<2']), {'split': 'test'})
+    assert result.no_of_kvp_added == 1
+    assert [atoms.info['split'] for atoms in find(backend, ['n<2'])] == ['test', 'test']
+    assert len(find(backend, ['split=train'])) == 2
+
+
+def test_remove_keys(backend):
+    backend.insert('', configurations(4))
+    backend.add_keys('', translate([]), {'split': 'train'})
+    result = backend.remove_keys('', translate(['n>=2']), ['split', 'missing'])
+    assert result.no_of_keys_removed == 2
+    assert len(result.modified_ids) == 2
+    assert [atoms.info['n'] for atoms in find(backend, ['split=train'])] == [0, 1]
+    assert 'split' not in find(backend, ['n=3'])[0].info
+
+
+def test_remove(backend):
+    uids = backend.insert('', configurations(6)).inserted_ids
+    result = backend.remove('', translate(['n>=2']), False)
+    assert result.removed_count == 4
+    assert result.removed_ids == uids[2:]
+    assert [atoms.info['n'] for atoms in find(backend, [])] == [0, 1]
+
+
+def test_remove_just_one(backend):
+    uids = backend.insert('', configurations(6)).inserted_ids
+    result = backend.remove('', translate(['config_type=bulk']), True)
+    assert result.removed_ids == [uids[1]]
+    assert len(find(backend, ['config_type=bulk'])) == 2
+
+
+def test_remove_many(backend, monkeypatch):
+    monkeypatch.setattr(asedb, 'CHUNK_SIZE', 2)
+    backend.insert('', configurations(7))
+    assert backend.remove('', translate(['n<5']), False).removed_count == 5
+    assert len(find(backend, [])) == 2
+
+
+def test_insert_content_uids(backend):
+    atoms_list = configurations(4)
+    for atoms in atoms_list:
+        atoms.info['uid'] = content_uid(atoms)
+    result = backend.insert('', atoms_list)
+    assert len(result.inserted_ids) == 4
+
+    # Storing the same configurations again doesn't duplicate them
+    atoms_list = configurations(4)
+    for atoms in atoms_list:
+        atoms.info['uid'] = content_uid(atoms)
+    result = backend.insert('', atoms_list)
+    assert result.inserted_ids == []
+    assert len(result.skipped_ids) == 4
+    assert len(find(backend, [])) == 4
+
+
+def test_mixed_type_values(backend):
+    backend.insert('', configurations(4))
+    for n, value in enumerate([1, 2, 'foo']):
+        backend.add_keys('', translate(['n={}'.format(n)]), {'k': value})
+    assert [atoms.info['n'] for atoms in find(backend, ['k=1,foo'])] == [0, 2]
+    # Rows without the key don't match
+    assert [atoms.info['n'] for atoms in find(backend, ['k!=1,foo'])] == [1]
+    assert [atoms.info['n'] for atoms in find(backend, ['k!=1,bar'])] == [1, 2]
+
+
+def test_insert_duplicates(backend):
+    backend.insert('', configurations(2), duplicates='skip')
+    stored = {atoms.info['n']: atoms.info['uid'] for atoms in find(backend, [])}
+
+    # The same structures, translated and with the atoms permuted
+    atoms_list = configurations(2)
+    for atoms in atoms_list:
+        atoms.translate([0.5, 0.25, 0.0])
+    atoms_list[0] = atoms_list[0][[2, 0, 1]]
+    # and a different one
+    atoms_list.append(configurations(1)[0])
+    atoms_list[-1].positions *= 1.1
+    result = backend.insert('', atoms_list, duplicates='skip')
+    assert result.skipped_ids == [stored[0], stored[1]]
+    assert len(result.inserted_ids) == 1
+
+    result = backend.insert('', configurations(1), duplicates='link')
+    assert len(result.inserted_ids) == 1
+    linked = find(backend, ['duplicate_of=' + stored[0]])
+    assert [atoms.info['uid'] for atoms in linked] == result.inserted_ids
+
+
+def test_duplicates_of_earlier_inserts(backend):
+    # Stored without --duplicates, and by a version without fingerprints
+    backend.insert('', configurations(2))
+    backend.remove_keys('', translate(['n=1']), ['fingerprint'])
+    with backend._cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM text_key_values WHERE key='fingerprint'")
+        assert cur.fetchone()[0] == 1
+        cur.execute("UPDATE information SET value='5' WHERE name='abcd_version'")
+
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    result = backend.insert('', configurations(2), duplicates='skip')
+    assert result.inserted_ids == []
+    assert len(result.skipped_ids) == 2
+
+
+def test_insert_leaves_atoms(backend):
+    atoms_list = configurations(2) + configurations(1)
+    atoms_list[0].info['energy'] = -5.0
+    atoms_list[1].new_array('forces', np.ones((len(atoms_list[1]), 3)))
+    upserted = configurations(1)
+
+    def state():
+        return [(dict(atoms.info), sorted(atoms.arrays), sorted(atoms.calc.results))
+                for atoms in atoms_list + upserted]
+
+    before = state()
+    backend.insert('', atoms_list, duplicates='link')
+    backend.update('', upserted, upsert=True, replace=False)
+    assert state() == before
+    # The stored ones have the keys which were added
+    stored = find(backend, ['n=0'])
+    assert len(stored) == 3
+    assert all('formula_reduced' in atoms.info for atoms in stored)
+    assert ['duplicate_of' in atoms.info for atoms in stored] == [False, True, False]
+
+
+def test_insert_duplicates_within_call(backend):
+    result = backend.insert('', configurations(2) + configurations(2),
+                            duplicates='skip')
+    assert len(result.inserted_ids) == 2
+    assert result.skipped_ids == result.inserted_ids
+
+
+def element_queries(backend):
+    return [len(find(backend, [q])) for q in
+            ['elements~H', 'elements~Si,O', 'elements~C', 'elements!=O',
+             'elements=H,O', 'elements=H', 'elements=Si', 'elements~H elements!=Si']]
+
+
+def test_element_queries(backend):
+    atoms_list = configurations(4)
+    atoms_list.append(molecule('CH3OH'))
+    backend.insert('', atoms_list)
+    assert element_queries(backend) == [3, 5, 1, 2, 2, 0, 2, 3]
+
+    # The same answers without the composition table
+    backend.composition = False
+    assert element_queries(backend) == [3, 5, 1, 2, 2, 0, 2, 3]
+
+
+def test_placeholder_atoms(backend):
+    atoms_list = configurations(2)
+    # X, atomic number 0
+    atoms_list[0].numbers[0] = 0
+    backend.insert('', atoms_list)
+    queries = ['elements~X', 'elements=H,X', 'elements!=X', 'elements~O,X']
+    expected = [[0], [0], [1], [0]]
+    assert [[a.info['n'] for a in find(backend, [q])] for q in queries] == expected
+    backend.composition = False
+    assert [[a.info['n'] for a in find(backend, [q])] for q in queries] == expected
+
+    # Masks written without the bit of X are fixed when the database is opened
+    with backend._cursor() as cur:
+        cur.execute('UPDATE abcd_composition SET mask1 = 0')
+        cur.execute("UPDATE information SET value='4' WHERE name='abcd_version'")
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    assert [[a.info['n'] for a in find(backend, [q])] for q in queries] == expected
+
+
+def test_composition_follows_writes(backend):
+    backend.insert('', configurations(4))
+    backend.remove('', translate(['config_type=bulk']), False)
+    with backend._cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM abcd_composition')
+        assert cur.fetchone()[0] == 2
+
+    # Replacing the structure of a row updates its composition
+    atoms = find(backend, ['n=0'])[0]
+    replacement = bulk('Si', cubic=True)
+    replacement.info['uid'] = atoms.info['uid']
+    backend.update('', replacement, False, True)
+    assert len(find(backend, ['elements=Si'])) == 1
+    assert len(find(backend, ['elements~H'])) == 1
+
+
+def test_composition_backfill(backend):
+    backend.insert('', configurations(3))
+    with backend._cursor() as cur:
+        cur.execute('DROP TABLE abcd_composition')
+
+    # Opening the database again fills the table for the existing rows
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    assert backend.composition
+    assert len(find(backend, ['elements=H,O'])) == 2
+
+
+def test_composition_queries(backend):
+    atoms_list = configurations(4)
+    atoms_list.append(bulk('WC', 'rocksalt', a=4.2, cubic=True))
+    backend.insert('', atoms_list)
+    counts = [len(find(backend, [q])) for q in
+              ['n_Si=8', 'n_H>=2', 'n_H<2', 'n_W=0,4', 'n_O!=1', 'n_H!=0,1',
+               'formula_reduced=CW', 'formula_reduced=W4C4', 'formula_reduced=OH2,Si']]
+    assert counts == [2, 2, 3, 5, 3, 2, 1, 1, 4]
+
+
+def test_formula_migration(backend):
+    backend.insert('', configurations(2))
+    backend.remove_keys('', translate([]), ['formula_reduced'])
+    with backend._cursor() as cur:
+        cur.execute("DELETE FROM information WHERE name='abcd_version'")
+
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    assert [atoms.info['formula_reduced'] for atoms in find(backend, [])] == ['H2O', 'Si']
+
+
+def test_derived_keys(backend):
+    atoms_list = configurations(4)
+    atoms_list[2].calc.results['forces'][0] = [0.0, 0.0, 2.0]
+    backend.insert('', atoms_list)
+    assert [atoms.info['n'] for atoms in find(backend, ['max_force>1'])] == [2]
+    assert len(find(backend, ['volume_per_atom>15', 'volume_per_atom<25'])) == 2
+    assert len(find(backend, ['min_distance>1.5'])) == 2
+
+    # Rows from before the derived keys get them when the database is opened
+    backend.remove_keys('', translate([]), ['max_force'])
+    with backend._cursor() as cur:
+        cur.execute("UPDATE information SET value='1' WHERE name='abcd_version'")
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    assert [atoms.info['n'] for atoms in find(backend, ['max_force>1'])] == [2]
+
+
+def test_text_index_migration(backend):
+    backend.insert('', configurations(2))
+    with backend._cursor() as cur:
+        cur.execute('CREATE INDEX text_key_value_index ON text_key_values(key, value)')
+        cur.execute("UPDATE information SET value='2' WHERE name='abcd_version'")
+
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    with backend._cursor() as cur:
+        cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='text_key_values'")
+        assert sorted(row[0] for row in cur.fetchall()) == [
+            'text_fingerprint_index', 'text_index', 'text_uid_index']
+        plan = asedb.query_plan(cur, "SELECT id FROM text_key_values WHERE key='uid' AND value=?",
+                                ['x'])
+    assert any('text_uid_index' in line for line in plan)
+
+
+def test_number_index_migration(backend):
+    backend.insert('', configurations(2))
+    with backend._cursor() as cur:
+        cur.execute('DROP INDEX number_value_index')
+        cur.execute('CREATE INDEX number_key_value_index ON number_key_values(key, value)')
+        cur.execute("CREATE INDEX abcd_number_index_n ON number_key_values(key, value, id) "
+                    "WHERE key='n'")
+        cur.execute("UPDATE information SET value='3' WHERE name='abcd_version'")
+
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    with backend._cursor() as cur:
+        cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='number_key_values'")
+        assert sorted(row[0] for row in cur.fetchall()) == ['number_index', 'number_value_index']
+    assert backend.list_indexes('') == []
+
+
+def test_untranslatable_conditions(backend):
+    backend.insert('', configurations(6))
+    # $exists has no SQL translation, so it is evaluated on the rows
+    query = translate(['config_type=molecule'])
+    query['$and'].append({'weight': {'$exists': False}})
+    backend.add_keys('', translate(['n=0']), {'weight': 1})
+    assert [atoms.info['n'] for atoms in backend.find('', query, {}, 0, None, False)] == [2, 4]
+    assert backend.count('', query) == 2
+    assert backend.count('', query, 1) == 1
+    assert backend.count('', translate(['config_type=molecule']), 2) == 2
+    assert len(list(backend.find('', query, {}, 1, None, False))) == 1
+
+    backend.add_keys('', query, {'checked': 1})
+    assert len(find(backend, ['checked=1'])) == 2
+    backend.remove('', query, True)
+    assert len(find(backend, ['checked=1'])) == 1
+
+
+def test_untranslatable_semantics(backend, monkeypatch):
+    backend.insert('', configurations(4))
+    backend.add_keys('', translate(['n=3']), {'k': 'foo'})
+    decoded = []
+    row2atoms = asedb.row2atoms
+    monkeypatch.setattr(asedb, 'row2atoms', lambda row, *args: decoded.append(row.id) or
+                        row2atoms(row, *args))
+
+    # Evaluated in Python, with the semantics of the SQL
+    untranslated = {'k': {'$exists': False}}
+    for query, ns in (({'n': {'$ne': 1}}, [0, 2, 3]),
+                      ({'k': {'$ne': 'bar'}}, [3]),
+                      ({'k': {'$nin': [1, 'foo']}}, []),
+                      ({'pbc': 'TTT'}, [1, 3]),
+                      ({'numbers': {'$in': [8]}}, [0, 2])):
+        assert [atoms.info['n'] for atoms in backend.find('', query, {}, 0, None, False)] == ns
+        del decoded[:]
+        atoms_list = list(backend.find('', {'$or': [query, {'$and': [untranslated, {'n': 9}]}]},
+                                       {}, 0, None, False))
+        assert [atoms.info['n'] for atoms in atoms_list] == ns
+        # Only the selected rows are decoded, once
+        assert len(decoded) == len(ns)
+
+
+def test_or_not_queries(backend):
+    backend.insert('', configurations(6))
+    queries = ['(config_type=bulk & n>2) | (config_type=molecule & n<2)',
+               '!(n=1 | n=2)', '!elements~H n>1', 'n=1,2 | !config_type=bulk']
+    expected = [[0, 3, 5], [0, 3, 4, 5], [3, 5], [0, 1, 2, 4]]
+    for query, ns in zip(queries, expected):
+        assert [atoms.info['n'] for atoms in find(backend, [query])] == ns
+        assert backend.count('', translate([query])) == len(ns)
+
+
+def test_plan_cache(backend):
+    backend.insert('', configurations(4))
+    for n in range(4):
+        assert [atoms.info['n'] for atoms in find(backend, ['n={}'.format(n)])] == [n]
+    assert [atoms.info['n'] for atoms in find(backend, ['config_type=bulk', 'elements~Si'])] == [1, 3]
+    assert [atoms.info['n'] for atoms in find(backend, ['config_type=molecule', 'elements~O'])] == [0, 2]
+    assert len(backend.plans) == 2
+
+    # Whether rows without the element match changes the SQL
+    assert len(find(backend, ['n_H>1'])) == 2
+    assert len(find(backend, ['n_H<1'])) == 2
+    assert len(backend.plans) == 4
+
+
+def test_explain(backend):
+    backend.insert('', configurations(6))
+    report = backend.explain('', translate(['n<4']), {}, 0)
+    assert report['queries'][0].startswith('SELECT systems.* FROM systems WHERE')
+    assert report['plan']
+    assert report['untranslated'] is None
+    assert (report['rows_scanned'], report['rows_returned']) == (4, 4)
+    assert sorted(report['times']) == ['decode', 'sql']
+
+    # Conditions evaluated in Python are reported along with the rows they drop
+    report = backend.explain('', {'$and': [{'n': {'$lt': 4}}, {'weight': {'$exists': False}}]}, {}, 1)
+    assert report['untranslated'] == {'$and': [{'weight': {'$exists': False}}]}
+    assert (report['rows_scanned'], report['rows_returned']) == (4, 1)
+    assert 'filter' in report['times']
+
+
+def test_indexes(backend):
+    backend.insert('', configurations(6))
+    assert backend.create_index('', ['config_type', 'energy', 'n']) == ['config_type', 'energy', 'n']
+    assert backend.create_index('', ['n']) == []
+    assert backend.list_indexes('') == ['config_type', 'energy', 'n']
+
+    # Queries on the indexed keys are answered from the indexes
+    for query, index in ((['n<3'], 'number_value_index'),
+                         (['config_type=bulk'], 'abcd_text_index_config_type'),
+                         (['energy<-2'], 'abcd_index_energy')):
+        report = backend.explain('', translate(query), {}, 0)
+        assert any(index in line for line in report["plan"])
+    assert [atoms.info['n'] for atoms in find(backend, ['n<3', 'config_type=bulk'])] == [1]
+
+    with pytest.raises(asedb.WriteError):
+        backend.create_index('', ['n_H'])
+
+    assert backend.drop_index('', ['n', 'missing']) == ['n']
+    assert backend.list_indexes('') == ['config_type', 'energy']
+    assert len(find(backend, ['n<3'])) == 3
+
+
+def scanned_statistics(backend):
+    '''Statistics of the key-value pairs and energies worked out from all the rows'''
+    values = {}
+    for atoms in find(backend, []):
+        for key, value in atoms.info.items():
+            values.setdefault(key, []).append(value)
+        values.setdefault('energy', []).append(atoms.get_potential_energy())
+    return {key: (len(vals), min(vals), max(vals)) for key, vals in values.items()}
+
+
+def test_key_statistics(backend):
+    backend.insert('', configurations(6))
+    backend.add_keys('', translate(['n<3']), {'split': 'train', 'weight': 2})
+    backend.remove_keys('', translate(['n=1']), ['split'])
+    backend.remove('', translate(['n=0']), False)
+    atoms = find(backend, ['n=5'])[0]
+    atoms.info['config_type'] = 'aaa'
+    backend.update('', [atoms], False, False)
+
+    stats = backend.key_statistics('')
+    assert stats['rows'] == 5
+    scanned = scanned_statistics(backend)
+    assert {key: s['count'] for key, s in stats['keys'].items()} == \
+        {key: count for key, (count, low, high) in scanned.items()}
+    # Only the range and distinct values of numbers are kept
+    for key, s in stats['keys'].items():
+        if s['type'] == 'number':
+            assert (s['min'], s['max']) == scanned[key][1:]
+        else:
+            assert (s['min'], s['max'], s['distinct']) == (None, None, None)
+    assert stats['keys']['config_type']['type'] == 'text'
+    assert stats['keys']['n']['distinct'] == 5
+    assert stats['keys']['n']['type'] == 'number'
+    assert not backend.key_statistics('')['keys'].get('missing')
+
+    # Databases written before the catalog existed get one
+    with backend._cursor() as cur:
+        cur.execute('DROP TABLE abcd_catalog')
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    assert backend.key_statistics('') == stats
+
+    # Read-only databases get one when they are opened with write access
+    with backend._cursor() as cur:
+        cur.execute('DROP TABLE abcd_catalog')
+    backend.catalog = False
+    assert backend.key_statistics('') is None
+
+
+def rounded(value):
+    if isinstance(value, dict):
+        return {key: rounded(v) for key, v in value.items()}
+    elif isinstance(value, list):
+        return [rounded(v) for v in value]
+    elif isinstance(value, float):
+        return round(value, 9)
+    return value
+
+
+def test_aggregate(backend):
+    backend.insert('', configurations(6))
+    backend.add_keys('', translate(['n<3']), {'weight': 2})
+    backend.add_keys('', translate(['n=4']), {'weight': 'heavy'})
+
+    for group_by, metrics, query in [
+            (['config_type'], ['energy', 'n', 'weight'], []),
+            (['config_type', 'n_H'], ['energy', 'natoms'], ['n>0']),
+            ([], ['n', 'missing'], []),
+            (['weight'], ['n'], ['n>10'])]:
+        expected = aggregate_atoms(find(backend, query), group_by, metrics, 3)
+        assert rounded(backend.aggregate('', translate(query), group_by, metrics, 3)) == \
+            rounded(expected)
+
+    entries = backend.aggregate('', translate([]), ['config_type'], ['energy'])
+    assert [(e['group']['config_type'], e['count']) for e in entries] == [('bulk', 3), ('molecule', 3)]
+    assert entries[0]['stats']['energy'] == {'count': 3, 'min': -5.0, 'max': -1.0, 'mean': -3.0}
+
+    # Filters which aren't translated to SQL are evaluated on the configurations
+    query = translate([])
+    query['$and'].append({'weight': {'$exists': True}})
+    assert [e['count'] for e in backend.aggregate('', query, ['config_type'], [])] == [1, 3]
+
+
+def test_pooled(backend):
+    backend.insert('', configurations(4))
+    pooled = asedb.ASEdbSQlite3Backend(database='test', pooled=True)
+    with pooled._cursor() as cur:
+        assert cur.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    errors = []
+    counts = []
+
+    def read():
+        try:
+            for i in range(20):
+                counts.append(pooled.count('', translate(['config_type=bulk'])))
+                assert len(list(pooled.find('', translate(['n<100']), {}, 0, None, False))) >= 4
+        except Exception as e:
+            errors.append(e)
+
+    def write(start):
+        try:
+            atoms_list = configurations(4)
+            for i, atoms in enumerate(atoms_list):
+                atoms.info['n'] = start + i
+            pooled.insert('', atoms_list)
+            pooled.add_keys('', translate(['n>={}'.format(start), 'n<{}'.format(start + 4)]),
+                            {'w{}'.format(start): 1})
+        except Exception as e:
+            errors.append(e)
+
+    threads = ([threading.Thread(target=read) for i in range(4)] +
+               [threading.Thread(target=write, args=(10 * (i + 1),)) for i in range(4)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert pooled.count('', {}) == 20
+    assert min(counts) >= 2 and max(counts) <= 10
+    # Writes are committed, so other connections see them
+    assert [backend.count('', translate(['w{}=1'.format(10 * (i + 1))])) for i in range(4)] == [4] * 4
+    pooled.close()
+
+
+def test_pooled_transaction(backend):
+    pooled = asedb.ASEdbSQlite3Backend(database='test', pooled=True)
+    pooled.begin()
+    pooled.insert('', configurations(2))
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(pooled.count('', {})))
+    thread.start()
+    thread.join()
+    # Other threads only see committed writes, this one sees its own
+    assert seen == [0]
+    assert pooled.count('', {}) == 2
+    pooled.rollback()
+    assert pooled.count('', {}) == 0
+
+    pooled.begin()
+    pooled.insert('', configurations(2))
+    pooled.commit()
+    assert backend.count('', {}) == 2
+    pooled.close()
+
+
+def test_find_workers(backend):
+    backend.insert('', configurations(30))
+    for query, sort, limit in [([], {}, 0), (['config_type=bulk'], {'n': Direction.DESCENDING}, 0),
+                               (['n>3'], {'energy': Direction.ASCENDING}, 7), (['n>100'], {}, 0)]:
+        serial = list(backend.find('', translate(query), sort, limit, None, False))
+        parallel = list(backend.find('', translate(query), sort, limit, ['n'], False, workers=3))
+        assert [atoms.info for atoms in parallel] == [{'n': atoms.info['n']} for atoms in serial]
+        for a, b in zip(serial, parallel):
+            assert np.allclose(a.positions, b.positions)
+            assert a.get_potential_energy() == b.get_potential_energy()
+
+    # Rows written in a transaction are not visible to other processes,
+    # so they are decoded here
+    backend.begin()
+    backend.insert('', configurations(2))
+    assert len(list(backend.find('', {}, {}, 0, None, False, workers=2))) == 32
+    backend.rollback()
+
+
+def test_find_reads_in_chunks(backend, monkeypatch):
+    monkeypatch.setattr(asedb, 'CHUNK_SIZE', 2)
+    backend.insert('', configurations(6))
+    cursor = backend.find('', {}, {}, 0, None, False)
+    assert next(cursor).info['n'] == 0
+    # The rows after the first chunk are read when they are reached, in
+    # a thread of their own with PrefetchCursor
+    backend.remove('', translate(['n>=3']), False)
+    assert [atoms.info['n'] for atoms in PrefetchCursor(cursor, 1)] == [1, 2]
+
+
+def hold_lock(filename, seconds, started):
+    con = sqlite3.connect(filename)
+    con.execute('BEGIN IMMEDIATE')
+    started.set()
+    time.sleep(seconds)
+    con.rollback()
+    con.close()
+
+
+def test_lock_wait(backend):
+    backend.insert('', configurations(1))
+    started = threading.Event()
+    holder = threading.Thread(target=hold_lock, args=(backend.connection.filename, 0.3, started))
+    holder.start()
+    started.wait()
+    result = backend.insert('', configurations(2))
+    holder.join()
+    assert 0.2 < result.lock_wait < 5
+    assert backend.count('', {}) == 3
+    # It is passed on by the server of remote databases
+    sent = asedb_remote.result_from_dct('InsertResult', **result.__dict__)
+    assert sent.lock_wait == result.lock_wait
+    assert backend.insert('', configurations(1)).lock_wait < 0.2
+
+    con = sqlite3.connect(backend.connection.filename)
+    con.execute('BEGIN IMMEDIATE')
+    with pytest.raises(asedb.WriteError):
+        locking.begin_immediate(sqlite3.connect(backend.connection.filename), timeout=0.1)
+    con.rollback()
+
+
+def test_open_while_writing(backend):
+    # Databases that don't need upgrading are opened without the write lock
+    asedb.ASEdbSQlite3Backend(database='test', pooled=True).close()
+    started = threading.Event()
+    holder = threading.Thread(target=hold_lock, args=(backend.connection.filename, 1, started))
+    holder.start()
+    started.wait()
+    for pooled in (False, True):
+        start = time.time()
+        opened = asedb.ASEdbSQlite3Backend(database='test', pooled=pooled)
+        assert time.time() - start < 0.5
+        assert opened.count('', {}) == 0
+        opened.close()
+    holder.join()
+
+
+def store(start, n):
+    atoms_list = configurations(n)
+    for i, atoms in enumerate(atoms_list):
+        atoms.info['n'] = start + i
+    asedb.ASEdbSQlite3Backend(database='test').insert('', atoms_list)
+
+
+def store_when_stored(start, n):
+    # Begins once the other writer committed its first batch
+    backend = asedb.ASEdbSQlite3Backend(database='test')
+    while not backend.count('', {}):
+        time.sleep(0.01)
+    store(start, n)
+
+
+@pytest.mark.skipif(not locking.fcntl or not hasattr(os, 'fork'), reason='needs fcntl and fork')
+def test_writers_take_turns(backend, monkeypatch):
+    monkeypatch.setattr(asedb, 'WRITE_BATCH_SIZE', 5)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=store, args=(0, 200)),
+                 context.Process(target=store_when_stored, args=(1000, 5))]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 2
+    # The short write got in between the batches of the long one
+    con = sqlite3.connect(backend.connection.filename)
+    ids = [n for n, in con.execute("SELECT value FROM number_key_values WHERE key='n' ORDER BY id")]
+    first = ids.index(1000)
+    assert ids[first:first + 5] == list(range(1000, 1005))
+    assert 0 < first < 150
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_concurrent_writers(backend, monkeypatch):
+    # Each process commits batches of 3 configurations
+    monkeypatch.setattr(asedb, 'WRITE_BATCH_SIZE', 3)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=store, args=(100 * i, 10)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+    assert backend.count('', {}) == 40
+    assert sorted(atoms.info['n'] for atoms in find(backend, [])) == sorted(
+        100 * i + j for i in range(4) for j in range(10))
@@ -0,0 +1,247 @@
+"""
+Testing the MongoDB backend on an in-memory mongomock client.
+
+"""
+
+import numpy as np
+import pytest
+from ase.build import bulk, molecule
+from ase.calculators.singlepoint import SinglePointCalculator
+
+mongomock = pytest.importorskip('mongomock')
+mongo = pytest.importorskip('mongobackend.mongobackend')
+import mongobackend.codec as codec
+from bson import decode, encode
+from bson.codec_options import CodecOptions
+
+from abcd import Direction
+from abcd.aggregation import aggregate_atoms
+from abcd.query import translate
+
+
+@pytest.fixture()
+def backend(monkeypatch):
+    # Recent pymongo passes the sort of UpdateOne and ReplaceOne to the bulk
+    # builder, which mongomock doesn't take. The backend matches on the
+    # unique uid, so there is nothing to sort.
+    def without_sort(method):
+        def add(self, *args, **kwargs):
+            kwargs.pop('sort', None)
+            return method(self, *args, **kwargs)
+        return add
+
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ('add_update', 'add_replace'):
+        monkeypatch.setattr(builder, name, without_sort(getattr(builder, name)))
+    # mongomock doesn't take type registries
+    monkeypatch.setattr(mongo, 'codec_options', CodecOptions())
+    return mongo.MongoDBBackend(client=mongomock.MongoClient())
+
+
+def configurations(n):
+    atoms_list = []
+    for i in range(n):
+        if i % 2:
+            atoms = bulk('Si', cubic=True)
+            atoms.info['config_type'] = 'bulk'
+        else:
+            atoms = molecule('H2O')
+            atoms.info['config_type'] = 'molecule'
+        atoms.info['n'] = i
+        atoms.calc = SinglePointCalculator(atoms, energy=-float(i),
+                                           forces=np.zeros((len(atoms), 3)))
+        atoms_list.append(atoms)
+    return atoms_list
+
+
+def find(backend, query):
+    return list(backend.find('', translate(query), {}, 0, None, False))
+
+
+def test_insert(backend, monkeypatch):
+    monkeypatch.setattr(mongo, 'BULK_SIZE', 4)
+    atoms_list = configurations(10)
+    result = backend.insert('', atoms_list)
+    assert len(result.inserted_ids) == 10
+    assert result.skipped_ids == []
+    # The Atoms objects are left as they are
+    assert not any('uid' in atoms.info for atoms in atoms_list)
+    assert backend.count('', {}) == 10
+    assert backend.count('', {}, 4) == 4
+
+    # Stored uids and uids repeated in the call are skipped
+    for atoms, uid in zip(atoms_list, result.inserted_ids):
+        atoms.info['uid'] = uid
+    new = configurations(1)
+    new[0].info['uid'] = 'new'
+    result = backend.insert('', atoms_list[:6] + new + new)
+    assert result.inserted_ids == [new[0].info['uid']]
+    assert sorted(result.skipped_ids) == sorted(a.info['uid'] for a in atoms_list[:6])
+    assert backend.count('', {}) == 11
+
+
+def test_insert_duplicates(backend):
+    backend.insert('', configurations(2), duplicates='skip')
+    result = backend.insert('', configurations(4), duplicates='skip')
+    assert len(result.inserted_ids) == 0
+    assert len(result.skipped_ids) == 4
+
+    atoms_list = configurations(1)
+    result = backend.insert('', atoms_list, duplicates='link')
+    assert len(result.inserted_ids) == 1
+    assert backend.count('', {'duplicate_of': {'$exists': True}}) == 1
+    assert sorted(atoms_list[0].info) == ['config_type', 'n']
+
+
+def test_duplicates_of_earlier_inserts(backend):
+    backend.insert('', configurations(2))
+    result = backend.insert('', configurations(2), duplicates='skip')
+    assert result.inserted_ids == []
+    assert len(result.skipped_ids) == 2
+
+
+def test_round_trip(backend):
+    atoms = configurations(2)[1]
+    uid, = backend.insert('', atoms).inserted_ids
+    stored, = find(backend, ['n=1'])
+    assert stored.info['config_type'] == 'bulk'
+    assert stored.info['uid'] == uid
+    assert (stored.numbers == atoms.numbers).all()
+    assert np.allclose(stored.positions, atoms.positions)
+    assert np.allclose(stored.cell, atoms.cell)
+    assert stored.get_potential_energy() == -1.0
+    assert 'n_Si' not in stored.info
+    assert len(find(backend, ['n_Si=8'])) == 1
+
+
+def test_codec():
+    for array in (np.arange(6, dtype=np.float32).reshape(2, 3), np.array([True, False]),
+                  np.array(['Si', 'C']), np.zeros((0, 3))):
+        doc = decode(encode({'a': codec.encode_array(array)}))
+        decoded = codec.decode_array(doc['a'])
+        assert decoded.dtype == array.dtype
+        assert decoded.shape == array.shape
+        assert (decoded == array).all()
+
+    # Arrays anywhere in a document, with the codec options of the backend
+    doc = decode(encode({'a': {'b': [np.arange(3)]}, 'n': np.int64(2)},
+                        codec_options=codec.codec_options))
+    assert doc['n'] == 2
+    assert list(codec.decode_array(doc['a']['b'][0])) == [0, 1, 2]
+
+    # Arrays stored as lists by earlier versions
+    assert list(codec.decode_array({'_type': 'nparray', 'value': [1, 2]})) == [1, 2]
+
+
+def test_stored_arrays(backend):
+    atoms = configurations(1)[0]
+    atoms.new_array('weights', np.arange(len(atoms), dtype=np.float32))
+    backend.insert('', atoms)
+    stored, = find(backend, [])
+    assert stored.arrays['weights'].dtype == np.float32
+    assert list(stored.arrays['weights']) == [0, 1, 2]
+    assert stored.get_forces().shape == (3, 3)
+
+    doc = backend.collection.find_one()
+    assert doc['positions']['dtype'] == '<f8'
+    assert doc['numbers'] == [8, 1, 1]
+
+
+def test_update(backend):
+    atoms_list = configurations(4)
+    result = backend.insert('', atoms_list[:2])
+    for atoms, uid in zip(atoms_list, result.inserted_ids):
+        atoms.info['uid'] = uid
+
+    for atoms in atoms_list:
+        atoms.info['split'] = 'train'
+    result = backend.update('', atoms_list, upsert=False, replace=False)
+    assert len(result.updated_ids) == 2
+    assert len(result.skipped_ids) == 2
+    assert backend.count('', {}) == 2
+    assert len(find(backend, ['split=train'])) == 2
+
+    result = backend.update('', atoms_list, upsert=True, replace=False)
+    assert len(result.updated_ids) == 2
+    assert len(result.upserted_ids) == 2
+    assert not any('uid' in a.info for a in atoms_list[2:])
+    assert backend.count('', {}) == 4
+
+    del atoms_list[0].info['split']
+    result = backend.update('', atoms_list[:1], upsert=False, replace=True)
+    assert result.replaced_ids == [atoms_list[0].info['uid']]
+    assert len(find(backend, ['split=train'])) == 3
+
+
+def test_remove(backend):
+    backend.insert('', configurations(6))
+    result = backend.remove('', translate(['config_type=bulk']), just_one=False)
+    assert result.removed_count == 3
+    assert backend.count('', {}) == 3
+
+    result = backend.remove('', {}, just_one=True)
+    assert result.removed_count == 1
+    assert backend.count('', {}) == 2
+
+
+def test_add_remove_keys(backend):
+    backend.insert('', configurations(6))
+    result = backend.add_keys('', translate(['config_type=bulk']),
+                              {'split': 'train', 'weight': 1.5})
+    assert result.no_of_kvp_added == 6
+    assert len(result.modified_ids) == 3
+    assert [atoms.info['n'] for atoms in find(backend, ['split=train'])] == [1, 3, 5]
+
+    result = backend.add_keys('', translate(['n<2']), {'split': 'test'})
+    assert result.no_of_kvp_added == 1
+
+    result = backend.remove_keys('', {}, ['split', 'weight'])
+    assert result.no_of_keys_removed == 7
+    assert backend.count('', {'split': {'$exists': True}}) == 0
+
+
+def test_find_sort_limit(backend):
+    backend.insert('', configurations(6))
+    found = backend.find('', {}, {'config_type': Direction.ASCENDING, 'n': Direction.DESCENDING},
+                         4, None, False)
+    assert [atoms.info['n'] for atoms in found] == [5, 3, 1, 4]
+
+
+def test_find_keys(backend):
+    backend.batch_size = 2
+    backend.insert('', configurations(3))
+    atoms_list = list(backend.find('', {}, {}, 0, ['n', 'uid'], False))
+    assert [sorted(atoms.info) for atoms in atoms_list] == [['n', 'uid']] * 3
+    assert atoms_list[0].get_potential_energy() == 0.0
+
+    atoms_list = list(backend.find('', {}, {}, 0, ['n'], True))
+    assert 'n' not in atoms_list[0].info
+    assert atoms_list[0].info['config_type'] == 'molecule'
+
+    atoms_list = list(backend.find('', {}, {}, 0, None, True))
+    assert atoms_list[0].info == {}
+    assert len(atoms_list[0]) == 3
+
+    assert mongo.projection(None, False) is None
+    assert 'config_type' not in mongo.projection(['n'], False)
+
+
+def test_aggregate(backend):
+    backend.insert('', configurations(6))
+    backend.add_keys('', translate(['n<3']), {'weight': 2})
+    backend.add_keys('', translate(['n=4']), {'weight': 'heavy'})
+
+    for group_by, metrics, query in [
+            (['config_type'], ['energy', 'n', 'weight'], []),
+            (['config_type', 'n_H'], ['energy'], ['n>0']),
+            ([], ['n', 'missing'], []),
+            (['weight'], ['n'], ['n>10'])]:
+        expected = aggregate_atoms(find(backend, query), group_by, metrics, 3)
+        entries = backend.aggregate('', translate(query), group_by, metrics, 3)
+        assert [dict(e['group']) for e in entries] == [dict(e['group']) for e in expected]
+        for entry, expected_entry in zip(entries, expected):
+            assert entry['count'] == expected_entry['count']
+            for key in metrics:
+                stats, expected_stats = entry['stats'][key], expected_entry['stats'][key]
+                assert stats['histogram']['counts'] == expected_stats['histogram']['counts']
+                assert stats['mean'] == pytest.approx(expected_stats['mean'])
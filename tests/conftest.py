@@ -0,0 +1,6 @@
+import sys
+
+# abcd.aio needs Python 3.7
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore += ['test_aio.py', 'backends/test_asedb_sqlite3_aio.py']
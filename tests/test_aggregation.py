@@ -0,0 +1,53 @@
+"""
+Testing the statistics of groups of configurations worked out in Python.
+
+"""
+
+import numpy as np
+from ase.build import bulk, molecule
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from abcd.aggregation import aggregate_atoms, bin_index, group_order
+
+
+def configurations():
+    atoms_list = []
+    for i in range(6):
+        atoms = bulk('Si', cubic=True) if i % 2 else molecule('H2O')
+        atoms.info['config_type'] = 'bulk' if i % 2 else 'molecule'
+        atoms.info['n'] = i
+        atoms.calc = SinglePointCalculator(atoms, energy=-float(i))
+        atoms_list.append(atoms)
+    atoms_list[0].info['n'] = 'zero'
+    del atoms_list[5].info['config_type']
+    return atoms_list
+
+
+def test_aggregate_atoms():
+    entries = aggregate_atoms(configurations(), ['config_type'], ['energy', 'n'])
+    assert [dict(e['group']) for e in entries] == [
+        {'config_type': None}, {'config_type': 'bulk'}, {'config_type': 'molecule'}]
+    assert [e['count'] for e in entries] == [1, 2, 3]
+    molecules = entries[2]['stats']
+    assert molecules['energy'] == {'count': 3, 'min': -4.0, 'max': 0.0, 'mean': -2.0}
+    # Only numbers are counted
+    assert molecules['n'] == {'count': 2, 'min': 2.0, 'max': 4.0, 'mean': 3.0}
+
+
+def test_histograms():
+    entries = aggregate_atoms(configurations(), [], ['energy', 'missing'], bins=5)
+    assert len(entries) == 1 and entries[0]['count'] == 6
+    histogram = entries[0]['stats']['energy']['histogram']
+    assert np.allclose(histogram['edges'], [-5, -4, -3, -2, -1, 0])
+    assert histogram['counts'] == [1, 1, 1, 1, 2]
+    assert entries[0]['stats']['missing']['histogram'] == {'edges': [], 'counts': []}
+
+    entries = aggregate_atoms(configurations(), ['config_type'], ['energy'], bins=2)
+    assert [e['stats']['energy']['histogram']['counts'] for e in entries] == [[1, 0], [1, 1], [1, 2]]
+
+
+def test_helpers():
+    assert bin_index(1.0, 0.0, 1.0, 4) == 3
+    assert bin_index(0.5, 0.5, 0.5, 4) == 0
+    assert sorted([('b',), (None,), (2,), ('a',)], key=group_order) == [(None,), (2,), ('a',), ('b',)]
+    assert aggregate_atoms([], ['config_type'], ['energy']) == []
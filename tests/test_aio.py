@@ -0,0 +1,164 @@
+"""
+Testing the asyncio interface on a backend keeping Atoms objects in a list.
+
+"""
+
+import asyncio
+import sys
+import threading
+import time
+
+import pytest
+from ase import Atoms
+
+from abcd import backend
+from abcd.aio import AsyncStructureBox
+
+
+class ListCursor(backend.Cursor):
+    def __init__(self, atoms_list):
+        self.iterator = iter(atoms_list)
+
+    def __next__(self):
+        return next(self.iterator)
+
+    def next(self):
+        return next(self.iterator)
+
+    def count(self):
+        return len(list(self.iterator))
+
+
+class ListBackend(backend.Backend):
+    thread_safe = True
+
+    def __init__(self, delay=0):
+        self.atoms_list = []
+        self.delay = delay
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+        self.threads = set()
+
+    def _slow(self):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            self.threads.add(threading.current_thread())
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+
+    def insert(self, auth_token, atoms, duplicates=None):
+        self._slow()
+        self.atoms_list.extend(atoms)
+        return len(atoms)
+
+    def find(self, auth_token, filter, sort, limit, keys, omit):
+        self._slow()
+        return ListCursor([atoms for atoms in self.atoms_list if filter(atoms)])
+
+    def count(self, auth_token, filter):
+        self._slow()
+        return len([atoms for atoms in self.atoms_list if filter(atoms)])
+
+    def add_keys(self, *args, **kwargs):
+        pass
+
+    def authenticate(self, *args, **kwargs):
+        pass
+
+    def close(self, *args, **kwargs):
+        pass
+
+    def is_open(self, *args, **kwargs):
+        return True
+
+    def list(self, *args, **kwargs):
+        pass
+
+    def open(self, *args, **kwargs):
+        pass
+
+    def remove(self, *args, **kwargs):
+        pass
+
+    def remove_keys(self, *args, **kwargs):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+class EchoBackend(ListBackend):
+    '''Its calls are made by a process writing back the command'''
+    def __init__(self):
+        super(EchoBackend, self).__init__()
+        self.deferred = False
+
+    def remote_calls(self):
+        remote = EchoBackend()
+        remote.deferred = True
+        return remote
+
+    def list(self, auth_token):
+        args = [sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read().upper())']
+        return backend.RemoteCall(args, 'list ' + auth_token,
+                                  lambda stdout, stderr: stdout.decode().split())
+
+
+def hydrogens(n):
+    return [Atoms('H', info={'n': i}) for i in range(n)]
+
+
+def test_overlapping_calls():
+    slow = ListBackend(delay=0.2)
+
+    async def run():
+        async with AsyncStructureBox(slow, max_workers=4) as box:
+            return await asyncio.gather(*[box.count('', lambda atoms: True) for i in range(4)])
+
+    started = time.time()
+    assert asyncio.run(run()) == [0] * 4
+    assert time.time() - started < 0.6
+    assert slow.most_running == 4
+
+
+def test_not_thread_safe():
+    slow = ListBackend(delay=0.05)
+    slow.thread_safe = False
+
+    async def run():
+        box = AsyncStructureBox(slow, max_workers=4)
+        await asyncio.gather(*[box.insert('', hydrogens(2)) for i in range(4)])
+        await box.close()
+
+    asyncio.run(run())
+    assert slow.most_running == 1
+    assert len(slow.threads) == 1
+    assert len(slow.atoms_list) == 8
+
+
+@pytest.mark.parametrize('n', [1, 5, 250])
+def test_cursor(n):
+    async def run():
+        async with AsyncStructureBox(ListBackend()) as box:
+            await box.insert('', hydrogens(n))
+            cursor = await box.find('', lambda atoms: atoms.info['n'] % 2 == 0)
+            found = [atoms.info['n'] async for atoms in cursor]
+            cursor = await box.find('', lambda atoms: True)
+            first = await cursor.__anext__()
+            return found, first.info['n'], await cursor.count()
+
+    found, first, left = asyncio.run(run())
+    assert found == list(range(0, n, 2))
+    assert first == 0
+    assert left == n - 1
+
+
+def test_remote_calls():
+    async def run():
+        box = AsyncStructureBox(EchoBackend())
+        return await asyncio.gather(box.list('a'), box.list('b'))
+
+    assert asyncio.run(run()) == [['LIST', 'A'], ['LIST', 'B']]
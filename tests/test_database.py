@@ -0,0 +1,101 @@
+"""
+Testing the long-lived Database handle against a recording backend.
+
+"""
+
+import pytest
+
+from abcd import backend
+from abcd.database import Database
+
+
+class RecordingBackend(backend.Backend):
+    """Backend which remembers what was called on it."""
+    def __init__(self):
+        self.calls = []
+
+    def __getattribute__(self, name):
+        attr = object.__getattribute__(self, name)
+        if callable(attr) and not name.startswith('_'):
+            object.__getattribute__(self, 'calls').append(name)
+        return attr
+
+    def add_keys(self, auth_token, filter, kvp):
+        return filter
+
+    def authenticate(self, credentials):
+        return 'token'
+
+    def close(self):
+        pass
+
+    def find(self, auth_token, filter, sort, limit, keys, omit_keys):
+        return filter
+
+    def insert(self, auth_token, atoms):
+        pass
+
+    def is_open(self):
+        return True
+
+    def list(self, auth_token):
+        return []
+
+    def open(self):
+        pass
+
+    def remove(self, auth_token, filter, just_one):
+        pass
+
+    def remove_keys(self, auth_token, filter, keys):
+        pass
+
+    def update(self, auth_token, atoms, upsert, replace):
+        pass
+
+
+@pytest.fixture()
+def db():
+    return Database(RecordingBackend())
+
+
+def test_open_once(db):
+    db.find('energy<0')
+    db.find('energy<1')
+    assert db.backend.calls.count('open') == 1
+    assert db.backend.calls.count('authenticate') == 1
+
+
+def test_query_translation(db):
+    assert db.find('energy<0') == {'$and': [{'energy': {'$lt': 0}}]}
+    assert db.find(['energy<0', 'n=1']) == {'$and': [{'energy': {'$lt': 0}},
+                                                     {'n': {'$eq': 1}}]}
+    assert db.find() == {'$and': []}
+
+
+def test_cached_query_is_a_copy(db):
+    db.find('energy<0')['$and'].append('garbage')
+    assert db.find('energy<0') == {'$and': [{'energy': {'$lt': 0}}]}
+
+
+def test_write_commits(db):
+    db.add_keys('energy<0', {'a': 1})
+    assert db.backend.calls[-1] == 'commit'
+
+
+def test_transaction(db):
+    with db:
+        db.add_keys('energy<0', {'a': 1})
+        db.remove_keys('energy<0', ['a'])
+        assert 'commit' not in db.backend.calls
+    assert db.backend.calls.count('begin') == 1
+    assert db.backend.calls.count('commit') == 1
+
+
+def test_transaction_rollback(db):
+    with pytest.raises(ValueError):
+        with db:
+            db.add_keys('energy<0', {'a': 1})
+            raise ValueError()
+    assert 'rollback' in db.backend.calls
+    assert 'commit' not in db.backend.calls
@@ -0,0 +1,49 @@
+"""
+Testing the derived scalar properties.
+
+"""
+
+import numpy as np
+import pytest
+from ase.build import bulk, molecule
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from abcd.derived import derived_keys
+
+
+def test_molecule():
+    atoms = molecule('H2O')
+    forces = np.zeros((3, 3))
+    forces[1] = [0.3, 0.0, 0.4]
+    atoms.calc = SinglePointCalculator(atoms, energy=-1.0, forces=forces)
+    keys = derived_keys(atoms)
+    # Properties of the cell are not defined without periodicity
+    assert sorted(keys) == ['max_force', 'min_distance']
+    assert keys['max_force'] == pytest.approx(0.5)
+    assert keys['min_distance'] == pytest.approx(atoms.get_distance(0, 1))
+
+
+def test_bulk():
+    atoms = bulk('Si', cubic=True)
+    stress = np.array([1.0, 1.0, 1.0, 0.0, 0.0, 1.0])
+    atoms.calc = SinglePointCalculator(atoms, stress=stress)
+    keys = derived_keys(atoms)
+    assert keys['volume_per_atom'] == pytest.approx(5.431**3 / 8, rel=1e-3)
+    assert keys['density'] == pytest.approx(2.33, rel=1e-2)
+    assert keys['min_distance'] == pytest.approx(5.431 * np.sqrt(3) / 4, rel=1e-3)
+    assert keys['stress_norm'] == pytest.approx(np.sqrt(5.0))
+
+
+@pytest.mark.parametrize('atoms', [molecule('CH3OH'), bulk('Cu', cubic=True) * (2, 2, 2),
+                                   bulk('Si', 'diamond', a=5.43)])
+def test_min_distance(atoms):
+    atoms.rattle(0.05, seed=1)
+    distances = atoms.get_all_distances(mic=atoms.pbc.any())
+    expected = distances[np.triu_indices(len(atoms), 1)].min()
+    assert derived_keys(atoms)['min_distance'] == pytest.approx(expected)
+
+
+def test_min_distance_beyond_cutoff():
+    atoms = molecule('H2')
+    atoms.positions = [[0.0, 0.0, 0.0], [0.0, 0.0, 10.0]]
+    assert derived_keys(atoms)['min_distance'] == pytest.approx(10.0)
@@ -0,0 +1,69 @@
+"""
+Testing the in-memory evaluation of filters.
+
+"""
+
+import numpy as np
+from ase.build import bulk, molecule
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from abcd.filtering import filter_atoms, match
+from abcd.query import translate
+
+
+def configurations():
+    water = molecule('H2O')
+    water.info.update({'config_type': 'molecule', 'n': 1})
+    water.calc = SinglePointCalculator(water, energy=-1.0)
+    silicon = bulk('Si', cubic=True)
+    silicon.info.update({'config_type': 'bulk', 'n': 2.5})
+    methanol = molecule('CH3OH')
+    methanol.info['config_type'] = 'molecule'
+    return [water, silicon, methanol]
+
+
+def selected(query):
+    return match(translate(query), configurations()).tolist()
+
+
+def test_comparisons():
+    assert selected(['n>=1', 'n<2']) == [True, False, False]
+    assert selected(['config_type=bulk,other']) == [False, True, False]
+    assert selected(['energy<0']) == [True, False, False]
+    assert selected(['formula_reduced=Si']) == [False, True, False]
+
+
+def test_missing_keys():
+    # As in ASEdb, != doesn't match configurations without the key
+    assert selected(['n!=1']) == [False, True, False]
+    assert selected(['n!=1,2.5']) == [False, False, False]
+    assert match({'$or': [{'n': {'$ne': 1}}]}, configurations()).tolist() == [False, True, False]
+    assert match({'n': {'$exists': False}}, configurations()).tolist() == [False, False, True]
+
+
+def test_mixed_types():
+    atoms_list = configurations()
+    atoms_list[2].info['n'] = 'foo'
+    assert match(translate(['n!=1']), atoms_list).tolist() == [False, True, False]
+    assert match(translate(['n!=1,foo']), atoms_list).tolist() == [False, True, False]
+    assert match(translate(['n!=1,bar']), atoms_list).tolist() == [False, True, True]
+
+
+def test_elements():
+    assert selected(['elements~C,Si']) == [False, True, True]
+    assert selected(['elements!=C']) == [True, True, False]
+    assert selected(['elements=H,O']) == [True, False, False]
+    assert selected(['n_H>2']) == [False, False, True]
+    assert selected(['n_H<1']) == [False, True, False]
+
+
+def test_logical_operators():
+    atoms_list = configurations()
+    assert match({'$or': [{'n': 1}, {'config_type': 'bulk'}]}, atoms_list).tolist() == [True, True, False]
+    assert match({'$nor': [{'n': 1}, {'config_type': 'bulk'}]}, atoms_list).tolist() == [False, False, True]
+
+
+def test_filter_atoms_in_batches():
+    atoms_list = configurations() * 5
+    atoms_it = filter_atoms(iter(atoms_list), translate(['config_type=molecule']), batch_size=4)
+    assert [atoms.get_chemical_formula() for atoms in atoms_it] == ['H2O', 'CH4O'] * 5
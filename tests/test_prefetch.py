@@ -0,0 +1,78 @@
+"""
+Testing the cursor reading ahead in a background thread.
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from abcd.prefetch import PrefetchCursor
+from abcd.shell import ListCursor
+
+
+class SlowCursor(ListCursor):
+    '''Takes delay seconds to get each item and records the thread doing it'''
+    def __init__(self, items, delay=0, fail_at=None):
+        super(SlowCursor, self).__init__(items)
+        self.delay = delay
+        self.fail_at = fail_at
+        self.read = 0
+        self.threads = set()
+
+    def __next__(self):
+        self.threads.add(threading.current_thread())
+        if self.read == self.fail_at:
+            raise ValueError('Cannot decode row {}'.format(self.read))
+        item = super(SlowCursor, self).__next__()
+        time.sleep(self.delay)
+        self.read += 1
+        return item
+
+    def next(self):
+        return self.__next__()
+
+
+@pytest.mark.parametrize('size', [1, 3, 100])
+def test_order(size):
+    cursor = SlowCursor(list(range(50)))
+    assert list(PrefetchCursor(cursor, size)) == list(range(50))
+    assert threading.current_thread() not in cursor.threads
+
+
+def test_count():
+    prefetched = PrefetchCursor(SlowCursor(list(range(10))), 4)
+    assert next(prefetched) == 0
+    assert prefetched.count() == 9
+    assert list(prefetched) == []
+
+
+def test_error():
+    prefetched = PrefetchCursor(SlowCursor(list(range(10)), fail_at=6), 2)
+    items = []
+    with pytest.raises(ValueError) as excinfo:
+        for item in prefetched:
+            items.append(item)
+    assert items == list(range(6))
+    assert 'row 6' in str(excinfo.value)
+
+
+def test_close():
+    cursor = SlowCursor(list(range(1000)))
+    prefetched = PrefetchCursor(cursor, 5)
+    assert next(prefetched) == 0
+    prefetched.close()
+    assert not prefetched.thread.is_alive()
+    # It stopped at most a queue ahead
+    assert cursor.read <= 7
+    assert list(prefetched) == []
+
+
+def test_overlap():
+    n, delay = 20, 0.02
+    started = time.time()
+    for item in PrefetchCursor(SlowCursor(list(range(n)), delay), 4):
+        time.sleep(delay)
+    # Reading and consuming serially would take 2 * n * delay
+    assert time.time() - started < 1.5 * n * delay
@@ -0,0 +1,45 @@
+"""
+Testing the translation of queries to the MongoDB format.
+
+"""
+
+import pytest
+
+from abcd.query import QueryError, translate
+
+
+def test_flat_queries():
+    assert translate(['energy<0', 'user=alice,bob']) == {
+        '$and': [{'energy': {'$lt': 0}}, {'user': {'$in': ['alice', 'bob']}}]}
+    assert translate(['energy<0 n!=1']) == {
+        '$and': [{'energy': {'$lt': 0}}, {'n': {'$ne': 1}}]}
+    # A single query can have spaces in its value
+    assert translate(['name=a b']) == {'$and': [{'name': {'$eq': 'a b'}}]}
+
+
+def test_expressions():
+    assert translate(['(a=1 & b=2) | c=3']) == {'$and': [{'$or': [
+        {'$and': [{'a': {'$eq': 1}}, {'b': {'$eq': 2}}]}, {'c': {'$eq': 3}}]}]}
+    assert translate(['!elements~H n!=2']) == {'$and': [
+        {'$nor': [{'numbers': {'$in': [1]}}]}, {'n': {'$ne': 2}}]}
+    assert translate(['a=1 | b=2 & c=3', 'd=4']) == {'$and': [
+        {'$or': [{'a': {'$eq': 1}}, {'$and': [{'b': {'$eq': 2}}, {'c': {'$eq': 3}}]}]},
+        {'d': {'$eq': 4}}]}
+    assert translate(['name="a | b" | x=1']) == {'$and': [{'$or': [
+        {'name': {'$eq': 'a | b'}}, {'x': {'$eq': 1}}]}]}
+
+
+@pytest.mark.parametrize('query', ['(a=1 | b=2', 'a=1 |', 'a=1 )', '!'])
+def test_invalid_expressions(query):
+    with pytest.raises(QueryError):
+        translate([query])
+
+
+
+@pytest.mark.parametrize('query, value', [('name=a(b)', 'a(b)'), ('name=(a)', '(a)'),
+                                          ('name=foo!', 'foo!'), ('name=a|b', 'a|b'),
+                                          ('name=R&D', 'R&D')])
+def test_values_with_symbols(query, value):
+    # Queries which are not combined don't need quotes
+    assert translate([query]) == {'$and': [{'name': {'$eq': value}}]}
+    assert translate([query + ' n!=1']) == {'$and': [{'name': {'$eq': value}}, {'n': {'$ne': 1}}]}
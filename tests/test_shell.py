@@ -0,0 +1,171 @@
+"""
+Testing the caches kept by the interactive shell, and the grouping and
+running of batch commands.
+
+"""
+
+from argparse import Namespace
+
+import pytest
+from ase.build import molecule
+
+from abcd import backend, results
+from abcd.query import translate
+from abcd.shell import ListCursor, Session, group_commands, merge_commands
+
+
+class CountingBackend(backend.Backend):
+    """Backend which counts finds and commits."""
+    def __init__(self, found=('atoms1', 'atoms2')):
+        self.finds = 0
+        self.commits = 0
+        self.found = found
+        # Filter and argument of each add_keys and remove_keys
+        self.writes = []
+
+    def add_keys(self, auth_token, filter, kvp):
+        self.writes.append((filter, kvp))
+        return results.AddKvpResult([], len(kvp), msg='Added')
+
+    def authenticate(self, credentials):
+        return 'token'
+
+    def close(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def find(self, auth_token, filter, sort, limit, keys, omit_keys):
+        self.finds += 1
+        return ListCursor(list(self.found))
+
+    def insert(self, auth_token, atoms):
+        pass
+
+    def is_open(self):
+        return True
+
+    def list(self, auth_token):
+        return []
+
+    def open(self):
+        pass
+
+    def remove(self, auth_token, filter, just_one):
+        pass
+
+    def remove_keys(self, auth_token, filter, keys):
+        self.writes.append((filter, keys))
+        return results.RemoveKeysResult([], len(keys), msg='Removed')
+
+    def update(self, auth_token, atoms, upsert, replace):
+        pass
+
+
+def test_find_is_cached():
+    session = Session(CountingBackend())
+    query = session.translate(['energy<0'])
+    assert list(session.box.find('token', query)) == ['atoms1', 'atoms2']
+    assert session.box.find('token', query).count() == 2
+    assert session.box.backend.finds == 1
+    session.box.find('token', query, limit=1)
+    assert session.box.backend.finds == 2
+
+
+def test_cached_atoms_are_copies():
+    session = Session(CountingBackend([molecule('H2O')]))
+    query = session.translate(['energy<0'])
+    first = next(session.box.find('token', query))
+    first.info['changed'] = True
+    assert 'changed' not in next(session.box.find('token', query)).info
+    assert session.box.backend.finds == 1
+
+
+def test_large_results_are_not_cached():
+    found = ['atoms{}'.format(i) for i in range(5)]
+    session = Session(CountingBackend(found))
+    session.box.page_size = 4
+    query = session.translate([])
+    assert list(session.box.find('token', query)) == found
+    assert session.box.find('token', query).count() == 5
+    assert session.box.backend.finds == 2
+
+
+def test_no_query():
+    session = Session(CountingBackend())
+    # The command line's default when no query is given
+    assert session.translate('') == session.translate([]) == {'$and': []}
+
+
+def test_write_clears_cache():
+    session = Session(CountingBackend())
+    query = session.translate(['energy<0'])
+    session.box.find('token', query)
+    session.box.add_keys('token', query, {'a': 1})
+    assert session.box.backend.commits == 1
+    session.box.find('token', query)
+    assert session.box.backend.finds == 2
+
+
+def command(query, **kwargs):
+    args = dict.fromkeys(['remove', 'write_to_file', 'extract_original_files',
+                          'store', 'update', 'add_keys', 'remove_keys',
+                          'create_index', 'drop_index', 'list_indexes', 'group_by', 'stats',
+                          'count', 'ids', 'show', 'long', 'list'])
+    args.update(kwargs)
+    return Namespace(query=query, **args)
+
+
+def test_group_commands():
+    commands = [command(['a=1'], add_keys='x=1'),
+                command(['a=1'], add_keys='y=2'),
+                command(['a=2'], add_keys='z=3'),
+                command(['a=2'], remove_keys='z'),
+                command(['a=2'], remove_keys='w'),
+                command(['a=2'], count=True),
+                command(['a=2'], count=True)]
+    assert group_commands(commands) == [[0, 1], [2], [3, 4], [5], [6]]
+
+
+def test_group_commands_writing_the_query_keys():
+    # The first command changes which configurations the second selects
+    commands = [command(['a=1'], add_keys='a=2'),
+                command(['a=1'], add_keys='b=3'),
+                command(['a=1'], remove_keys='b'),
+                command(['a=1'], remove_keys='a')]
+    assert group_commands(commands) == [[0], [1], [2], [3]]
+
+
+def test_group_commands_with_other_options():
+    commands = [command(['a=1'], add_keys='x=1'),
+                command(['a=1'], add_keys='y=2', verbose=1)]
+    assert group_commands(commands) == [[0], [1]]
+
+
+def test_merge_commands():
+    merged = merge_commands([command(['a=1'], add_keys='x=1'),
+                             command(['a=1'], add_keys='y=2,z=3')])
+    assert merged.add_keys == 'x=1,y=2,z=3'
+    assert merged.query == ['a=1']
+
+
+def test_batch_without_query(tmpdir, monkeypatch, capsys):
+    try:
+        from abcd import cli
+    except ImportError as e:
+        # e.g. an ASE the command line tool doesn't work with
+        pytest.skip(str(e))
+    counting = CountingBackend()
+    monkeypatch.setattr(cli, 'init_backend', lambda args: counting)
+    commands = tmpdir.join('commands')
+    commands.write('--add-keys a=1\n--add-keys b=2\n--remove-keys c\n--count\n'
+                   "'energy<0' --add-keys d=3\n")
+    parser = cli.make_parser()
+    args = parser.parse_args(['db', '--batch', str(commands)])
+    cli.batch(parser, args, 1)
+    everything = {'$and': []}
+    assert counting.writes == [(everything, {'a': 1, 'b': 2}), (everything, ['c']),
+                               (translate(['energy<0']), {'d': 3})]
+    assert counting.commits == 1
+    assert 'Found: 2' in capsys.readouterr().out
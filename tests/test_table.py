@@ -2,7 +2,7 @@
 Simple unit tests for abcd.table
 """
 
-from abcd.table import trim
+from abcd.table import print_aggregate, print_key_statistics, trim
 
 class TestTrim:
 
@@ -31,3 +31,29 @@ class TestTrim:
     def test_integer_cut(self):
         assert trim(12345678, 5) == '12345..'
 
+
+
+def test_print_key_statistics(capsys):
+    stats = {'rows': 3, 'keys': {
+        'energy': {'count': 3, 'type': 'number', 'min': -2.0, 'max': 1.5, 'distinct': None},
+        'split': {'count': 1, 'type': 'text', 'min': None, 'max': None, 'distinct': None}}}
+    print_key_statistics(stats, show_keys=None)
+    intersection, union = capsys.readouterr().out.split('UNION')
+    assert 'ROWS: 3' in intersection
+    assert 'energy (3)' in intersection and 'split' not in intersection
+    assert 'split (1)' in union and '...' in union and 'None' not in union
+
+
+def test_print_aggregate(capsys):
+    entries = [
+        {'group': {'config_type': 'bulk'}, 'count': 2,
+         'stats': {'energy': {'count': 2, 'min': -2.0, 'max': -1.0, 'mean': -1.5,
+                              'histogram': {'edges': [-2.0, -1.5, -1.0], 'counts': [1, 1]}}}},
+        {'group': {'config_type': 'molecule'}, 'count': 1,
+         'stats': {'energy': {'count': 0, 'min': None, 'max': None, 'mean': None,
+                              'histogram': {'edges': [-2.0, -1.5, -1.0], 'counts': [0, 0]}}}}]
+    print_aggregate(entries, ['config_type'], ['energy'])
+    out = capsys.readouterr().out
+    assert 'energy (mean)' in out and '-1.5' in out
+    assert 'config_type=bulk: 1 1' in out
+    assert 'config_type=molecule: 0 0' in out
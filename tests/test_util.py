@@ -0,0 +1,42 @@
+"""
+Testing the helper functions in abcd.util.
+
+"""
+
+import numpy as np
+from ase.build import molecule
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from abcd.util import content_uid, is_number_string, random_uid
+
+
+def test_content_uid_is_deterministic():
+    atoms = molecule('H2O')
+    assert content_uid(atoms) == content_uid(molecule('H2O'))
+    assert len(content_uid(atoms)) == len(random_uid()) == 15
+
+
+def test_content_uid_ignores_rounding_noise():
+    atoms = molecule('H2O')
+    noisy = atoms.copy()
+    noisy.positions += 1e-9
+    assert content_uid(atoms) == content_uid(noisy)
+    noisy.positions += 1e-3
+    assert content_uid(atoms) != content_uid(noisy)
+
+
+def test_content_uid_depends_on_results():
+    atoms = molecule('H2O')
+    atoms.calc = SinglePointCalculator(atoms, energy=-1.0,
+                                       forces=np.zeros((len(atoms), 3)))
+    other = molecule('H2O')
+    other.calc = SinglePointCalculator(other, energy=-2.0,
+                                       forces=np.zeros((len(other), 3)))
+    assert content_uid(atoms) != content_uid(other)
+    assert content_uid(atoms) != content_uid(molecule('H2O'))
+
+
+def test_uids_are_not_numbers():
+    # ASEdb refuses strings like "123" or "6e81" as text values
+    assert is_number_string('6e8103191649531')
+    assert not any(is_number_string(random_uid()) for _ in range(2000))